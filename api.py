@@ -4,15 +4,324 @@ import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 import os
-from fastapi import FastAPI, HTTPException
-from typing import Optional
+import re
+import shutil
+import tempfile
+import asyncio
+import threading
+import uuid
+import zipfile
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from typing import List, Optional
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
 from inference.inference import Inference
+from inference.jobs import JobStore, JobWorkerPool, JOB_COMPLETED
+from inference.stream_session import TTSStreamSession
+from inference.admission import AdmissionController, AdmissionRejected
+from inference.cost_model import count_phones
+from inference.metrics import (REGISTRY, REQUESTS_TOTAL, TIME_TO_FIRST_BYTE_SECONDS, REAL_TIME_FACTOR)
+from inference.tracing import CURRENT_TRACE, start_trace, finish_trace, stage
+from inference.profiling import PROFILER
+from inference.memory import accountant_from_env, evict_oldest, module_bytes, object_bytes
+from sovits.weights import LOAD_SECONDS
+from inference.autotune import load_profile
+from inference.encoders import (FORMATS, StreamEncoder, available_encoders, check_available, content_type, encode,
+                                is_encoded, negotiate)
+from sovits.output import WAV_HEADER_SIZE
+from sovits.resample import check_rate
+
+# Host-tuned thread counts, concurrency and batch sizes (python -m inference.autotune) become
+# defaults for the environment variables read below; explicitly set variables win
+AUTOTUNE_PROFILE = load_profile(os.getenv("TTS_AUTOTUNE_PROFILE", "logs/autotune.json"))
 
 TTS_PORT=8020
+BATCH_OUTPUT_DIR = os.getenv("TTS_BATCH_DIR", "logs/tts_batch")
+# Seconds a "urls" batch stays downloadable; older batch directories are deleted
+BATCH_TTL = float(os.getenv("TTS_BATCH_TTL", "3600"))
+JOB_DB_PATH = os.getenv("TTS_JOB_DB", "logs/jobs.db")
+JOB_OUTPUT_DIR = os.getenv("TTS_JOB_DIR", "logs/jobs")
+JOB_WORKERS = int(os.getenv("TTS_JOB_WORKERS", "2"))
+ADMIN_TOKEN = os.getenv("TTS_ADMIN_TOKEN")
+MEMORY_INTERVAL = float(os.getenv("TTS_MEMORY_INTERVAL", "60"))
 app = FastAPI()
+job_pool = None
+memory = accountant_from_env()
+admission = AdmissionController(
+    max_inflight_sentences=int(os.getenv("TTS_MAX_INFLIGHT_SENTENCES", "64")),
+    max_inflight_audio_seconds=float(os.getenv("TTS_MAX_INFLIGHT_AUDIO_SECONDS", "600")),
+    max_queue=int(os.getenv("TTS_MAX_QUEUE", "32")),
+    default_deadline=float(os.getenv("TTS_QUEUE_DEADLINE", "30")),
+)
+
+
+async def admit(endpoint, texts, speed, deadline):
+    sentences, audio_seconds, service_seconds = 0, 0.0, 0.0
+    for text in texts:
+        # g2p takes milliseconds per sentence, too long to run on the event loop
+        estimate = await asyncio.to_thread(tts.estimate_cost, text, speed)
+        sentences += max(1, estimate.sentences)
+        audio_seconds += estimate.audio_seconds
+        service_seconds += estimate.total_seconds
+    try:
+        with stage("admission_wait"):
+            return await admission.acquire(sentences, audio_seconds, deadline, service_seconds)
+    except AdmissionRejected as e:
+        REQUESTS_TOTAL.labels(endpoint, "rejected").inc()
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+def finish_request(trace):
+    finish_trace(trace)
+    PROFILER.request_finished()
+
+
+def check_admin(request):
+    if ADMIN_TOKEN and request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def run_until_disconnected(request, coro, poll_interval=0.5):
+    # Cancels coro (and the LLM completions it is waiting on) once the client goes away
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logging.info("client disconnected, cancelling request")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def check_priority(priority):
+    try:
+        tts.llm_scheduler.check_lane(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def negotiate_format(media_type, accept=None):
+    try:
+        media_type = negotiate(media_type, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        check_available(media_type)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return media_type
+
+
+def start_encoder(media_type, sample_rate=None):
+    """The stream's encoder for a compressed media_type, or None."""
+    if not is_encoded(media_type):
+        return None
+    processor = tts.sovits_processor
+    return StreamEncoder(media_type, sample_rate or processor.sampling_rate, processor.is_int32)
+
+
+def check_sample_rate(sample_rate):
+    if sample_rate is not None:
+        try:
+            check_rate(sample_rate)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def audio_seconds_of(num_bytes, sample_rate=None):
+    processor = tts.sovits_processor
+    return num_bytes / ((sample_rate or processor.sampling_rate) * (4 if processor.is_int32 else 2))
+
+
+def observe_request(endpoint, started_at, num_bytes, sample_rate=None):
+    REQUESTS_TOTAL.labels(endpoint, "ok").inc()
+    audio_seconds = audio_seconds_of(num_bytes, sample_rate)
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe((time.perf_counter() - started_at) / audio_seconds)
+
+
+def encode_items(wavs, media_type, sample_rate=None):
+    """Batch items as media_type; each compressed item is encoded in one pass."""
+    if media_type == "wav":
+        return wavs
+    processor = tts.sovits_processor
+    pcms = [memoryview(wav)[WAV_HEADER_SIZE:] for wav in wavs]
+    if media_type == "pcm":
+        return pcms
+    return [encode(pcm, media_type, sample_rate or processor.sampling_rate, processor.is_int32) for pcm in pcms]
+
+
+async def stream_until_disconnected(request, wavs, ticket, cancel_event, priority, trace, encoder=None,
+                                    sample_rate=None):
+    # Keeps the admission budget held until the streamed audio is fully produced,
+    # and stops the SoVITS generator at the next segment once the client disconnects.
+    # Compressed formats feed the PCM chunks through one encoder for the whole stream.
+    CURRENT_TRACE.set(trace)
+    endpoint, started_at = trace.endpoint, trace.started_at
+    num_bytes = 0
+    first_byte = True
+    try:
+        while True:
+            if await request.is_disconnected():
+                logging.info("client disconnected, stopping synthesis")
+                REQUESTS_TOTAL.labels(endpoint, "disconnected").inc()
+                break
+            chunk = await tts.next_segment(wavs, priority, ticket.service_seconds, sample_rate)
+            if chunk is None:
+                if encoder is not None:
+                    with stage("encoding"):
+                        tail = await asyncio.to_thread(encoder.close)
+                    if tail:
+                        yield tail
+                observe_request(endpoint, started_at, num_bytes, sample_rate)
+                break
+            # num_bytes counts PCM, so the real-time factor is the same for every format
+            num_bytes += len(chunk)
+            if encoder is not None:
+                with stage("encoding"):
+                    chunk = await asyncio.to_thread(encoder.write, chunk)
+                if not chunk:
+                    continue
+            if first_byte:
+                TIME_TO_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started_at)
+                first_byte = False
+            yield chunk
+    finally:
+        if encoder is not None:
+            encoder.abort()
+        cancel_event.set()
+        admission.release(ticket)
+        finish_request(trace)
+
+
+def register_runtime_metrics():
+    # Values already tracked by the admission controller, schedulers and caches are
+    # read at scrape time, so they cost nothing on the request path
+    processor = tts.sovits_processor
+    REGISTRY.callback(
+        "tts_cache_hits_total", "Cache hits by cache.", "counter", ["cache"],
+        lambda: [((name,), value) for name, value in processor.cache_hits.items()]
+                + [(("phones",), count_phones.cache_info().hits)])
+    REGISTRY.callback(
+        "tts_cache_misses_total", "Cache misses by cache.", "counter", ["cache"],
+        lambda: [((name,), value) for name, value in processor.cache_misses.items()]
+                + [(("phones",), count_phones.cache_info().misses)])
+    REGISTRY.callback(
+        "tts_queue_depth", "Waiting requests or sentences by queue and lane.", "gauge", ["queue", "lane"],
+        lambda: [(("admission", ""), len(admission.waiters))]
+                + [((scheduler.name, lane), stats.queued)
+                   for scheduler in (tts.llm_scheduler, tts.sovits_scheduler)
+                   for lane, stats in scheduler.stats.items()])
+    REGISTRY.callback(
+        "tts_model_load_seconds", "Cold-start load time of each model.", "gauge", ["model"],
+        lambda: [((name,), seconds) for name, seconds in LOAD_SECONDS.items()])
+    REGISTRY.callback(
+        "tts_inflight_requests", "Admitted requests that have not finished.", "gauge", [],
+        lambda: [((), admission.inflight_requests)])
+    REGISTRY.callback(
+        "tts_inflight_audio_seconds", "Predicted audio seconds of admitted requests.", "gauge", [],
+        lambda: [((), admission.inflight_audio_seconds)])
+
+
+def register_memory_accounting():
+    processor = tts.sovits_processor
+    for spk, speaker in processor.speaker_list.items():
+        memory.register_model(f"sovits.{spk}", lambda m=speaker.sovits.vq_model: module_bytes(m))
+    memory.register_model("hubert", lambda: module_bytes(processor.ssl_model))
+    llm = getattr(tts.llama, "llama", None)
+    if llm is not None:
+        # vLLM weights and KV cache live in the vLLM server process and are not counted here
+        memory.register_model("llama", lambda: module_bytes(llm))
+        memory.register_inflight("llm_kv_cache", tts.llama.kv_cache_bytes)
+    # Segments held by "close" mode responses until their WAV header can be written
+    processor.buffer_accountant = memory
+    memory.register_cache("spec", lambda: object_bytes(processor.spec_cache),
+                          lambda fraction: evict_oldest(processor.spec_cache, fraction))
+    memory.register_cache("audio_token", lambda: object_bytes(processor.audio_token_cache),
+                          lambda fraction: evict_oldest(processor.audio_token_cache, fraction))
+    memory.register_cache("sentences", lambda: object_bytes(tts.sentence_cache),
+                          lambda fraction: evict_oldest(tts.sentence_cache, fraction))
+    REGISTRY.callback(
+        "tts_memory_bytes", "Bytes held by each model, cache and in-flight buffer.", "gauge", ["component"],
+        lambda: [((f"{section}.{name}",), value)
+                 for section, values in memory.last_snapshot.items() if section in ("models", "caches", "inflight")
+                 for name, value in values.items() if value is not None])
+
+
+async def memory_monitor():
+    while True:
+        snapshot = await asyncio.to_thread(memory.snapshot)
+        # Eviction runs gc.collect() and torch.cuda.empty_cache(), which must not block requests
+        await asyncio.to_thread(memory.enforce, snapshot)
+        logging.info(memory.log_line(snapshot))
+        await asyncio.sleep(MEMORY_INTERVAL)
+
+
+def remove_expired_batches():
+    if not os.path.isdir(BATCH_OUTPUT_DIR):
+        return 0
+    expires = time.time() - BATCH_TTL
+    removed = 0
+    # Batch directories of "urls" responses, and zip files left behind by interrupted downloads
+    for entry in os.scandir(BATCH_OUTPUT_DIR):
+        if entry.stat().st_mtime >= expires:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        removed += 1
+    return removed
+
+
+async def batch_cleaner():
+    while True:
+        removed = await asyncio.to_thread(remove_expired_batches)
+        if removed:
+            logging.info(f"removed {removed} expired batch outputs")
+        await asyncio.sleep(min(BATCH_TTL, 600))
+
+
+@app.on_event("startup")
+async def start_job_pool():
+    global job_pool
+    register_runtime_metrics()
+    register_memory_accounting()
+    # Probes ffmpeg once, so format checks on the request path are a cached lookup
+    logging.info(f"ffmpeg audio encoders: {len(await asyncio.to_thread(available_encoders))}")
+    if MEMORY_INTERVAL > 0:
+        app.state.memory_monitor = asyncio.create_task(memory_monitor())
+    if BATCH_TTL > 0:
+        app.state.batch_cleaner = asyncio.create_task(batch_cleaner())
+    job_pool = JobWorkerPool(tts, JobStore(JOB_DB_PATH, JOB_OUTPUT_DIR), num_workers=JOB_WORKERS)
+    job_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_pool():
+    for name in ("memory_monitor", "batch_cleaner"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if job_pool is not None:
+        await job_pool.stop()
 
 
 class TTSRequest(BaseModel):
@@ -23,9 +332,20 @@ class TTSRequest(BaseModel):
     repetition_penalty: Optional[float]=1.0
     speed: Optional[float]=1.0
     scaling_factor: Optional[float]=1.0
+    deadline: Optional[float]=None  # max seconds to wait for admission
+    priority: Optional[str]="interactive"  # scheduling lane, see TTS_LANE_WEIGHTS
+    media_type: Optional[str]=None  # wav, pcm, ogg (opus), aac or mp3; defaults to the Accept header, then wav
+    sample_rate: Optional[int]=None  # output rate, see sovits.resample.SAMPLE_RATES; defaults to the model rate
     
 @app.post("/get_tts")
-async def get_tts(request_data: TTSRequest):
+async def get_tts(request_data: TTSRequest, request: Request):
+    trace = start_trace(request.headers.get("x-request-id"), "get_tts")
+    check_priority(request_data.priority)
+    media_type = negotiate_format(request_data.media_type, request.headers.get("accept"))
+    check_sample_rate(request_data.sample_rate)
+    ticket = await admit("get_tts", [request_data.text], request_data.speed, request_data.deadline)
+    cancel_event = threading.Event()
+    encoder = None
     try:
         logging.info(f"req: {request_data}")
         ref_wav_path = request_data.ref_wav_path
@@ -36,11 +356,29 @@ async def get_tts(request_data: TTSRequest):
         speed = request_data.speed
         scaling_factor = request_data.scaling_factor
         
-        tts_response = await tts.generate(ref_wav_path, prompt_text, text, temperature=temperature,
-                                          repetition_penalty=repetition_penalty, speed=speed,
-                                          scaling_factor=scaling_factor)
-        return StreamingResponse(tts_response, media_type="audio/wav")
+        tts_response = await run_until_disconnected(request, tts.generate(
+            ref_wav_path, prompt_text, text, temperature=temperature,
+            repetition_penalty=repetition_penalty, speed=speed,
+            scaling_factor=scaling_factor, cancel_event=cancel_event, priority=request_data.priority,
+            media_type="wav" if media_type == "wav" else "pcm", sample_rate=request_data.sample_rate))
+        # Started before the response, so a failing encoder is an error status, not an empty 200
+        encoder = await asyncio.to_thread(start_encoder, media_type, request_data.sample_rate)
+        # Spans up to the LLM are in the headers; decode and pack spans go to the trace log
+        return StreamingResponse(stream_until_disconnected(request, tts_response, ticket, cancel_event,
+                                                           request_data.priority, trace, encoder,
+                                                           request_data.sample_rate),
+                                 media_type=content_type(media_type), headers=trace.headers())
+    except ClientDisconnected:
+        admission.release(ticket)
+        finish_request(trace)
+        REQUESTS_TOTAL.labels("get_tts", "disconnected").inc()
+        raise HTTPException(status_code=499, detail="Client disconnected")
     except Exception as e:
+        if encoder is not None:
+            encoder.abort()
+        admission.release(ticket)
+        finish_request(trace)
+        REQUESTS_TOTAL.labels("get_tts", "error").inc()
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -53,9 +391,14 @@ class TimestampRequest(BaseModel):
     repetition_penalty: Optional[float] = 1.0
     speed: Optional[float] = 1.0
     scaling_factor: Optional[float] = 1.0
+    deadline: Optional[float] = None
+    priority: Optional[str] = "interactive"
 
 @app.post("/get_tts_with_timestamps")
-async def get_tts_with_timestamps(request_data: TimestampRequest):
+async def get_tts_with_timestamps(request_data: TimestampRequest, request: Request, response: Response):
+    trace = start_trace(request.headers.get("x-request-id"), "get_tts_with_timestamps")
+    check_priority(request_data.priority)
+    ticket = await admit("get_tts_with_timestamps", [request_data.text], request_data.speed, request_data.deadline)
     try:
         logging.info(f"req: {request_data}")
         ref_wav_path = request_data.ref_wav_path
@@ -66,15 +409,357 @@ async def get_tts_with_timestamps(request_data: TimestampRequest):
         speed = request_data.speed
         scaling_factor = request_data.scaling_factor
 
-        tts_response, timestamps = await tts.generate_with_timestamps(ref_wav_path, prompt_text, text, temperature=temperature,
-                                                                      repetition_penalty=repetition_penalty, speed=speed,
-                                                                      scaling_factor=scaling_factor)
+        tts_response, timestamps = await run_until_disconnected(request, tts.generate_with_timestamps(
+            ref_wav_path, prompt_text, text, temperature=temperature,
+            repetition_penalty=repetition_penalty, speed=speed,
+            scaling_factor=scaling_factor, priority=request_data.priority))
+        response.headers.update(trace.headers())
         return {"audio": StreamingResponse(tts_response, media_type="audio/wav"), "timestamps": timestamps}
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(ticket)
+        finish_request(trace)
+
+class TTSBatchItem(BaseModel):
+    ref_wav_path: str
+    prompt_text: str
+    text: str
+
+class TTSBatchRequest(BaseModel):
+    items: List[TTSBatchItem]
+    temperature: Optional[float] = 1.0
+    repetition_penalty: Optional[float] = 1.0
+    speed: Optional[float] = 1.0
+    scaling_factor: Optional[float] = 1.0
+    response_format: Optional[str] = "zip"  # "zip" or "urls"
+    deadline: Optional[float] = None
+    priority: Optional[str] = "bulk"
+    sample_rate: Optional[int] = None
+    media_type: Optional[str] = None  # format of every item, as in /get_tts; defaults to wav
+
+def write_zip(items, media_type):
+    """
+    Writes items as 0.<media_type>, 1.<media_type>, ... into a temporary zip file.
+    :return: path of the file; the caller deletes it
+    """
+    os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".zip", dir=BATCH_OUTPUT_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as zf:
+            for i, item in enumerate(items):
+                zf.writestr(f"{i}.{media_type}", item)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+@app.post("/get_tts_batch")
+async def get_tts_batch(request_data: TTSBatchRequest, request: Request, response: Response):
+    if request_data.response_format not in ("zip", "urls"):
+        raise HTTPException(status_code=400, detail=f"Invalid response_format: {request_data.response_format}")
+    if not request_data.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    check_priority(request_data.priority)
+    check_sample_rate(request_data.sample_rate)
+    # Accept describes the zip / JSON envelope here, so only media_type selects the item format
+    media_type = negotiate_format(request_data.media_type)
+    trace = start_trace(request.headers.get("x-request-id"), "get_tts_batch")
+    ticket = await admit("get_tts_batch", [item.text for item in request_data.items], request_data.speed,
+                         request_data.deadline)
+    try:
+        logging.info(f"batch req: {len(request_data.items)} items")
+        items = [item.dict() for item in request_data.items]
+        wavs = await run_until_disconnected(request, tts.generate_batch(
+            items, temperature=request_data.temperature,
+            repetition_penalty=request_data.repetition_penalty,
+            speed=request_data.speed, scaling_factor=request_data.scaling_factor,
+            priority=request_data.priority, sample_rate=request_data.sample_rate))
+        batch_bytes = sum(len(wav) for wav in wavs)
+        observe_request("get_tts_batch", trace.started_at, batch_bytes, request_data.sample_rate)
+        if media_type != "wav":
+            with stage("encoding"):
+                wavs = await asyncio.to_thread(encode_items, wavs, media_type, request_data.sample_rate)
+            batch_bytes = sum(len(wav) for wav in wavs)
+    except ClientDisconnected:
+        REQUESTS_TOTAL.labels("get_tts_batch", "disconnected").inc()
+        finish_request(trace)
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except Exception as e:
+        REQUESTS_TOTAL.labels("get_tts_batch", "error").inc()
+        finish_request(trace)
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(ticket)
+
+    batch_id = uuid.uuid4().hex
+    if request_data.response_format == "urls":
+        memory.add_buffer("batch", batch_bytes)
+        try:
+            with stage("encoding"):
+                batch_dir = os.path.join(BATCH_OUTPUT_DIR, batch_id)
+                os.makedirs(batch_dir, exist_ok=True)
+                for i, wav in enumerate(wavs):
+                    with open(os.path.join(batch_dir, f"{i}.{media_type}"), "wb") as f:
+                        f.write(wav)
+        finally:
+            memory.release_buffer("batch", batch_bytes)
+        response.headers.update(trace.headers())
+        finish_request(trace)
+        return {"batch_id": batch_id, "urls": [f"/get_tts_batch/{batch_id}/{i}" for i in range(len(wavs))]}
+
+    # The zip is written to a temporary file, so only the WAVs are held in memory while it is
+    # built and nothing once it is written; the file is deleted after the response is sent
+    memory.add_buffer("batch", batch_bytes)
+    try:
+        with stage("encoding"):
+            zip_path = await asyncio.to_thread(write_zip, wavs, media_type)
+    finally:
+        memory.release_buffer("batch", batch_bytes)
+    del wavs
+    finish_request(trace)
+    return FileResponse(zip_path, media_type="application/zip", filename=f"{batch_id}.zip",
+                        headers=trace.headers(), background=BackgroundTask(os.remove, zip_path))
+
+@app.get("/get_tts_batch/{batch_id}/{index}")
+async def get_tts_batch_item(batch_id: str, index: int):
+    if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+        raise HTTPException(status_code=404, detail="Unknown batch")
+    # Items are stored as <index>.<media_type>
+    batch_dir = os.path.join(BATCH_OUTPUT_DIR, batch_id)
+    names = os.listdir(batch_dir) if os.path.isdir(batch_dir) else []
+    name = next((n for n in names if n.split(".")[0] == str(index) and n.split(".")[-1] in FORMATS), None)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Unknown batch item")
+    return FileResponse(os.path.join(batch_dir, name), media_type=content_type(name.split(".")[-1]))
+
+def job_to_dict(job):
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["done"] / job["total"] if job["total"] else 1.0,
+        "sentences_done": job["done"],
+        "sentences_total": job["total"],
+        "error": job["error"],
+    }
+
+@app.post("/jobs")
+async def submit_job(request_data: TTSRequest):
+    # Jobs default to the bulk lane unless a priority is given explicitly
+    priority = request_data.priority if "priority" in request_data.__fields_set__ else "bulk"
+    check_priority(priority)
+    try:
+        logging.info(f"job req: {request_data}")
+        job_id = await job_pool.submit(request_data.ref_wav_path, request_data.prompt_text, request_data.text,
+                                       temperature=request_data.temperature,
+                                       repetition_penalty=request_data.repetition_penalty,
+                                       speed=request_data.speed, scaling_factor=request_data.scaling_factor,
+                                       priority=priority)
+        return {"job_id": job_id}
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_pool.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job_to_dict(job)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_pool.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return FileResponse(job_pool.store.output_path(job_id), media_type="audio/wav")
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.exposition(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "admission": admission.stats(),
+        "cost_model": tts.cost_model.coefficients(),
+        "model_load_seconds": LOAD_SECONDS,
+        "precision": tts.sovits_processor.precision.stats(),
+        "autotune": AUTOTUNE_PROFILE["settings"] if AUTOTUNE_PROFILE else None,
+        "compiled_decode": tts.sovits_processor.compiled_decoder.stats()
+        if tts.sovits_processor.compiled_decoder is not None else None,
+        "lanes": {
+            "llm": tts.llm_scheduler.lane_stats(),
+            "sovits": tts.sovits_scheduler.lane_stats(),
+        },
+    }
+
+
+class ProfileRequest(BaseModel):
+    requests: Optional[int] = None  # profile the next N finished requests
+    seconds: Optional[float] = None  # or the next T seconds, whichever ends first
+    mode: Optional[str] = "both"  # "torch", "sampling" or "both"
+    interval: Optional[float] = 0.005  # sampling interval in seconds
+
+@app.post("/admin/profile")
+async def arm_profiler(request_data: ProfileRequest, request: Request):
+    check_admin(request)
+    try:
+        # Waits for the torch profiler to start on its own thread
+        return await asyncio.to_thread(PROFILER.arm, request_data.requests, request_data.seconds,
+                                       request_data.mode, request_data.interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/admin/profile")
+async def get_profiler(request: Request):
+    check_admin(request)
+    return PROFILER.status()
+
+
+@app.delete("/admin/profile")
+async def disarm_profiler(request: Request):
+    check_admin(request)
+    result = await asyncio.to_thread(PROFILER.disarm)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No profile session is armed")
+    return result
+
+
+@app.get("/admin/memory")
+async def get_memory(request: Request):
+    check_admin(request)
+    return await asyncio.to_thread(memory.snapshot)
+
+
+@app.websocket("/ws/tts")
+async def ws_tts(websocket: WebSocket):
+    """
+    Protocol (JSON text frames from the client, raw PCM binary frames from the server):
+      1. {"ref_wav_path", "prompt_text", optional temperature/repetition_penalty/speed/scaling_factor/deadline,
+          media_type: "pcm" (default), "ogg", "aac" or "mp3"}
+         -> {"type": "ready", "sample_rate", "sample_width", "media_type"}
+         Compressed audio goes through one encoder for the session; what it still buffers
+         at a flush is sent with later audio, and all of it before {"type": "closed"}.
+      2. {"type": "text", "text": fragment}, any number of times
+      3. {"type": "flush"} -> remaining text is synthesized, then {"type": "flushed"}
+         {"type": "close"} -> same as flush, then the socket is closed
+      Each sentence goes through admission control like an HTTP request; when it is rejected,
+      {"type": "error", "status": 429 or 503, "detail", "retry_after"} is sent and the socket is
+      closed with 1013 (try again later).
+      If synthesis fails, {"type": "error", "detail"} is sent and the socket is closed with 1011.
+    """
+    await websocket.accept()
+    sentences = asyncio.Queue()
+    synth_task = None
+    encoder = None
+    try:
+        init = await websocket.receive_json()
+        logging.info(f"ws req: {init}")
+        media_type = negotiate(init.get("media_type") or "pcm")
+        if media_type == "wav":
+            raise ValueError("media_type 'wav' needs the total length up front; use 'pcm' on /ws/tts")
+        check_available(media_type)
+        # The session warms the speaker reference (HuBERT, spectrogram) and normalizes the prompt,
+        # and feed / flush run the text frontend, so all of them run off the event loop
+        session = await asyncio.to_thread(TTSStreamSession, tts, init["ref_wav_path"], init["prompt_text"],
+                                          temperature=init.get("temperature", 1.0),
+                                          repetition_penalty=init.get("repetition_penalty", 1.0),
+                                          speed=init.get("speed", 1.0),
+                                          scaling_factor=init.get("scaling_factor", 1.0))
+        processor = tts.sovits_processor
+        encoder = await asyncio.to_thread(start_encoder, media_type)
+        await websocket.send_json({"type": "ready", "sample_rate": processor.sampling_rate,
+                                   "sample_width": 4 if processor.is_int32 else 2, "media_type": media_type})
+
+        # Sentences are synthesized in order while more text keeps arriving;
+        # a dict item on the queue is a control reply sent once everything before it is done.
+        async def synthesize_loop():
+            while True:
+                item = await sentences.get()
+                if isinstance(item, dict):
+                    if item["type"] == "closed" and encoder is not None:
+                        tail = await asyncio.to_thread(encoder.close)
+                        if tail:
+                            await websocket.send_bytes(tail)
+                    await websocket.send_json(item)
+                    if item["type"] == "closed":
+                        return
+                    continue
+                ticket = await admit("ws_tts", [item], session.speed, init.get("deadline"))
+                try:
+                    audio = await session.synthesize(item)
+                finally:
+                    admission.release(ticket)
+                if encoder is not None:
+                    audio = await asyncio.to_thread(encoder.write, audio)
+                if audio:
+                    await websocket.send_bytes(audio)
+        synth_task = asyncio.create_task(synthesize_loop())
+
+        while True:
+            # Waits on the synthesis task too, so a failed sentence ends the session
+            # instead of leaving the client waiting for a reply that never comes
+            receive = asyncio.ensure_future(websocket.receive_json())
+            await asyncio.wait({receive, synth_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                receive.cancel()
+                synth_task.result()
+            message = receive.result()
+            message_type = message.get("type")
+            if message_type == "text":
+                for sentence in await asyncio.to_thread(session.feed, message.get("text", "")):
+                    sentences.put_nowait(sentence)
+            elif message_type in ("flush", "close"):
+                for sentence in await asyncio.to_thread(session.flush):
+                    sentences.put_nowait(sentence)
+                if message_type == "flush":
+                    sentences.put_nowait({"type": "flushed"})
+                else:
+                    sentences.put_nowait({"type": "closed"})
+                    await synth_task
+                    await websocket.close()
+                    return
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown message type: {message_type}"})
+    except WebSocketDisconnect:
+        logging.info("ws client disconnected")
+    except HTTPException as e:
+        # Rejected by admission control
+        try:
+            await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail,
+                                       "retry_after": int((e.headers or {}).get("Retry-After", 1))})
+            await websocket.close(code=1013, reason=e.detail[:120])
+        except Exception:
+            logging.info("ws client gone before the rejection was sent")
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        try:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            await websocket.close(code=1011, reason=str(e)[:120])
+        except Exception:
+            logging.info("ws client gone before the error was sent")
+    finally:
+        if synth_task is not None and not synth_task.done():
+            synth_task.cancel()
+        if encoder is not None:
+            encoder.abort()
+
 
 if __name__ == "__main__":
     model_type = "base"
@@ -91,5 +776,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error downloading model: {str(e)}")
     
-    tts = Inference(model_type, model_path, enable_vllm_acc=True)
+    # TTS_FAKE_LLM=1 replaces the Llama backend with random tokens, for load tests on CPU
+    tts = Inference(model_type, model_path, enable_vllm_acc=True,
+                    enable_fake_llm=os.getenv("TTS_FAKE_LLM", "0") == "1")
     uvicorn.run(app, host="0.0.0.0", port=TTS_PORT)
@@ -0,0 +1,289 @@
+"""
+Numerical-equivalence harness: runs the reference fp32 SynthesizerTrn.decode and optimized
+decode paths on the same fixed-seed inputs and checks the audio against tolerances.
+
+    python -m benchmarks.equivalence                      # random-weight model from s2.json
+    python -m benchmarks.equivalence --sovits-path pretrained_models/Muyan-TTS/sovits.pth \
+        --paths fp16,batched --min-snr 30 --output logs/bench/equivalence.json
+
+Per path and token length it reports waveform SNR (dB), log-mel L1 distance and max abs
+error, and exits non-zero when any path is outside its tolerances. noise_scale defaults
+to 0 so only numerical differences are measured; with a non-zero noise_scale every path
+draws its noise from the same seed.
+"""
+import argparse
+import copy
+import json
+import logging
+import math
+import os
+import sys
+
+import numpy as np
+import torch
+
+from sovits.module.mel_processing import spec_to_mel_torch, spectral_normalize_torch, spectrogram_torch
+from benchmarks.fixtures import build_synthesizer, decode_inputs, load_hps
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# (min SNR dB, max log-mel L1, max abs error); lossless rewrites must be near exact
+EXACT_TOLERANCE = {"min_snr": 60.0, "max_mel_l1": 0.01, "max_abs": 1e-3}
+DEFAULT_TOLERANCES = {
+    "cached_ge": EXACT_TOLERANCE,
+    "batched": EXACT_TOLERANCE,
+    "compile": EXACT_TOLERANCE,
+    "compile_bucketed": EXACT_TOLERANCE,
+    "chunked": EXACT_TOLERANCE,
+    "reference_attention": EXACT_TOLERANCE,
+    "onnx": EXACT_TOLERANCE,
+    "fp16": {"min_snr": 20.0, "max_mel_l1": 0.2, "max_abs": 0.1},
+    "bf16": {"min_snr": 12.0, "max_mel_l1": 0.4, "max_abs": 0.2},
+    "int8": {"min_snr": 10.0, "max_mel_l1": 0.5, "max_abs": 0.3},
+}
+
+PATHS = {}
+
+
+def decode_path(name):
+    def decorator(fn):
+        PATHS[name] = fn
+        return fn
+    return decorator
+
+
+def seeded_decode(decode, seed, *args, **kwargs):
+    # decode samples z_p noise with torch.randn_like; reseed so every path draws the same noise
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+    return decode(*args, **kwargs)
+
+
+def to_waveform(audio):
+    return audio.detach().float().cpu().numpy().reshape(-1)
+
+
+def reference(model, inputs, noise_scale, seed):
+    codes, phones, refer = inputs
+    return to_waveform(seeded_decode(model.decode, seed, codes, phones, [refer], noise_scale=noise_scale))
+
+
+def _cast_decode(model, inputs, noise_scale, seed, device, dtype):
+    codes, phones, refer = inputs
+    model = copy.deepcopy(model).to(device=device, dtype=dtype)
+    audio = seeded_decode(model.decode, seed, codes.to(device), phones.to(device),
+                          [refer.to(device=device, dtype=dtype)], noise_scale=noise_scale)
+    return to_waveform(audio)
+
+
+@decode_path("fp16")
+def fp16_decode(model, inputs, noise_scale, seed, device):
+    return _cast_decode(model, inputs, noise_scale, seed, device, torch.float16)
+
+
+@decode_path("bf16")
+def bf16_decode(model, inputs, noise_scale, seed, device):
+    return _cast_decode(model, inputs, noise_scale, seed, device, torch.bfloat16)
+
+
+@decode_path("int8")
+def int8_decode(model, inputs, noise_scale, seed, device):
+    # Dynamic quantization covers the Linear layers; convolutions stay fp32 (CPU only)
+    quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+    codes, phones, refer = inputs
+    return to_waveform(seeded_decode(quantized.decode, seed, codes, phones, [refer], noise_scale=noise_scale))
+
+
+@decode_path("cached_ge")
+def cached_ge_decode(model, inputs, noise_scale, seed, device):
+    # Reference embedding computed once up front and passed in, as the batch path does
+    codes, phones, refer = inputs
+    ge = model.get_ge([refer])
+    audio, lengths = seeded_decode(model.decode_batch, seed, codes, torch.LongTensor([codes.size(2)]),
+                                   phones, torch.LongTensor([phones.size(1)]), ge, noise_scale=noise_scale)
+    return to_waveform(audio[0, :, :lengths[0]])
+
+
+@decode_path("batched")
+def batched_decode(model, inputs, noise_scale, seed, device):
+    # Decoded alongside a longer item so padding and masking are exercised
+    codes, phones, refer = inputs
+    pad_codes = torch.cat([codes, codes[:, :, : codes.size(2) // 2]], 2)
+    pad_phones = torch.cat([phones, phones[:, : phones.size(1) // 2]], 1)
+    batch_codes = torch.zeros(1, 2, pad_codes.size(2), dtype=codes.dtype)
+    batch_codes[:, 0, :codes.size(2)] = codes[:, 0]
+    batch_codes[:, 1] = pad_codes[:, 0]
+    batch_phones = torch.zeros(2, pad_phones.size(1), dtype=phones.dtype)
+    batch_phones[0, :phones.size(1)] = phones[0]
+    batch_phones[1] = pad_phones[0]
+    ge = model.get_ge([refer]).expand(2, -1, -1)
+    audio, lengths = seeded_decode(
+        model.decode_batch, seed, batch_codes, torch.LongTensor([codes.size(2), pad_codes.size(2)]),
+        batch_phones, torch.LongTensor([phones.size(1), pad_phones.size(1)]), ge, noise_scale=noise_scale)
+    return to_waveform(audio[0, :, :lengths[0]])
+
+
+@decode_path("compile")
+def compiled_decode(model, inputs, noise_scale, seed, device):
+    codes, phones, refer = inputs
+    decode = torch.compile(copy.deepcopy(model).decode, dynamic=True)
+    return to_waveform(seeded_decode(decode, seed, codes, phones, [refer], noise_scale=noise_scale))
+
+
+@decode_path("reference_attention")
+def reference_attention_decode(model, inputs, noise_scale, seed, device):
+    # The pre-SDPA attention implementation, to check the fast path the reference now uses
+    from sovits.module import attentions
+    codes, phones, refer = inputs
+    attentions.FAST_ATTENTION = False
+    try:
+        return to_waveform(seeded_decode(model.decode, seed, codes, phones, [refer], noise_scale=noise_scale))
+    finally:
+        attentions.FAST_ATTENTION = True
+
+
+@decode_path("chunked")
+def chunked_decode(model, inputs, noise_scale, seed, device):
+    # Small windows so several crossfades land inside every tested length
+    codes, phones, refer = inputs
+    chunks = seeded_decode(model.decode_chunked, seed, codes, phones, [refer], noise_scale=noise_scale, chunk_frames=40)
+    return to_waveform(torch.cat(list(chunks), -1))
+
+
+@decode_path("compile_bucketed")
+def bucketed_decode(model, inputs, noise_scale, seed, device):
+    # Padded up to the next length bucket; like "batched", only the masks keep it equal
+    from sovits.compiled_decode import BucketedDecoder
+    codes, phones, refer = inputs
+    decoder = BucketedDecoder(model, token_buckets=(codes.size(2) + 16,), phone_buckets=(phones.size(1) + 8,))
+    # Unwarmed bucket pairs are decoded eagerly
+    decoder.warmup(repeat=1)
+    return to_waveform(seeded_decode(decoder.decode, seed, codes, phones, model.get_ge([refer]),
+                                     noise_scale=noise_scale))
+
+
+@decode_path("onnx")
+def onnx_decode(model, inputs, noise_scale, seed, device):
+    # Exported graph through onnxruntime; its noise comes from ORT, so compare with noise_scale 0
+    import tempfile
+    from sovits.onnx_decode import OnnxDecodeSession, export_decode_onnx
+    codes, phones, refer = inputs
+    with tempfile.TemporaryDirectory() as tmp:
+        path = export_decode_onnx(copy.deepcopy(model), os.path.join(tmp, "decode.onnx"))
+        session = OnnxDecodeSession(path, device)
+        return session.decode(codes, phones, model.get_ge([refer]), noise_scale=noise_scale).reshape(-1)
+
+
+def log_mel(audio, hps):
+    y = torch.from_numpy(np.clip(audio, -1.0, 1.0)).unsqueeze(0)
+    spec = spectrogram_torch(y, hps.data.filter_length, hps.data.sampling_rate, hps.data.hop_length,
+                             hps.data.win_length, center=False)
+    mel = spec_to_mel_torch(spec, hps.data.filter_length, hps.data.n_mel_channels, hps.data.sampling_rate,
+                            hps.data.mel_fmin, hps.data.mel_fmax)
+    return spectral_normalize_torch(mel)
+
+
+def compare_waveforms(ref, out, hps):
+    """
+    :return: dict with snr_db, mel_l1, max_abs and the length difference in samples
+    """
+    length = min(len(ref), len(out))
+    ref_cut, out_cut = ref[:length].astype(np.float64), out[:length].astype(np.float64)
+    noise = np.sum((ref_cut - out_cut) ** 2)
+    signal = np.sum(ref_cut ** 2)
+    snr = float("inf") if noise == 0 else 10 * math.log10(max(signal, 1e-20) / noise)
+    mel_ref, mel_out = log_mel(ref[:length], hps), log_mel(out[:length], hps)
+    return {
+        "snr_db": snr,
+        "mel_l1": float((mel_ref - mel_out).abs().mean()),
+        "max_abs": float(np.max(np.abs(ref_cut - out_cut))) if length else 0.0,
+        "length_diff": len(out) - len(ref),
+    }
+
+
+def within_tolerance(metrics, tolerance):
+    failures = []
+    if metrics["snr_db"] < tolerance["min_snr"]:
+        failures.append(f"snr {metrics['snr_db']:.1f} dB < {tolerance['min_snr']}")
+    if metrics["mel_l1"] > tolerance["max_mel_l1"]:
+        failures.append(f"mel_l1 {metrics['mel_l1']:.4f} > {tolerance['max_mel_l1']}")
+    if metrics["max_abs"] > tolerance["max_abs"]:
+        failures.append(f"max_abs {metrics['max_abs']:.4f} > {tolerance['max_abs']}")
+    if metrics["length_diff"] != 0:
+        failures.append(f"length differs by {metrics['length_diff']} samples")
+    return failures
+
+
+def load_model(args, hps):
+    if not args.sovits_path:
+        return build_synthesizer(hps, seed=args.seed), hps
+    from sovits.export import load_sovits
+    from sovits.process import DictToAttrRecursive
+    model, config = load_sovits(args.sovits_path)
+    return model, DictToAttrRecursive(config)
+
+
+def default_paths():
+    paths = ["cached_ge", "batched", "reference_attention"]
+    paths.append("fp16" if torch.cuda.is_available() else "bf16")
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paths", default=",".join(default_paths()), help=f"comma separated, from {sorted(PATHS)}")
+    parser.add_argument("--sovits-path", default=None, help="checkpoint to test; random weights from s2.json if omitted")
+    parser.add_argument("--token-lengths", default="50,150,400")
+    parser.add_argument("--noise-scale", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="device for the cast (fp16/bf16) paths")
+    parser.add_argument("--min-snr", type=float, default=None, help="override every path's minimum SNR (dB)")
+    parser.add_argument("--max-mel-l1", type=float, default=None, help="override every path's maximum log-mel L1")
+    parser.add_argument("--max-abs", type=float, default=None, help="override every path's maximum abs error")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    overrides = {k: v for k, v in (("min_snr", args.min_snr), ("max_mel_l1", args.max_mel_l1),
+                                   ("max_abs", args.max_abs)) if v is not None}
+    hps = load_hps()
+    model, hps = load_model(args, hps)
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    for name in paths:
+        if name not in PATHS:
+            parser.error(f"Unknown path: '{name}'. Expected one of {sorted(PATHS)}")
+
+    rows = []
+    for num_tokens in (int(n) for n in args.token_lengths.split(",")):
+        inputs = decode_inputs(model, hps, num_tokens, seed=args.seed)
+        ref = reference(model, inputs, args.noise_scale, args.seed)
+        for name in paths:
+            tolerance = dict(DEFAULT_TOLERANCES.get(name, EXACT_TOLERANCE), **overrides)
+            row = {"path": name, "tokens": num_tokens, "tolerance": tolerance}
+            try:
+                out = PATHS[name](model, inputs, args.noise_scale, args.seed, args.device)
+            except Exception as e:
+                row.update(status="error", failures=[f"{type(e).__name__}: {e}"])
+                rows.append(row)
+                logging.error(f"{name}[{num_tokens}]: {row['failures'][0]}")
+                continue
+            row.update(compare_waveforms(ref, out, hps))
+            row["failures"] = within_tolerance(row, tolerance)
+            row["status"] = "fail" if row["failures"] else "pass"
+            rows.append(row)
+            logging.info(f"{name}[{num_tokens}]: {row['status']} snr={row['snr_db']:.1f}dB "
+                         f"mel_l1={row['mel_l1']:.4f} max_abs={row['max_abs']:.4f}")
+
+    failed = [row for row in rows if row["status"] != "pass"]
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"noise_scale": args.noise_scale, "seed": args.seed, "sovits_path": args.sovits_path,
+                       "rows": rows, "failed": len(failed)}, f, indent=2)
+    print(f"{len(rows) - len(failed)}/{len(rows)} checks within tolerance")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
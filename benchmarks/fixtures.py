@@ -0,0 +1,72 @@
+"""
+Deterministic inputs and random-weight models for benchmarks that must run without
+downloaded checkpoints.
+"""
+import json
+
+import numpy as np
+import torch
+
+from sovits.models import SynthesizerTrn
+from sovits.module.mel_processing import spectrogram_torch
+from sovits.process import DictToAttrRecursive
+
+S2_CONFIG_PATH = "sovits/configs/s2.json"
+
+SAMPLE_TEXT = (
+    "Welcome to the captivating world of podcasts, let's embark on this exciting journey together. "
+    "In 2024, more than 4.5 million shows were published & listened to by 60% of adults. "
+    "Although the campaign was not a complete success, it did provide Napoleon with valuable experience and prestige."
+)
+
+
+def load_hps(config_path=S2_CONFIG_PATH, version="v1"):
+    with open(config_path) as f:
+        hps = DictToAttrRecursive(json.load(f))
+    hps.model.semantic_frame_rate = "25hz"
+    hps.model.version = version
+    return hps
+
+
+def build_synthesizer(hps, seed=0, device="cpu", dtype=torch.float32):
+    """
+    SynthesizerTrn with seeded random weights, set up for inference like
+    Processor.get_sovits_weights (enc_q removed, eval mode).
+    """
+    torch.manual_seed(seed)
+    model = SynthesizerTrn(
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **vars(hps.model)
+    )
+    del model.enc_q
+    # Codebooks are zero until k-means init in training; give them random entries instead
+    for layer in model.quantizer.vq.layers:
+        layer._codebook.embed.normal_()
+    return model.to(device=device, dtype=dtype).eval()
+
+
+def reference_audio(hps, seconds=3.0, seed=0):
+    rng = np.random.default_rng(seed)
+    audio = rng.standard_normal(int(hps.data.sampling_rate * seconds)).astype(np.float32) * 0.1
+    return torch.from_numpy(audio).unsqueeze(0)
+
+
+def reference_spectrogram(hps, seconds=3.0, seed=0):
+    return spectrogram_torch(reference_audio(hps, seconds, seed), hps.data.filter_length, hps.data.sampling_rate,
+                             hps.data.hop_length, hps.data.win_length, center=False)
+
+
+def decode_inputs(model, hps, num_tokens, seed=0, device="cpu", dtype=torch.float32):
+    """
+    Seeded (codes, phones, refer) for SynthesizerTrn.decode, with about one phone per
+    two semantic tokens as in real speech.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    codebook_size = model.quantizer.bins
+    num_phones = model.enc_p.text_embedding.num_embeddings
+    codes = torch.randint(0, codebook_size, (1, 1, num_tokens), generator=generator)
+    phones = torch.randint(1, num_phones, (1, max(1, num_tokens // 2)), generator=generator)
+    refer = reference_spectrogram(hps, seed=seed).to(device=device, dtype=dtype)
+    return codes.to(device), phones.to(device), refer
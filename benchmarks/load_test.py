@@ -0,0 +1,341 @@
+"""
+End-to-end load test: replays a JSONL workload against the API or an in-process Inference.
+
+    # against a running server (start it with TTS_FAKE_LLM=1 to run on CPU)
+    python -m benchmarks.load_test run --workload requests.jsonl --url http://localhost:8020 \
+        --arrival closed --concurrency 1,4,16 --requests 64 --output logs/bench/base.json
+
+    # in-process with the fake LLM backend
+    python -m benchmarks.load_test run --workload requests.jsonl --in-process --fake-llm \
+        --arrival poisson --rate 0.5,1,2 --requests 64 --output logs/bench/new.json
+
+    python -m benchmarks.load_test compare logs/bench/base.json logs/bench/new.json --threshold 0.1
+
+Each workload line is a JSON object with "text" (a "body" field is used when there is no
+"text") and optionally ref_wav_path, prompt_text, temperature, repetition_penalty, speed,
+scaling_factor and priority.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import struct
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_REF_WAV_PATH = "assets/Claire.wav"
+DEFAULT_PROMPT_TEXT = "Although the campaign was not a complete success, it did provide Napoleon with valuable experience and prestige."
+REQUEST_FIELDS = ("temperature", "repetition_penalty", "speed", "scaling_factor", "priority")
+
+# Report metrics where a larger value is better; every other compared metric is better smaller
+HIGHER_IS_BETTER = {"throughput_rps", "audio_seconds_per_second"}
+
+
+def load_workload(path):
+    items = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.get("text") or record.get("body")
+            if not text:
+                continue
+            item = {
+                "ref_wav_path": record.get("ref_wav_path", DEFAULT_REF_WAV_PATH),
+                "prompt_text": record.get("prompt_text", DEFAULT_PROMPT_TEXT),
+                "text": text,
+            }
+            item.update({k: record[k] for k in REQUEST_FIELDS if k in record})
+            items.append(item)
+    if not items:
+        raise ValueError(f"No requests with text found in {path}")
+    return items
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+class RequestResult:
+    def __init__(self, latency=None, ttfb=None, audio_seconds=0.0, error=None):
+        self.latency = latency
+        self.ttfb = ttfb
+        self.audio_seconds = audio_seconds
+        self.error = error
+
+
+def wav_audio_seconds(header, num_bytes):
+    """Duration of a streamed WAV response from its 44-byte header and total size."""
+    rate = struct.unpack("<I", header[24:28])[0]
+    sample_width = struct.unpack("<H", header[34:36])[0] // 8
+    return max(0, num_bytes - 44) / (rate * sample_width)
+
+
+class HttpTarget:
+    def __init__(self, url, timeout=300.0):
+        import httpx
+        self.url = url.rstrip("/") + "/get_tts"
+        self.client = httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=None))
+
+    async def __call__(self, item):
+        start = time.perf_counter()
+        ttfb = None
+        header = b""
+        num_bytes = 0
+        async with self.client.stream("POST", self.url, json=item) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return RequestResult(error=f"HTTP {response.status_code}: {response.text[:200]}")
+            async for chunk in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                if len(header) < 44:
+                    header += chunk[:44 - len(header)]
+                num_bytes += len(chunk)
+        if len(header) < 44:
+            return RequestResult(error="Response is not a WAV file")
+        return RequestResult(time.perf_counter() - start, ttfb, wav_audio_seconds(header, num_bytes))
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class InProcessTarget:
+    def __init__(self, model_type, model_path, fake_llm):
+        from inference.inference import Inference
+        self.tts = Inference(model_type, model_path, enable_fake_llm=fake_llm)
+        processor = self.tts.sovits_processor
+        self.bytes_per_second = processor.sampling_rate * (4 if processor.is_int32 else 2)
+
+    async def __call__(self, item):
+        start = time.perf_counter()
+        priority = item.get("priority", "interactive")
+        kwargs = {k: v for k, v in item.items() if k != "priority"}
+        wavs = await self.tts.generate(priority=priority, **kwargs)
+        ttfb = None
+        num_bytes = 0
+        while True:
+            segment = await self.tts.next_segment(wavs, priority)
+            if segment is None:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            num_bytes += len(segment)
+        # Segments are WAV files in "close" stream mode; their headers are negligible here
+        return RequestResult(time.perf_counter() - start, ttfb, num_bytes / self.bytes_per_second)
+
+    async def close(self):
+        pass
+
+
+async def timed(target, item, results):
+    try:
+        results.append(await target(item))
+    except Exception as e:
+        results.append(RequestResult(error=f"{type(e).__name__}: {e}"))
+
+
+async def run_closed(target, workload, concurrency, num_requests):
+    results = []
+    counter = iter(range(num_requests))
+
+    async def worker():
+        for i in counter:
+            await timed(target, workload[i % len(workload)], results)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results
+
+
+async def run_poisson(target, workload, rate, num_requests, seed):
+    # Open loop: arrivals do not wait for earlier requests, so queueing shows up in latency
+    results = []
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(num_requests):
+        tasks.append(asyncio.create_task(timed(target, workload[i % len(workload)], results)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def run_report(results, duration, **config):
+    ok = [r for r in results if r.error is None]
+    audio_seconds = sum(r.audio_seconds for r in ok)
+    errors = [r.error for r in results if r.error is not None]
+    return dict(
+        config,
+        requests=len(results),
+        errors=len(errors),
+        error_samples=errors[:5],
+        duration_seconds=duration,
+        throughput_rps=len(ok) / duration if duration > 0 else 0.0,
+        audio_seconds_per_second=audio_seconds / duration if duration > 0 else 0.0,
+        latency_seconds=summarize([r.latency for r in ok]),
+        ttfb_seconds=summarize([r.ttfb for r in ok if r.ttfb is not None]),
+        real_time_factor=summarize([r.latency / r.audio_seconds for r in ok if r.audio_seconds > 0]),
+    )
+
+
+async def run(args):
+    workload = load_workload(args.workload)
+    if args.shuffle:
+        random.Random(args.seed).shuffle(workload)
+    if args.in_process:
+        target = InProcessTarget(args.model_type, args.model_path, args.fake_llm)
+    else:
+        target = HttpTarget(args.url, args.timeout)
+
+    runs = []
+    try:
+        if args.warmup:
+            await run_closed(target, workload, 1, args.warmup)
+        if args.arrival == "closed":
+            levels = [("concurrency", int(c)) for c in args.concurrency.split(",")]
+        else:
+            levels = [("rate", float(r)) for r in args.rate.split(",")]
+        for key, level in levels:
+            logging.info(f"load test: arrival={args.arrival} {key}={level} requests={args.requests}")
+            start = time.perf_counter()
+            if args.arrival == "closed":
+                results = await run_closed(target, workload, level, args.requests)
+            else:
+                results = await run_poisson(target, workload, level, args.requests, args.seed)
+            report = run_report(results, time.perf_counter() - start, arrival=args.arrival, **{key: level})
+            logging.info(f"load test: {report['throughput_rps']:.2f} req/s, "
+                         f"p95 latency {report['latency_seconds']['p95']}, errors {report['errors']}")
+            runs.append(report)
+    finally:
+        await target.close()
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": "in-process" if args.in_process else args.url,
+        "fake_llm": args.fake_llm,
+        "workload": args.workload,
+        "workload_size": len(workload),
+        "host": {"platform": platform.platform(), "python": platform.python_version()},
+        "runs": runs,
+    }
+
+
+def run_key(report):
+    return (report["arrival"], report.get("concurrency", report.get("rate")))
+
+
+def compare_reports(base, new, threshold):
+    """
+    Compares matching runs of two reports. A metric regresses when it is worse than the
+    baseline by more than `threshold` (relative).
+    """
+    base_runs = {run_key(r): r for r in base["runs"]}
+    rows = []
+    for run in new["runs"]:
+        key = run_key(run)
+        if key not in base_runs:
+            continue
+        old = base_runs[key]
+        metrics = [(name, old[name], run[name]) for name in sorted(HIGHER_IS_BETTER)]
+        for group in ("latency_seconds", "ttfb_seconds", "real_time_factor"):
+            for stat in ("p50", "p95", "p99"):
+                metrics.append((f"{group}.{stat}", old[group][stat], run[group][stat]))
+        metrics.append(("errors", old["errors"], run["errors"]))
+        for name, before, after in metrics:
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+            worse = -change if name in HIGHER_IS_BETTER else change
+            rows.append({
+                "arrival": key[0],
+                "level": key[1],
+                "metric": name,
+                "base": before,
+                "new": after,
+                "change": change,
+                "regression": worse > threshold,
+            })
+    return rows
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare_reports(base, new, args.threshold)
+    regressions = [row for row in rows if row["regression"]]
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['arrival']:>8} {row['level']:>6} {row['metric']:<26} "
+              f"{row['base']:>10.4f} -> {row['new']:>10.4f} ({row['change']:+.1%}) {flag}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"threshold": args.threshold, "rows": rows, "regressions": len(regressions)}, f, indent=2)
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="replay a workload and write a JSON report")
+    run_parser.add_argument("--workload", default="requests.jsonl")
+    run_parser.add_argument("--url", default="http://localhost:8020")
+    run_parser.add_argument("--timeout", type=float, default=300.0)
+    run_parser.add_argument("--in-process", action="store_true", help="call Inference directly instead of the API")
+    run_parser.add_argument("--fake-llm", action="store_true", help="in-process: use the fake Llama backend")
+    run_parser.add_argument("--model-type", default="base")
+    run_parser.add_argument("--model-path", default="pretrained_models/Muyan-TTS")
+    run_parser.add_argument("--arrival", choices=("closed", "poisson"), default="closed")
+    run_parser.add_argument("--concurrency", default="1,4", help="closed loop: comma separated levels")
+    run_parser.add_argument("--rate", default="1", help="poisson: comma separated arrival rates (req/s)")
+    run_parser.add_argument("--requests", type=int, default=32, help="requests per level")
+    run_parser.add_argument("--warmup", type=int, default=1, help="sequential requests before measuring")
+    run_parser.add_argument("--shuffle", action="store_true")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="logs/bench/load_test.json")
+
+    compare_parser = subparsers.add_parser("compare", help="flag regressions between two reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as regression")
+    compare_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args)
+
+    report = asyncio.run(run(args))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"load test report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+Micro-benchmarks of the per-stage hot paths, with JSON baselines for catching CPU regressions.
+
+    python -m benchmarks.micro list
+    python -m benchmarks.micro run --output benchmarks/baselines/cpu.json
+    python -m benchmarks.micro run -k sovits --compare benchmarks/baselines/cpu.json --threshold 0.15
+
+Each benchmark is warmed up for --warmup seconds, then timed in --repeat rounds; the number
+of calls per round is calibrated so a round lasts at least --min-round seconds. The median
+per-call time of the rounds is what gets compared against the baseline.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DECODE_TOKEN_LENGTHS = (50, 150, 400)
+
+BENCHMARKS = []
+
+
+class Benchmark:
+    def __init__(self, name, setup, param=None):
+        """
+        :param setup: callable(param) doing the expensive preparation once and returning
+                      the zero-argument function to time
+        """
+        self.name = name
+        self.setup = setup
+        self.param = param
+
+
+def benchmark(name, params=(None,)):
+    def decorator(setup):
+        for param in params:
+            BENCHMARKS.append(Benchmark(name if param is None else f"{name}[{param}]", setup, param))
+        return setup
+    return decorator
+
+
+@benchmark("text.get_normed_text")
+def bench_get_normed_text(_):
+    from sovits.utils import get_normed_text
+    from benchmarks.fixtures import SAMPLE_TEXT
+    return lambda: get_normed_text(SAMPLE_TEXT, "en", "v1")
+
+
+@benchmark("text.clean_and_split_text")
+def bench_clean_and_split_text(_):
+    from sovits.utils import clean_and_split_text, get_normed_text
+    from benchmarks.fixtures import SAMPLE_TEXT
+    text = get_normed_text(SAMPLE_TEXT, "en", "v1")
+    return lambda: clean_and_split_text(text)
+
+
+@benchmark("text.g2p_en")
+def bench_g2p(_):
+    from sovits.text.english import g2p
+    from sovits.utils import get_normed_text
+    from benchmarks.fixtures import SAMPLE_TEXT
+    text = get_normed_text(SAMPLE_TEXT, "en", "v1")
+    return lambda: g2p(text)
+
+
+@benchmark("text.cleaned_text_to_sequence")
+def bench_cleaned_text_to_sequence(_):
+    from sovits.text import cleaned_text_to_sequence
+    from sovits.text.cleaner import clean_text
+    from benchmarks.fixtures import SAMPLE_TEXT
+    phones, _, _ = clean_text(SAMPLE_TEXT, "en", "v1")
+    return lambda: cleaned_text_to_sequence(phones, "v1")
+
+
+@benchmark("tokens.tensor_to_audio_tokens")
+def bench_tensor_to_audio_tokens(_):
+    import torch
+    from sovits.utils import tensor_to_audio_tokens
+    tokens = torch.randint(0, 1024, (1, 500), generator=torch.Generator().manual_seed(0))
+    return lambda: tensor_to_audio_tokens(tokens)
+
+
+@benchmark("tokens.parse_audio_tokens")
+def bench_parse_audio_tokens(_):
+    # The token parsing get_tts_wav does on every segment
+    import random
+    from sovits.utils import parse_audio_tokens
+    rng = random.Random(0)
+    predict = "".join(f"<|audio_token_{rng.randrange(1024)}|>" for _ in range(500)) + "<|audio_token_end|>"
+    return lambda: parse_audio_tokens(predict)
+
+
+@benchmark("audio.spectrogram_torch")
+def bench_spectrogram(_):
+    from sovits.module.mel_processing import spectrogram_torch
+    from benchmarks.fixtures import load_hps, reference_audio
+    hps = load_hps()
+    audio = reference_audio(hps)
+    return lambda: spectrogram_torch(audio, hps.data.filter_length, hps.data.sampling_rate,
+                                     hps.data.hop_length, hps.data.win_length, center=False)
+
+
+@benchmark("sovits.decode", params=DECODE_TOKEN_LENGTHS)
+def bench_decode(num_tokens):
+    from benchmarks.fixtures import build_synthesizer, decode_inputs, load_hps
+    hps = load_hps()
+    model = build_synthesizer(hps)
+    codes, phones, refer = decode_inputs(model, hps, num_tokens)
+    return lambda: model.decode(codes, phones, [refer])
+
+
+@benchmark("sovits.decode_chunked", params=DECODE_TOKEN_LENGTHS)
+def bench_decode_chunked(num_tokens):
+    import torch
+    from benchmarks.fixtures import build_synthesizer, decode_inputs, load_hps
+    hps = load_hps()
+    model = build_synthesizer(hps)
+    codes, phones, refer = decode_inputs(model, hps, num_tokens)
+    return lambda: torch.cat(list(model.decode_chunked(codes, phones, [refer])), -1)
+
+
+@benchmark("attention.relative", params=("fast-400", "reference-400", "fast-2000", "reference-2000"))
+def bench_relative_attention(param):
+    # TextEncoder self-attention (window_size=4) over a long sequence
+    return _attention_setup(param, window_size=4)
+
+
+@benchmark("attention.cross", params=("fast-400", "reference-400", "fast-2000", "reference-2000"))
+def bench_cross_attention(param):
+    # MRTE cross-attention: no relative window, the SDPA path
+    return _attention_setup(param, window_size=None)
+
+
+def _attention_setup(param, window_size):
+    import torch
+    from sovits.module import attentions
+    mode, length = param.split("-")
+    torch.manual_seed(0)
+    layer = attentions.MultiHeadAttention(192, 192, 2, window_size=window_size).eval()
+    x = torch.randn(1, 192, int(length))
+    mask = torch.ones(1, 1, int(length), int(length))
+
+    @torch.no_grad()
+    def run():
+        attentions.FAST_ATTENTION = mode == "fast"
+        try:
+            return layer(x, x, mask)
+        finally:
+            attentions.FAST_ATTENTION = True
+    return run
+
+
+@benchmark("hubert.features")
+def bench_hubert(_):
+    # Pretrained weights when present, otherwise a random model of the same (base) size
+    import torch
+    from transformers import HubertConfig, HubertModel
+    path = "pretrained_models/chinese-hubert-base"
+    if os.path.exists(path):
+        model = HubertModel.from_pretrained(path, local_files_only=True)
+    else:
+        torch.manual_seed(0)
+        model = HubertModel(HubertConfig())
+    model.eval()
+    wav16k = torch.randn(1, 16000 * 3, generator=torch.Generator().manual_seed(0)) * 0.1
+
+    def run():
+        with torch.no_grad():
+            return model(wav16k)["last_hidden_state"]
+    return run
+
+
+@benchmark("audio.pack_wav")
+def bench_pack_wav(_):
+    from io import BytesIO
+    import numpy as np
+    from sovits.utils import pack_audio, pack_wav
+    rate = 32000
+    data = (np.random.default_rng(0).standard_normal(rate * 5) * 3000).astype(np.int16)
+    return lambda: pack_wav(pack_audio(BytesIO(), data, rate), rate)
+
+
+@benchmark("audio.output_stage")
+def bench_output_stage(_):
+    # Gain, clip, int16 conversion and WAV framing of 5s of decoded audio; the copy stands
+    # in for the fresh array every decode returns, since the stage works in place
+    import numpy as np
+    from sovits.output import silence_samples, wav_bytes
+    rate = 32000
+    audio = (np.random.default_rng(0).standard_normal(rate * 5) * 0.3).astype(np.float32)
+    return lambda: wav_bytes(audio.copy(), rate, 1.0, silence=silence_samples(rate))
+
+
+def measure(fn, warmup=0.5, repeat=7, min_round=0.2):
+    """
+    :return: dict of per-call seconds statistics over `repeat` rounds
+    """
+    deadline = time.perf_counter() + warmup
+    warmup_calls = 0
+    while warmup_calls < 3 or time.perf_counter() < deadline:
+        fn()
+        warmup_calls += 1
+
+    # Calibrate calls per round like timeit.autorange
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_round:
+            break
+        number *= 2 if number < 8 else 5
+
+    rounds = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            rounds.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {
+        "median": statistics.median(rounds),
+        "min": min(rounds),
+        "mean": statistics.fmean(rounds),
+        "stdev": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+        "rounds": repeat,
+        "number": number,
+    }
+
+
+def host_info(threads):
+    import torch
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": threads,
+    }
+
+
+def compare_results(baseline, results, threshold):
+    rows = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"]
+        rows.append({
+            "name": name,
+            "base": base["median"],
+            "new": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def run(args):
+    import torch
+    torch.set_num_threads(args.threads)
+    selected = [b for b in BENCHMARKS if not args.filter or any(k in b.name for k in args.filter)]
+    results = {}
+    for bench in selected:
+        try:
+            fn = bench.setup(bench.param)
+        except Exception as e:
+            logging.warning(f"{bench.name}: setup failed, skipped ({type(e).__name__}: {e})")
+            continue
+        results[bench.name] = measure(fn, args.warmup, args.repeat, args.min_round)
+        stats = results[bench.name]
+        logging.info(f"{bench.name}: median {stats['median'] * 1000:.3f} ms "
+                     f"(min {stats['min'] * 1000:.3f} ms, stdev {stats['stdev'] * 1000:.3f} ms, x{stats['number']})")
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": host_info(args.threads), "results": results}
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"micro-benchmark results written to {args.output}")
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    if baseline["host"].get("torch_threads") != args.threads:
+        logging.warning("baseline was recorded with a different thread count, ratios are not comparable")
+    rows = compare_results(baseline, results, args.threshold)
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<34} {row['base'] * 1000:>10.3f} ms -> {row['new'] * 1000:>10.3f} ms "
+              f"(x{row['ratio']:.2f}) {flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list benchmark names")
+    run_parser = subparsers.add_parser("run", help="run benchmarks, optionally against a baseline")
+    run_parser.add_argument("-k", "--filter", action="append", help="only names containing this (repeatable)")
+    run_parser.add_argument("--warmup", type=float, default=0.5, help="warmup seconds per benchmark")
+    run_parser.add_argument("--repeat", type=int, default=7, help="timed rounds per benchmark")
+    run_parser.add_argument("--min-round", type=float, default=0.2, help="minimum seconds per round")
+    run_parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads, fixed for stable timings")
+    run_parser.add_argument("--output", default=None, help="write results (usable as a baseline) to this file")
+    run_parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    run_parser.add_argument("--threshold", type=float, default=0.15, help="relative slowdown counted as regression")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for bench in BENCHMARKS:
+            print(bench.name)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
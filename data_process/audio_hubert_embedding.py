@@ -3,6 +3,7 @@
 import sys,os
 
 import sovits.cnhubert as cnhubert
+from sovits.precision import policy_from_env
 import torch
 
 
@@ -24,18 +25,15 @@ def my_save(fea,path):
 def audio_hubert_embedding(input_dir="data", output_dir="data", cnhubert_base_path="pretrained_models/chinese-hubert-base"):
     cnhubert.cnhubert_base_path = cnhubert_base_path
     os.makedirs(os.path.join(output_dir, "tmp", "hubert_embedding"), exist_ok=True)
-    is_half = eval(os.environ.get("is_half", "True")) and torch.cuda.is_available()
     maxx=0.95
     alpha=0.5
     if torch.cuda.is_available():
         device = "cuda"
     else:
         device = "cpu"
+    precision = policy_from_env(device)
     model=cnhubert.get_model()
-    if(is_half==True):
-        model=model.half().to(device)
-    else:
-        model = model.to(device)
+    model = model.to(device=device, dtype=precision.weight_dtype("hubert"))
 
     nan_fails=[]
     def name2go(wav_name,wav_path):
@@ -51,13 +49,10 @@ def audio_hubert_embedding(input_dir="data", output_dir="data", cnhubert_base_pa
         tmp_audio = librosa.resample(
             tmp_audio32b, orig_sr=32000, target_sr=16000
         )
-        tensor_wav16 = torch.from_numpy(tmp_audio)
-        if (is_half == True):
-            tensor_wav16=tensor_wav16.half().to(device)
-        else:
-            tensor_wav16 = tensor_wav16.to(device)
-        ssl=model.model(tensor_wav16.unsqueeze(0))["last_hidden_state"].transpose(1,2).cpu()#torch.Size([1, 768, 215])
-        if np.isnan(ssl.detach().numpy()).sum()!= 0:
+        tensor_wav16 = torch.from_numpy(tmp_audio).to(device=device, dtype=precision.weight_dtype("hubert"))
+        with precision.autocast("hubert"):
+            ssl=model.model(tensor_wav16.unsqueeze(0))["last_hidden_state"].transpose(1,2).cpu()#torch.Size([1, 768, 215])
+        if torch.isnan(ssl).any():
             nan_fails.append((wav_name,wav_path))
             print("nan filtered:%s"%wav_name)
             return
@@ -76,8 +71,8 @@ def audio_hubert_embedding(input_dir="data", output_dir="data", cnhubert_base_pa
         except:
             print(line,traceback.format_exc())
 
-    if(len(nan_fails)>0 and is_half==True):
-        is_half=False
+    if(len(nan_fails)>0 and precision.mode("hubert") != "fp32"):
+        precision.fall_back("hubert")
         model=model.float()
         for wav in nan_fails:
             try:
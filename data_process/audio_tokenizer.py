@@ -1,12 +1,12 @@
 import sys,os
 import torch
-is_half = eval(os.environ.get("is_half", "True")) and torch.cuda.is_available()
 import math, traceback
 import sys, pdb
 
 import sovits
 import logging, librosa
 from sovits.models import SynthesizerTrn
+from sovits.precision import policy_from_env
 from sovits.utils import clean_path
 logging.getLogger("numba").setLevel(logging.WARNING)
 
@@ -41,10 +41,9 @@ def audio_tokenizer(input_dir = "data",
             version="v2",
             **hps.model
         )
-        if is_half == True:
-            vq_model = vq_model.half().to(device)
-        else:
-            vq_model = vq_model.to(device)
+        precision = policy_from_env(device)
+        dtype = precision.weight_dtype("sovits")
+        vq_model = vq_model.to(device=device, dtype=dtype)
         vq_model.eval()
         
         vq_model.load_state_dict(
@@ -57,11 +56,9 @@ def audio_tokenizer(input_dir = "data",
             if os.path.exists(hubert_path) == False:
                 return
             ssl_content = torch.load(hubert_path, map_location="cpu")
-            if is_half == True:
-                ssl_content = ssl_content.half().to(device)
-            else:
-                ssl_content = ssl_content.to(device)
-            codes = vq_model.extract_latent(ssl_content)
+            ssl_content = ssl_content.to(device=device, dtype=dtype)
+            with precision.autocast("sovits"):
+                codes = vq_model.extract_latent(ssl_content)
             semantic = " ".join([str(i) for i in codes[0, 0, :].tolist()])
             lines.append("%s\t%s" % (wav_name, semantic))
 
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    def __init__(self, sentences, audio_seconds, deadline, service_seconds=0.0):
+        self.sentences = sentences
+        self.audio_seconds = audio_seconds
+        self.deadline = deadline
+        self.service_seconds = service_seconds
+        self.future = None
+        self.admitted_at = None
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Bounds the work handed to the LLM and SoVITS by in-flight sentence and audio-second budgets.
+    Requests that do not fit wait in a FIFO queue of at most max_queue entries until their
+    deadline; beyond that they are rejected with 429. Queued requests whose deadline passes are
+    dropped before any compute is spent on them, and requests whose predicted wait (the
+    service seconds queued ahead of them, see CostModel) already exceeds their deadline are
+    shed immediately.
+    """
+    def __init__(self, max_inflight_sentences=64, max_inflight_audio_seconds=600.0,
+                 max_queue=32, default_deadline=30.0):
+        self.max_inflight_sentences = max_inflight_sentences
+        self.max_inflight_audio_seconds = max_inflight_audio_seconds
+        self.max_queue = max_queue
+        self.default_deadline = default_deadline
+        self.inflight_sentences = 0
+        self.inflight_audio_seconds = 0.0
+        self.inflight_requests = 0
+        self.waiters = deque()
+        # Wall-clock seconds per budgeted audio second, updated on release
+        self.rtf = 1.0
+        self.loop = None
+
+    def _fits(self, ticket):
+        if self.inflight_requests == 0:
+            # An oversized request still runs when it is alone
+            return True
+        return (self.inflight_sentences + ticket.sentences <= self.max_inflight_sentences
+                and self.inflight_audio_seconds + ticket.audio_seconds <= self.max_inflight_audio_seconds)
+
+    def _admit(self, ticket):
+        self.inflight_sentences += ticket.sentences
+        self.inflight_audio_seconds += ticket.audio_seconds
+        self.inflight_requests += 1
+        ticket.admitted_at = time.monotonic()
+
+    def retry_after(self):
+        pending = self.inflight_audio_seconds + sum(w.audio_seconds for w in self.waiters)
+        return max(1, math.ceil(self.rtf * pending / max(1, self.inflight_requests)))
+
+    async def acquire(self, sentences, audio_seconds, deadline=None, service_seconds=0.0):
+        """
+        Waits until the request fits the budgets.
+        :param deadline: seconds the request may wait in the queue (default_deadline if None)
+        :param service_seconds: predicted compute seconds of the request
+        :raises AdmissionRejected: 429 when the queue is full, 503 when the deadline expires
+            or is predicted to expire
+        """
+        self.loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        timeout = self.default_deadline if deadline is None else deadline
+        ticket = AdmissionTicket(sentences, audio_seconds, now + timeout, service_seconds)
+        if not self.waiters and self._fits(ticket):
+            self._admit(ticket)
+            return ticket
+        if len(self.waiters) >= self.max_queue:
+            logging.info(f"admission rejected: queue full ({len(self.waiters)} waiting)")
+            raise AdmissionRejected(429, "Server overloaded, retry later", self.retry_after())
+        predicted_wait = sum(w.service_seconds for w in self.waiters)
+        if predicted_wait > timeout:
+            logging.info(f"admission shed: predicted wait {predicted_wait:.1f}s exceeds deadline {timeout:.1f}s")
+            raise AdmissionRejected(503, "Deadline would expire while queued", self.retry_after())
+
+        ticket.future = self.loop.create_future()
+        self.waiters.append(ticket)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+            return ticket
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+            logging.info("admission rejected: deadline expired while queued")
+            raise AdmissionRejected(503, "Deadline expired while queued", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket):
+        if ticket in self.waiters:
+            self.waiters.remove(ticket)
+            self._dispatch()
+        elif ticket.admitted_at is not None:
+            self._release(ticket)
+
+    def release(self, ticket):
+        """Returns the ticket's budget. Safe to call from worker threads and more than once."""
+        if self.loop is not None and self.loop.is_running():
+            try:
+                if asyncio.get_running_loop() is self.loop:
+                    self._release(ticket)
+                    return
+            except RuntimeError:
+                pass
+            self.loop.call_soon_threadsafe(self._release, ticket)
+        else:
+            self._release(ticket)
+
+    def _release(self, ticket):
+        if ticket.released or ticket.admitted_at is None:
+            return
+        ticket.released = True
+        self.inflight_sentences -= ticket.sentences
+        self.inflight_audio_seconds -= ticket.audio_seconds
+        self.inflight_requests -= 1
+        if ticket.audio_seconds > 0:
+            observed = (time.monotonic() - ticket.admitted_at) / ticket.audio_seconds
+            self.rtf = 0.9 * self.rtf + 0.1 * observed
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.waiters:
+            head = self.waiters[0]
+            if head.deadline <= now or head.future.done():
+                # Expired: drop without spending compute, its waiter reports the rejection
+                self.waiters.popleft()
+                continue
+            if not self._fits(head):
+                break
+            self.waiters.popleft()
+            self._admit(head)
+            head.future.set_result(True)
+
+    def stats(self):
+        return {
+            "inflight_requests": self.inflight_requests,
+            "inflight_sentences": self.inflight_sentences,
+            "inflight_audio_seconds": self.inflight_audio_seconds,
+            "queued": len(self.waiters),
+        }
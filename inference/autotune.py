@@ -0,0 +1,287 @@
+"""
+Host autotuner for thread counts, decoder concurrency and micro-batch sizes.
+
+    python -m inference.autotune --output logs/autotune.json --latency-target 1.0
+    TTS_AUTOTUNE_PROFILE=logs/autotune.json python api.py
+
+Runs short synthetic benchmarks on this host: SoVITS decode over (torch threads x
+concurrent decoders) and batch sizes, HuBERT feature extraction and g2p, plus the
+onnxruntime sessions when their models are available (--onnx-decode-path, --g2pw-dir).
+Picks the settings with the highest decode throughput whose p95 latency stays within
+--latency-target seconds per segment of --tokens semantic tokens, and writes them with
+the measurements to a profile file.
+
+At startup the server applies the profile as defaults for the matching environment
+variables (SETTINGS); variables that are set explicitly take precedence.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# profile setting -> environment variable it provides the default for
+SETTINGS = {
+    "torch_threads": "TTS_TORCH_THREADS",
+    "sovits_concurrency": "TTS_SOVITS_CONCURRENCY",
+    "decode_batch_size": "TTS_DECODE_BATCH_SIZE",
+    "ort_threads": "TTS_ORT_THREADS",
+    "g2pw_threads": "TTS_G2PW_THREADS",
+}
+BATCH_SIZES = (1, 2, 4, 8, 16)
+MAX_WORKERS = 8
+
+
+def load_profile(path):
+    """
+    Applies a profile written by this module as environment defaults, then sets the torch
+    thread count from TTS_TORCH_THREADS.
+    :return: the profile dict, or None when there is no profile at path
+    """
+    profile = None
+    if path and os.path.exists(path):
+        with open(path) as f:
+            profile = json.load(f)
+        for name, value in profile.get("settings", {}).items():
+            if name in SETTINGS and value is not None:
+                os.environ.setdefault(SETTINGS[name], str(value))
+        logging.info(f"autotune profile {path}: " +
+                     ", ".join(f"{SETTINGS[k]}={os.environ[SETTINGS[k]]}" for k in SETTINGS if SETTINGS[k] in os.environ))
+    if os.getenv("TTS_TORCH_THREADS"):
+        import torch
+        torch.set_num_threads(int(os.environ["TTS_TORCH_THREADS"]))
+    return profile
+
+
+def thread_candidates(limit):
+    candidates = {limit}
+    threads = 1
+    while threads < limit:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_concurrent(fn, threads, workers, rounds):
+    """
+    Calls fn rounds times on each of `workers` Python threads, each using `threads`
+    torch intra-op threads.
+    :return: dict with throughput (calls/s), p50 and p95 latency
+    """
+    import torch
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        # OpenMP thread counts are per calling thread
+        torch.set_num_threads(threads)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    torch.set_num_threads(threads)
+    fn()
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+    }
+
+
+def choose(rows, latency_target):
+    """Highest throughput within the latency target, else the lowest p95."""
+    within = [row for row in rows if row["p95"] <= latency_target]
+    if within:
+        return max(within, key=lambda row: row["throughput"])
+    logging.warning(f"no setting meets the {latency_target}s latency target, using the lowest p95")
+    return min(rows, key=lambda row: row["p95"])
+
+
+def tune_decode(model, hps, cores, num_tokens, rounds, latency_target):
+    from benchmarks.fixtures import decode_inputs
+    codes, phones, refer = decode_inputs(model, hps, num_tokens)
+    rows = []
+    for threads in thread_candidates(cores):
+        for workers in range(1, min(MAX_WORKERS, max(1, cores // threads)) + 1):
+            row = dict(threads=threads, workers=workers,
+                       **run_concurrent(lambda: model.decode(codes, phones, [refer]), threads, workers, rounds))
+            logging.info(f"decode threads={threads} workers={workers}: {row['throughput']:.2f}/s "
+                         f"p95 {row['p95'] * 1000:.0f}ms")
+            rows.append(row)
+    return choose(rows, latency_target), rows
+
+
+def tune_batch(model, hps, threads, num_tokens, rounds, latency_target):
+    import torch
+    from benchmarks.fixtures import decode_inputs
+    codes, phones, refer = decode_inputs(model, hps, num_tokens)
+    ge = model.get_ge([refer]).detach()
+    rows = []
+    for batch_size in BATCH_SIZES:
+        batch_codes = codes.expand(-1, batch_size, -1).contiguous()
+        batch_phones = phones.expand(batch_size, -1).contiguous()
+        code_lengths = torch.LongTensor([num_tokens] * batch_size)
+        text_lengths = torch.LongTensor([phones.size(1)] * batch_size)
+        batch_ge = ge.expand(batch_size, -1, -1)
+        result = run_concurrent(lambda: model.decode_batch(batch_codes, code_lengths, batch_phones, text_lengths,
+                                                           batch_ge), threads, 1, rounds)
+        # Throughput in segments: each call decodes batch_size of them
+        row = dict(batch_size=batch_size, throughput=result["throughput"] * batch_size,
+                   p50=result["p50"], p95=result["p95"])
+        logging.info(f"decode batch={batch_size}: {row['throughput']:.2f} segments/s p95 {row['p95'] * 1000:.0f}ms")
+        rows.append(row)
+    return choose(rows, latency_target), rows
+
+
+def bench_hubert(threads, rounds):
+    import torch
+    from transformers import HubertConfig, HubertModel
+    path = "pretrained_models/chinese-hubert-base"
+    if os.path.exists(path):
+        model = HubertModel.from_pretrained(path, local_files_only=True)
+    else:
+        torch.manual_seed(0)
+        model = HubertModel(HubertConfig())
+    model.eval()
+    wav16k = torch.randn(1, 16000 * 3, generator=torch.Generator().manual_seed(0)) * 0.1
+
+    @torch.no_grad()
+    def run():
+        return model(wav16k)["last_hidden_state"]
+    return run_concurrent(run, threads, 1, rounds)
+
+
+def bench_g2p(rounds):
+    from sovits.text.english import g2p
+    from sovits.utils import get_normed_text
+    from benchmarks.fixtures import SAMPLE_TEXT
+    text = get_normed_text(SAMPLE_TEXT, "en", "v1")
+    return run_concurrent(lambda: g2p(text), 1, 1, rounds)
+
+
+def tune_ort(make_session_fn, cores, rounds):
+    """
+    :param make_session_fn: callable(threads) returning the zero-argument function to time
+    :return: (fastest thread count, rows)
+    """
+    rows = []
+    for threads in thread_candidates(cores):
+        row = dict(threads=threads, **run_concurrent(make_session_fn(threads), 1, 1, rounds))
+        logging.info(f"onnxruntime threads={threads}: p50 {row['p50'] * 1000:.1f}ms")
+        rows.append(row)
+    return min(rows, key=lambda row: row["p50"])["threads"], rows
+
+
+def tune(args):
+    import torch
+    from benchmarks.fixtures import build_synthesizer, load_hps
+    cores = args.max_threads or os.cpu_count() or 1
+    hps = load_hps()
+    if args.sovits_path:
+        from sovits.export import load_sovits
+        model, _ = load_sovits(args.sovits_path)
+    else:
+        model = build_synthesizer(hps)
+
+    decode, decode_rows = tune_decode(model, hps, cores, args.tokens, args.rounds, args.latency_target)
+    threads = decode["threads"]
+    batch, batch_rows = tune_batch(model, hps, threads, args.tokens, args.rounds, args.latency_target)
+    measurements = {"decode": decode_rows, "batch": batch_rows}
+    settings = {
+        "torch_threads": threads,
+        "sovits_concurrency": decode["workers"],
+        "decode_batch_size": batch["batch_size"],
+        "ort_threads": threads,
+        "g2pw_threads": None,
+    }
+
+    try:
+        measurements["hubert"] = bench_hubert(threads, args.rounds)
+        logging.info(f"hubert 3s: p50 {measurements['hubert']['p50'] * 1000:.0f}ms")
+    except Exception as e:
+        logging.warning(f"hubert benchmark skipped ({type(e).__name__}: {e})")
+    measurements["g2p_en"] = bench_g2p(args.rounds)
+
+    if args.onnx_decode_path:
+        from sovits.onnx_decode import OnnxDecodeSession
+        from benchmarks.fixtures import decode_inputs
+        codes, phones, refer = decode_inputs(model, hps, args.tokens)
+        ge = model.get_ge([refer]).detach()
+
+        def make_session(ort_threads):
+            session = OnnxDecodeSession(args.onnx_decode_path, threads=ort_threads)
+            return lambda: session.decode(codes, phones, ge)
+        settings["ort_threads"], measurements["onnx_decode"] = tune_ort(
+            make_session, max(1, cores // decode["workers"]), args.rounds)
+
+    if args.g2pw_dir:
+        from sovits.text.g2pw.onnx_api import G2PWOnnxConverter
+
+        def make_g2pw(g2pw_threads):
+            os.environ["TTS_G2PW_THREADS"] = str(g2pw_threads)
+            converter = G2PWOnnxConverter(model_dir=args.g2pw_dir, style="pinyin")
+            return lambda: converter(["然而这次战役并不完全成功，但它确实为拿破仑提供了宝贵的经验和威望。"])
+        settings["g2pw_threads"], measurements["g2pw"] = tune_ort(make_g2pw, min(cores, 8), args.rounds)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        },
+        "latency_target": args.latency_target,
+        "tokens": args.tokens,
+        "settings": settings,
+        "measurements": measurements,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="logs/autotune.json")
+    parser.add_argument("--sovits-path", default=None, help="checkpoint to benchmark; random weights from s2.json if omitted")
+    parser.add_argument("--latency-target", type=float, default=1.0, help="p95 seconds per decoded segment")
+    parser.add_argument("--tokens", type=int, default=150, help="semantic tokens per synthetic segment (~6s audio)")
+    parser.add_argument("--rounds", type=int, default=3, help="timed calls per worker and setting")
+    parser.add_argument("--max-threads", type=int, default=None, help="cores to tune over (default: all)")
+    parser.add_argument("--onnx-decode-path", default=os.getenv("TTS_ONNX_DECODE_PATH"),
+                        help="also tune onnxruntime threads of this exported decode graph")
+    parser.add_argument("--g2pw-dir", default=None, help="also tune the G2PW onnxruntime threads")
+    args = parser.parse_args(argv)
+
+    profile = tune(args)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent=2)
+    for name, value in profile["settings"].items():
+        if value is not None:
+            print(f"{SETTINGS[name]}={value}")
+    logging.info(f"autotune profile written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
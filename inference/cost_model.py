@@ -0,0 +1,97 @@
+import functools
+import threading
+
+# The LLM emits semantic tokens at 25 Hz (see SynthesizerTrn semantic_frame_rate)
+AUDIO_TOKENS_PER_SECOND = 25.0
+
+
+@functools.lru_cache(maxsize=4096)
+def count_phones(sentence, version="v1"):
+    # Imported here so the model itself does not pull in the text frontend
+    from sovits.utils import clean_text_inf_phone
+
+    phones, _, _ = clean_text_inf_phone(sentence, "en", version)
+    return len(phones)
+
+
+class CostEstimate:
+    def __init__(self, sentences, phones, audio_tokens, audio_seconds, llm_seconds, decode_seconds):
+        self.sentences = sentences
+        self.phones = phones
+        self.audio_tokens = audio_tokens
+        self.audio_seconds = audio_seconds
+        self.llm_seconds = llm_seconds
+        self.decode_seconds = decode_seconds
+
+    @property
+    def total_seconds(self):
+        return self.llm_seconds + self.decode_seconds
+
+    def to_dict(self):
+        return {
+            "sentences": self.sentences,
+            "phones": self.phones,
+            "audio_tokens": self.audio_tokens,
+            "audio_seconds": self.audio_seconds,
+            "llm_seconds": self.llm_seconds,
+            "decode_seconds": self.decode_seconds,
+        }
+
+
+class CostModel:
+    """
+    Predicts the work of a request from the phone count of its text:
+      audio tokens   = tokens_per_phone * phones
+      audio seconds  = audio tokens / 25 / speed
+      LLM seconds    = llm_seconds_per_token * audio tokens (per sentence, sentences run in parallel)
+      decode seconds = decode_seconds_per_audio_second * audio seconds
+    Each coefficient is an exponentially weighted average of observed ratios, so the model
+    calibrates itself online against the host it runs on.
+    """
+    def __init__(self, tokens_per_phone=2.0, llm_seconds_per_token=0.01,
+                 decode_seconds_per_audio_second=0.1, smoothing=0.1):
+        self.tokens_per_phone = tokens_per_phone
+        self.llm_seconds_per_token = llm_seconds_per_token
+        self.decode_seconds_per_audio_second = decode_seconds_per_audio_second
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+
+    def predict(self, sentence_phones, speed=1.0):
+        """
+        :param sentence_phones: phone count of each sentence of the request
+        """
+        phones = sum(sentence_phones)
+        audio_tokens = self.tokens_per_phone * phones
+        audio_seconds = audio_tokens / AUDIO_TOKENS_PER_SECOND / max(speed, 1e-3)
+        longest_tokens = self.tokens_per_phone * max(sentence_phones, default=0)
+        return CostEstimate(
+            sentences=len(sentence_phones),
+            phones=phones,
+            audio_tokens=audio_tokens,
+            audio_seconds=audio_seconds,
+            llm_seconds=self.llm_seconds_per_token * longest_tokens,
+            decode_seconds=self.decode_seconds_per_audio_second * audio_seconds,
+        )
+
+    def _update(self, name, observed):
+        with self.lock:
+            setattr(self, name, (1 - self.smoothing) * getattr(self, name) + self.smoothing * observed)
+
+    def observe_tokens(self, phones, audio_tokens):
+        if phones > 0 and audio_tokens > 0:
+            self._update("tokens_per_phone", audio_tokens / phones)
+
+    def observe_llm(self, longest_tokens, seconds):
+        if longest_tokens > 0:
+            self._update("llm_seconds_per_token", seconds / longest_tokens)
+
+    def observe_decode(self, audio_seconds, seconds):
+        if audio_seconds > 0:
+            self._update("decode_seconds_per_audio_second", seconds / audio_seconds)
+
+    def coefficients(self):
+        return {
+            "tokens_per_phone": self.tokens_per_phone,
+            "llm_seconds_per_token": self.llm_seconds_per_token,
+            "decode_seconds_per_audio_second": self.decode_seconds_per_audio_second,
+        }
@@ -0,0 +1,175 @@
+"""
+Output formats of the synthesis endpoints and persistent streaming encoders.
+
+"wav" and "pcm" are sent as produced. Compressed formats go through one ffmpeg process per
+response stream: PCM segments are written to its stdin as they are decoded, and a reader
+thread collects whatever encoded bytes it has produced, so a stream pays one process spawn
+no matter how many segments it has.
+
+Bitrates default to values suited to mono speech and can be set with TTS_<FORMAT>_BITRATE,
+e.g. TTS_MP3_BITRATE=96k.
+"""
+import functools
+import logging
+import os
+import subprocess
+import threading
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# format -> (content type, ffmpeg output arguments, default bitrate)
+FORMATS = {
+    "wav": ("audio/wav", None, None),
+    "pcm": ("audio/pcm", None, None),
+    # libopus only takes 8/12/16/24/48 kHz input
+    "ogg": ("audio/ogg", ["-c:a", "libopus", "-ar", "48000", "-application", "voip", "-f", "ogg"], "32k"),
+    "aac": ("audio/aac", ["-c:a", "aac", "-f", "adts"], "64k"),
+    "mp3": ("audio/mpeg", ["-c:a", "libmp3lame", "-f", "mp3"], "64k"),
+}
+ALIASES = {"opus": "ogg", "raw": "pcm"}
+ACCEPT_TYPES = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav",
+    "audio/pcm": "pcm", "audio/l16": "pcm",
+    "audio/ogg": "ogg", "audio/opus": "ogg",
+    "audio/aac": "aac", "audio/aacp": "aac",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+}
+READ_SIZE = 65536
+# Bytes of ffmpeg's stderr kept for error messages
+STDERR_TAIL = 4096
+
+
+def is_encoded(media_type):
+    return FORMATS[media_type][1] is not None
+
+
+def content_type(media_type):
+    return FORMATS[media_type][0]
+
+
+def negotiate(media_type=None, accept=None):
+    """
+    Output format of a request: media_type when given, else the first supported type in
+    the Accept header, else "wav".
+    :raises ValueError: for an unknown media_type
+    """
+    if media_type:
+        media_type = ALIASES.get(media_type.lower(), media_type.lower())
+        if media_type not in FORMATS:
+            raise ValueError(f"Unknown media_type: '{media_type}'. Expected one of {sorted(FORMATS)}")
+        return media_type
+    for accepted in (accept or "").split(","):
+        accepted = accepted.split(";")[0].strip().lower()
+        if accepted in ACCEPT_TYPES:
+            return ACCEPT_TYPES[accepted]
+    return "wav"
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders():
+    """Codec names of the installed ffmpeg's audio encoders; empty when ffmpeg is missing."""
+    try:
+        listing = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True,
+                                 check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return frozenset()
+    # Lines look like " A....D libopus              libopus Opus"
+    return frozenset(parts[1] for parts in map(str.split, listing.splitlines())
+                     if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith("A") and parts[1] != "=")
+
+
+def check_available(media_type):
+    """
+    :raises RuntimeError: when media_type needs an encoder this host's ffmpeg does not have
+    """
+    if not is_encoded(media_type):
+        return
+    codec = FORMATS[media_type][1][1]
+    if codec not in available_encoders():
+        raise RuntimeError(f"{media_type} output needs ffmpeg with the {codec} encoder, which is not installed")
+
+
+class StreamEncoder:
+    def __init__(self, media_type, rate, is_int32=False):
+        """
+        Starts the ffmpeg process encoding mono PCM at `rate` into media_type.
+        """
+        _, args, bitrate = FORMATS[media_type]
+        bitrate = os.getenv(f"TTS_{media_type.upper()}_BITRATE", bitrate)
+        self.media_type = media_type
+        self.process = subprocess.Popen([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "s32le" if is_int32 else "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+            *args, "-b:a", bitrate, "-vn", "-flush_packets", "1", "pipe:1",
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.output = bytearray()
+        self.stderr_tail = bytearray()
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        # stderr is drained while the stream runs: once ffmpeg fills the pipe with warnings it
+        # would block, and write() with it
+        self.stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self.stderr_reader.start()
+
+    def _read(self):
+        stdout = self.process.stdout
+        while chunk := stdout.read1(READ_SIZE):
+            with self.lock:
+                self.output += chunk
+
+    def _read_stderr(self):
+        stderr = self.process.stderr
+        while chunk := stderr.read1(READ_SIZE):
+            self.stderr_tail += chunk
+            del self.stderr_tail[:-STDERR_TAIL]
+
+    def _take(self):
+        with self.lock:
+            data = bytes(self.output)
+            self.output.clear()
+        return data
+
+    def _error(self):
+        self.process.wait()
+        self.stderr_reader.join()
+        detail = self.stderr_tail.decode(errors="replace").strip()
+        return RuntimeError(f"{self.media_type} encoder exited with {self.process.returncode}: {detail}")
+
+    def write(self, pcm):
+        """
+        Feeds PCM bytes to the encoder.
+        :return: the encoded bytes available so far, possibly empty
+        """
+        try:
+            self.process.stdin.write(pcm)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise self._error()
+        return self._take()
+
+    def close(self):
+        """
+        Ends the input and waits for the encoder to flush.
+        :return: the remaining encoded bytes
+        """
+        self.process.stdin.close()
+        self.reader.join()
+        if self.process.wait() != 0:
+            raise self._error()
+        return self._take()
+
+    def abort(self):
+        """Stops the encoder, e.g. after the client went away; a no-op once it exited."""
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def encode(pcm, media_type, rate, is_int32=False):
+    """One-shot encoding of a complete PCM buffer, e.g. a batch item."""
+    encoder = StreamEncoder(media_type, rate, is_int32)
+    try:
+        return encoder.write(pcm) + encoder.close()
+    finally:
+        encoder.abort()
@@ -1,33 +1,65 @@
 import sys
 import os
 from sovits.process import Processor
+from inference.scheduler import PriorityScheduler, DEFAULT_LANE, lane_weights_from_env
+from inference.cost_model import CostModel, count_phones
+from inference.tracing import record_stage, stage
 from sovits.utils import *
 from fastapi.responses import StreamingResponse
 import re, logging
+import asyncio
+import threading
+import time
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 MIN_SENTENCE_LENGTH = 12
+# Split sentences kept per request text, so generate reuses the split done for admission
+SENTENCE_CACHE_SIZE = int(os.getenv("TTS_SENTENCE_CACHE_SIZE", "1024"))
 
 
 class Inference():
     def __init__(self, 
                  model_type, model_path, ref_wav_path="assets/Claire.wav", 
                  prompt_text="Although the campaign was not a complete success, it did provide Napoleon with valuable experience and prestige.",
-                 enable_vllm_acc=False):
+                 enable_vllm_acc=False, enable_fake_llm=False):
         # ref_wav_path and prompt_text are used here only to initialize sovits (otherwise the first run would be slow)
         # new ref_wav_path and prompt_text can still be specified later using call_tts
-        self.sovits_processor = Processor(sovits_path=os.path.join(model_path, "sovits.pth"))
+        # SoVITS/HuBERT precision follows sovits.precision (TTS_PRECISION): fp16 on GPU, bf16/fp32 on CPU
+        # TTS_SOVITS_PATH can point at an inference-only export (python -m sovits.export)
+        sovits_path = os.getenv("TTS_SOVITS_PATH", os.path.join(model_path, "sovits.pth"))
+        # TTS_DECODE_BACKEND=onnx decodes through onnxruntime (python -m sovits.onnx_decode),
+        # =compile through torch.compile length buckets (TTS_COMPILE_BUCKETS)
+        self.sovits_processor = Processor(sovits_path=sovits_path,
+                                          decode_backend=os.getenv("TTS_DECODE_BACKEND", "torch"),
+                                          onnx_decode_path=os.getenv("TTS_ONNX_DECODE_PATH"),
+                                          decode_chunk_frames=int(os.getenv("TTS_DECODE_CHUNK_FRAMES", "0")))
+        self.sovits_processor.stage_observer = record_stage
         self.sovits_processor.generate_audio_token(ref_wav_path)
         clean_text_inf_normed_text(prompt_text, 'en', 'v1') 
         logging.info("init vits finish")
 
+        # LLM sentences and SoVITS decode segments are scheduled across priority lanes
+        lane_weights = lane_weights_from_env()
+        self.llm_scheduler = PriorityScheduler("llm", int(os.getenv("TTS_LLM_CONCURRENCY", "64")), lane_weights)
+        self.sovits_scheduler = PriorityScheduler("sovits", int(os.getenv("TTS_SOVITS_CONCURRENCY", "1")), lane_weights)
+        # Micro-batch size of /get_tts_batch decodes (see python -m inference.autotune)
+        self.decode_batch_size = int(os.getenv("TTS_DECODE_BATCH_SIZE", "8"))
+        # Predicts request cost from phone counts; calibrated online by the calls below
+        self.cost_model = CostModel()
+        self.sentence_cache = {}
+        self.sentence_cache_lock = threading.Lock()
+
         # Used to distinguish between API mode and regular TTS mode
         self.enable_vllm_acc = enable_vllm_acc
-        if self.enable_vllm_acc == True:
+        if enable_fake_llm:
+            # Random audio tokens with simulated latency, for load tests without a GPU
+            from inference.inference_llama import InferenceLlamaFake
+            self.llama = InferenceLlamaFake(model_path, model_type, scheduler=self.llm_scheduler)
+        elif self.enable_vllm_acc == True:
             from inference.inference_llama import InferenceLlamaVllm
-            self.llama = InferenceLlamaVllm(model_path, model_type)
+            self.llama = InferenceLlamaVllm(model_path, model_type, scheduler=self.llm_scheduler)
         else:
             from inference.inference_llama import InferenceLlamaHf
-            self.llama = InferenceLlamaHf(model_path, model_type)
+            self.llama = InferenceLlamaHf(model_path, model_type, scheduler=self.llm_scheduler)
             
         self.model_type = model_type
         
@@ -44,37 +76,175 @@ class Inference():
         else:
             raise ValueError(f"Error model type: {self.model_type}")    
         
-    def _process_prompt(self, ref_wav_path, prompt_text, text):
-        audio_tokens = self.sovits_processor.generate_audio_token(ref_wav_path)
-        prompt_text = get_normed_text(prompt_text, 'en', 'v1')
-        text = get_normed_text(text, 'en', 'v1')
+    def _split_sentences(self, text):
+        # .get() so entries evicted concurrently under memory pressure count as misses
+        batch_texts = self.sentence_cache.get(text)
+        if batch_texts is not None:
+            return list(batch_texts)
+        with stage("text_normalization"):
+            normed_text = get_normed_text(text, 'en', 'v1')
         
         # Used to handle overly long sentences by splitting them into multiple shorter sentences
-        batch_texts = clean_and_split_text(text)
-        batch_texts = merge_sentences_minimum_n(batch_texts, MIN_SENTENCE_LENGTH) 
+        with stage("sentence_split"):
+            batch_texts = clean_and_split_text(normed_text)
+            batch_texts = merge_sentences_minimum_n(batch_texts, MIN_SENTENCE_LENGTH) 
+        with self.sentence_cache_lock:
+            self.sentence_cache[text] = tuple(batch_texts)
+            while len(self.sentence_cache) > SENTENCE_CACHE_SIZE:
+                self.sentence_cache.pop(next(iter(self.sentence_cache)), None)
+        return batch_texts
+        
+    def _process_prompt(self, ref_wav_path, prompt_text, text):
+        with stage("reference_lookup"):
+            audio_tokens = self.sovits_processor.generate_audio_token(ref_wav_path)
+        prompt_text = get_normed_text(prompt_text, 'en', 'v1')
+        batch_texts = self._split_sentences(text)
         
         batch_prompts = []
         for i in range(len(batch_texts)):
             batch_prompts.append(self._create_prompt(prompt_text, batch_texts[i], audio_tokens))
             
-        return batch_prompts
+        return batch_prompts, batch_texts
+
+    def estimate_cost(self, text, speed=1.0):
+        """
+        Runs the text frontend (normalization, split and g2p of each sentence); the split
+        sentences and phone counts are cached, so generate on the same text reuses them.
+        Call it off the event loop, e.g. through asyncio.to_thread.
+        """
+        return self._estimate_sentences(self._split_sentences(text), speed)
+
+    def _estimate_sentences(self, batch_texts, speed=1.0):
+        return self.cost_model.predict([count_phones(t) for t in batch_texts], speed)
+
+    async def _call_llm(self, batch_prompts, batch_texts, temperature, repetition_penalty, priority, speed=1.0):
+        estimate = self._estimate_sentences(batch_texts, speed)
+        start = time.monotonic()
+        results = await self.llama.cal_tts(batch_prompts, temperature, repetition_penalty,
+                                           priority=priority, cost=estimate.total_seconds)
+        token_counts = count_audio_tokens([r for r in results if isinstance(r, str)])
+        self.cost_model.observe_tokens(estimate.phones, sum(token_counts))
+        self.cost_model.observe_llm(max(token_counts, default=0), time.monotonic() - start)
+        return results, estimate
+
+    def _observe_decode(self, audio_bytes, seconds, sample_rate=None):
+        # sample_rate: rate of resampled output, so bytes still convert to decoded audio seconds
+        rate = sample_rate or self.sovits_processor.sampling_rate
+        bytes_per_second = rate * (4 if self.sovits_processor.is_int32 else 2)
+        self.cost_model.observe_decode(audio_bytes / bytes_per_second, seconds)
         
     async def generate(self, ref_wav_path, prompt_text, text, temperature=1.0, 
                  repetition_penalty=1.0, cut_punc=None,
-                 speed=1.0, scaling_factor=1.0):
+                 speed=1.0, scaling_factor=1.0, cancel_event=None, priority=DEFAULT_LANE, media_type="wav",
+                 sample_rate=None):
+        # cancel_event (threading.Event): once set, the returned generator stops at the next segment
+        # media_type "pcm": the generator yields raw PCM chunks instead of a WAV file
+        # sample_rate: output rate, resampled from the model rate before packing
         try:
             logging.info(f"Generating TTS for text: {text}")
-            batch_prompts = self._process_prompt(ref_wav_path, prompt_text, text)
+            batch_prompts, batch_texts = self._process_prompt(ref_wav_path, prompt_text, text)
             
-            results = await self.llama.cal_tts(batch_prompts, temperature, repetition_penalty)
+            results, _ = await self._call_llm(batch_prompts, batch_texts, temperature, repetition_penalty, priority, speed)
             pred_semantic = "".join(results)
-            wavs = self.sovits_processor.handle(pred_semantic, ref_wav_path, prompt_text, 'en', text, 'en', cut_punc, speed, [], scaling_factor)
+            wavs = self.sovits_processor.handle(pred_semantic, ref_wav_path, prompt_text, 'en', text, 'en', cut_punc, speed, [], scaling_factor, cancel_event=cancel_event, media_type=media_type,
+                                                sample_rate=sample_rate)
             logging.info("TTS generation successful")
             return wavs
         except Exception as e:
             logging.error(f"Error during TTS generation: {str(e)}")
             raise
 
+    async def generate_batch(self, items, temperature=1.0, repetition_penalty=1.0,
+                             speed=1.0, scaling_factor=1.0, priority="bulk", sample_rate=None):
+        """
+        Synthesizes many texts, possibly across speakers, in one pass.
+        :param items: list of dicts with ref_wav_path, prompt_text and text
+        :return: list of wav bytes, in the order of items
+        """
+        try:
+            logging.info(f"Generating TTS batch of {len(items)} items")
+            # Reference tokens and the normalized prompt are computed once per speaker,
+            # and identical prompts (same speaker and sentence) go to the LLM once.
+            speakers = {}
+            unique_prompts = {}
+            unique_sentences = []
+            item_prompts = []
+            for item in items:
+                speaker_key = (item["ref_wav_path"], item["prompt_text"])
+                if speaker_key not in speakers:
+                    with stage("reference_lookup"):
+                        audio_tokens = self.sovits_processor.generate_audio_token(item["ref_wav_path"])
+                    speakers[speaker_key] = (get_normed_text(item["prompt_text"], 'en', 'v1'), audio_tokens)
+                prompt_text, audio_tokens = speakers[speaker_key]
+                prompt_ids = []
+                for sentence in self._split_sentences(item["text"]):
+                    prompt = self._create_prompt(prompt_text, sentence, audio_tokens)
+                    if prompt not in unique_prompts:
+                        unique_prompts[prompt] = len(unique_prompts)
+                        unique_sentences.append(sentence)
+                    prompt_ids.append(unique_prompts[prompt])
+                item_prompts.append(prompt_ids)
+            logging.info(f"Batch has {sum(len(p) for p in item_prompts)} sentences, {len(unique_prompts)} unique")
+
+            results, estimate = await self._call_llm(list(unique_prompts), unique_sentences, temperature,
+                                                     repetition_penalty, priority, speed)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+            # Identical items share one decode
+            unique_items = {}
+            item_ids = []
+            for item, prompt_ids in zip(items, item_prompts):
+                key = (item["ref_wav_path"], item["prompt_text"], item["text"])
+                if key not in unique_items:
+                    pred_semantic = "".join(results[i] for i in prompt_ids)
+                    unique_items[key] = (len(unique_items), (pred_semantic, item["ref_wav_path"], item["text"]))
+                item_ids.append(unique_items[key][0])
+            decode_items = [decode_item for _, decode_item in unique_items.values()]
+
+            async with self.sovits_scheduler.slot(priority, estimate.total_seconds):
+                start = time.monotonic()
+                wavs = await asyncio.to_thread(self.sovits_processor.get_tts_wav_batch, decode_items,
+                                               speed=speed, scaling_factor=scaling_factor,
+                                               max_batch_size=self.decode_batch_size, sample_rate=sample_rate)
+                self._observe_decode(sum(len(w) for w in wavs), time.monotonic() - start, sample_rate)
+            logging.info("TTS batch generation successful")
+            return [wavs[i] for i in item_ids]
+        except Exception as e:
+            logging.error(f"Error during TTS batch generation: {str(e)}")
+            raise
+
+    async def generate_sentence_pcm(self, ref_wav_path, prompt_text, sentence, temperature=1.0,
+                                    repetition_penalty=1.0, speed=1.0, scaling_factor=1.0, priority=DEFAULT_LANE):
+        """
+        Synthesizes one already normalized and split sentence (see _split_sentences) and
+        returns raw PCM bytes. prompt_text must already be normalized with get_normed_text.
+        """
+        audio_tokens = self.sovits_processor.generate_audio_token(ref_wav_path)
+        prompt = self._create_prompt(prompt_text, sentence, audio_tokens)
+        results, estimate = await self._call_llm([prompt], [sentence], temperature, repetition_penalty, priority, speed)
+        if isinstance(results[0], Exception):
+            raise results[0]
+        async with self.sovits_scheduler.slot(priority, estimate.total_seconds):
+            start = time.monotonic()
+            pcm = await asyncio.to_thread(self.sovits_processor.get_tts_pcm, results[0], ref_wav_path, sentence,
+                                          speed=speed, scaling_factor=scaling_factor)
+            self._observe_decode(len(pcm), time.monotonic() - start)
+            return pcm
+
+    async def next_segment(self, wavs, priority=DEFAULT_LANE, cost=0.0, sample_rate=None):
+        """
+        Advances a generator returned by generate by one segment on a worker thread,
+        holding a SoVITS slot of the given lane. Returns None when the generator is exhausted.
+        """
+        async with self.sovits_scheduler.slot(priority, cost):
+            start = time.monotonic()
+            chunk = await asyncio.to_thread(next, wavs, None)
+            if chunk is not None:
+                self._observe_decode(len(chunk), time.monotonic() - start, sample_rate)
+            return chunk
+
     def init_vits(self, ref_wav_path, prompt_text):
         logging.info("init vits...")
         self.sovits_processor.generate_audio_token(ref_wav_path)
@@ -94,15 +264,18 @@ class Inference():
 
     async def generate_with_timestamps(self, ref_wav_path, prompt_text, text, temperature=1.0, 
                  repetition_penalty=1.0, cut_punc=None,
-                 speed=1.0, scaling_factor=1.0):
+                 speed=1.0, scaling_factor=1.0, priority=DEFAULT_LANE):
         try:
             logging.info(f"Generating TTS with timestamps for text: {text}")
-            batch_prompts = self._process_prompt(ref_wav_path, prompt_text, text)
+            batch_prompts, batch_texts = self._process_prompt(ref_wav_path, prompt_text, text)
             
-            results = await self.llama.cal_tts(batch_prompts, temperature, repetition_penalty)
+            results, estimate = await self._call_llm(batch_prompts, batch_texts, temperature, repetition_penalty, priority, speed)
             pred_semantic = "".join(results)
             wavs = self.sovits_processor.handle(pred_semantic, ref_wav_path, prompt_text, 'en', text, 'en', cut_punc, speed, [], scaling_factor)
-            synthesized_audio = b''.join([chunk for chunk in wavs])
+            chunks = []
+            while (chunk := await self.next_segment(wavs, priority, estimate.total_seconds)) is not None:
+                chunks.append(chunk)
+            synthesized_audio = b''.join(chunks)
             timestamps = self.generate_timestamps(text, synthesized_audio)
             logging.info("TTS with timestamps generation successful")
             return synthesized_audio, timestamps
@@ -7,8 +7,15 @@ import torch
 from openai import AsyncOpenAI
 import asyncio
 import logging
+import random
+import re
 import socket
+import threading
 from transformers import StoppingCriteria, StoppingCriteriaList
+from inference.scheduler import DEFAULT_LANE
+from inference.metrics import LLM_TOKENS_PER_SECOND
+from inference.tracing import record_stage
+from sovits.weights import has_safetensors, pretrained_kwargs, timed_load
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -26,10 +33,36 @@ class EosReachedCriteria(StoppingCriteria):
         return False
     
 
+class CancelledCriteria(StoppingCriteria):
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+
+_llama_clients = {}
+
+def get_llama_client(llama_port):
+    # One client per port so connections are pooled instead of opened per sentence
+    if llama_port not in _llama_clients:
+        _llama_clients[llama_port] = AsyncOpenAI(api_key="EMPTY", base_url=f"http://localhost:{llama_port}/v1")
+    return _llama_clients[llama_port]
+
+
+def observe_llm_sentence(start, generated_text):
+    seconds = time.perf_counter() - start
+    tokens = generated_text.count("<|audio_token_")
+    record_stage("llm_sentence", seconds, tokens=tokens)
+    if seconds > 0:
+        LLM_TOKENS_PER_SECOND.observe(tokens / seconds)
+
+
 async def send_request_llama(model_type, prompt_text, llama_port, temperature=1.0, repetition_penalty=1.0):
-    # Call the OpenAI ChatCompletion endpoint asynchronously
-    url_chat = f"http://localhost:{llama_port}/v1"
-    client = AsyncOpenAI(api_key="EMPTY", base_url=url_chat)
+    # Call the OpenAI ChatCompletion endpoint asynchronously.
+    # Cancelling this coroutine closes its HTTP request, and vLLM aborts the generation
+    # of requests whose client has disconnected.
+    client = get_llama_client(llama_port)
     
     if model_type == "base":
         response = await client.completions.create(
@@ -60,15 +93,19 @@ async def send_request_llama(model_type, prompt_text, llama_port, temperature=1.
         return response.choices[0].message.content
 
 class InferenceLlamaVllm:
-    def __init__(self, model_path, model_type):
+    def __init__(self, model_path, model_type, scheduler=None):
         self.llama_port = self._get_available_port()
         self.model_type = model_type
+        # Optional PriorityScheduler; each sentence takes one slot
+        self.scheduler = scheduler
         os.makedirs('logs', exist_ok=True)
 
         pid_file = "logs/vllm_pid.txt"
+        # vLLM reads safetensors weights by mmap when the model directory has them
+        load_format = "--load-format safetensors " if has_safetensors(model_path) else ""
         cmd = (
             f"python -m vllm.entrypoints.openai.api_server "
-            f"--model {model_path} --served-model-name llamaar --enable-prefix-caching "
+            f"--model {model_path} --served-model-name llamaar --enable-prefix-caching {load_format}"
             f"--host 0.0.0.0 --port {self.llama_port} > logs/llm.log 2>&1 & echo $! > {pid_file}"
         )
 
@@ -82,7 +119,8 @@ class InferenceLlamaVllm:
 
         logging.info("initializing llama, it may take some time...")
 
-        self._wait_for_service(self.llama_port, timeout=300)
+        with timed_load("llama"):
+            self._wait_for_service(self.llama_port, timeout=300)
         logging.info(f"init llama finish in IPD:{self.pid}")
         
     def _is_port_available(self, port):
@@ -123,10 +161,29 @@ class InferenceLlamaVllm:
             time.sleep(1) 
         raise TimeoutError("Service startup timeout!")
     
-    async def cal_tts(self, batch_prompts, temperature, repetition_penalty):
-        tasks = [send_request_llama(self.model_type, prompt, self.llama_port, temperature, repetition_penalty) for prompt in batch_prompts]
-            
-        results = await asyncio.gather(*tasks)
+    async def _timed_request(self, prompt, temperature, repetition_penalty):
+        start = time.perf_counter()
+        result = await send_request_llama(self.model_type, prompt, self.llama_port, temperature, repetition_penalty)
+        observe_llm_sentence(start, result)
+        return result
+
+    async def _send_request(self, prompt, temperature, repetition_penalty, priority, cost):
+        if self.scheduler is None:
+            return await self._timed_request(prompt, temperature, repetition_penalty)
+        async with self.scheduler.slot(priority, cost):
+            return await self._timed_request(prompt, temperature, repetition_penalty)
+
+    async def cal_tts(self, batch_prompts, temperature, repetition_penalty, priority=DEFAULT_LANE, cost=0.0):
+        # cost: expected seconds of the whole request, orders sentences within a priority lane
+        tasks = [asyncio.create_task(self._send_request(prompt, temperature, repetition_penalty, priority, cost)) for prompt in batch_prompts]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # On cancellation or a failed sentence, abort every completion still running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
         
         return results
 
@@ -142,46 +199,130 @@ class InferenceLlamaVllm:
         return timestamps
 
 
+class InferenceLlamaFake:
+    """
+    Stand-in for the Llama backends in load tests and CPU-only runs. Emits random audio
+    tokens (seeded by the prompt, so runs are repeatable) in proportion to the words of
+    the prompt, after sleeping for the time a real backend would take to generate them.
+    For base prompts the word count includes the reference prompt text.
+    """
+    def __init__(self, model_path=None, model_type="base", scheduler=None,
+                 tokens_per_word=6.0, seconds_per_token=None, first_token_seconds=0.02, codebook_size=1024):
+        self.model_type = model_type
+        self.scheduler = scheduler
+        self.tokens_per_word = tokens_per_word
+        if seconds_per_token is None:
+            seconds_per_token = float(os.getenv("TTS_FAKE_LLM_SECONDS_PER_TOKEN", "0.01"))
+        self.seconds_per_token = seconds_per_token
+        self.first_token_seconds = first_token_seconds
+        self.codebook_size = codebook_size
+
+    def _completion(self, prompt):
+        text = re.sub(r"<\|.+?\|>", " ", prompt)
+        num_tokens = max(1, int(len(text.split()) * self.tokens_per_word))
+        rng = random.Random(prompt)
+        return "".join(f"<|audio_token_{rng.randrange(self.codebook_size)}|>" for _ in range(num_tokens)) \
+            + "<|audio_token_end|>"
+
+    async def cal_tts(self, batch_prompts, temperature=1.0, repetition_penalty=1.0, priority=DEFAULT_LANE, cost=0.0):
+        async def process_prompt(prompt):
+            start = time.perf_counter()
+            generated_text = self._completion(prompt)
+            tokens = generated_text.count("<|audio_token_") - 1
+            await asyncio.sleep(self.first_token_seconds + tokens * self.seconds_per_token)
+            observe_llm_sentence(start, generated_text)
+            return generated_text
+
+        async def scheduled_prompt(prompt):
+            if self.scheduler is None:
+                return await process_prompt(prompt)
+            async with self.scheduler.slot(priority, cost):
+                return await process_prompt(prompt)
+
+        return await asyncio.gather(*[scheduled_prompt(prompt) for prompt in batch_prompts],
+                                    return_exceptions=True)
+
+    def generate_timestamps(self, text, synthesized_audio):
+        words = text.split()
+        num_words = len(words)
+        duration = len(synthesized_audio) / 16000  # Assuming 16kHz sample rate
+        return [(word, (i / num_words) * duration, ((i + 1) / num_words) * duration)
+                for i, word in enumerate(words)]
+
+
 class InferenceLlamaHf:
-    def __init__(self, model_path, model_type):
+    def __init__(self, model_path, model_type, scheduler=None):
         self.device = torch.device(f"cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.llama = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16, 
-            trust_remote_code=True     
-        ).to(self.device)
+        with timed_load("llama"):
+            self.llama = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.float16, 
+                trust_remote_code=True,
+                **pretrained_kwargs(model_path)
+            ).to(self.device)
         
         self.model_type = model_type
-        
-    async def cal_tts(self, batch_prompts, temperature=1.0, repetition_penalty=1.0):
+        # Optional PriorityScheduler; each sentence takes one slot
+        self.scheduler = scheduler
+        # max_length of the generations currently running, for KV cache accounting
+        self.max_length = 1024
+        self.inflight_tokens = 0
+
+    def kv_cache_bytes(self):
+        """Upper bound of the KV cache held by running generations (every one at max_length)."""
+        config = self.llama.config
+        num_kv_heads = getattr(config, "num_key_value_heads", config.num_attention_heads)
+        head_dim = config.hidden_size // config.num_attention_heads
+        bytes_per_token = 2 * config.num_hidden_layers * num_kv_heads * head_dim * self.llama.dtype.itemsize
+        return bytes_per_token * self.inflight_tokens
+
+    async def cal_tts(self, batch_prompts, temperature=1.0, repetition_penalty=1.0, priority=DEFAULT_LANE, cost=0.0):
         results = []
         stop_sequences_str = ["<|audio_token_end|>", "<|end_header_id|>", "<|end_of_text|>"]
         stop_token_ids_list = [self.tokenizer.encode(seq_str, add_special_tokens=False) for seq_str in stop_sequences_str]
         custom_stopping_criteria = EosReachedCriteria(stop_token_ids_list=stop_token_ids_list)
-        stopping_criteria_list = StoppingCriteriaList([custom_stopping_criteria])
+        # Set on cancellation: running and not yet started generations stop at the next token
+        cancel_event = threading.Event()
+        stopping_criteria_list = StoppingCriteriaList([custom_stopping_criteria, CancelledCriteria(cancel_event)])
         
         async def process_prompt(prompt):
             inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
             input_ids = inputs["input_ids"]
             input_length = input_ids.shape[1]
+            start = time.perf_counter()
             
-            with torch.no_grad():
-                outputs = await asyncio.to_thread(
-                    self.llama.generate,
-                    **inputs,
-                    max_length=1024,
-                    temperature=temperature,
-                    repetition_penalty=repetition_penalty,
-                    stopping_criteria=stopping_criteria_list
-                )
+            self.inflight_tokens += self.max_length
+            try:
+                with torch.no_grad():
+                    outputs = await asyncio.to_thread(
+                        self.llama.generate,
+                        **inputs,
+                        max_length=self.max_length,
+                        temperature=temperature,
+                        repetition_penalty=repetition_penalty,
+                        stopping_criteria=stopping_criteria_list
+                    )
+            finally:
+                self.inflight_tokens -= self.max_length
             
             generated_tokens = outputs[0][input_length:]
             generated_text = self.tokenizer.decode(generated_tokens, skip_special_tokens=False)
+            observe_llm_sentence(start, generated_text)
             return generated_text
 
-        tasks = [process_prompt(prompt) for prompt in batch_prompts]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        async def scheduled_prompt(prompt):
+            if self.scheduler is None:
+                return await process_prompt(prompt)
+            async with self.scheduler.slot(priority, cost):
+                return await process_prompt(prompt)
+
+        tasks = [scheduled_prompt(prompt) for prompt in batch_prompts]
+        try:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
         
         return results
 
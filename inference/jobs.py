@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from sovits.output import WAV_HEADER_SIZE
+from sovits.utils import get_normed_text, wav_header
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class JobStore:
+    """
+    SQLite-backed store for long-form synthesis jobs.
+    Each job keeps its split sentences and a checkpoint (sentences done, PCM bytes written),
+    so a restarted worker can resume from the last finished sentence.
+    """
+    def __init__(self, db_path="logs/jobs.db", output_dir="logs/jobs"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, "
+                "sentences TEXT NOT NULL, total INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0, "
+                "bytes_written INTEGER NOT NULL DEFAULT 0, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def output_path(self, job_id):
+        return os.path.join(self.output_dir, f"{job_id}.wav")
+
+    def create(self, params, sentences):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, status, params, sentences, total, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, json.dumps(params), json.dumps(sentences), len(sentences), now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def pending(self):
+        """Jobs that were queued or interrupted mid-run, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def set_status(self, job_id, status, error=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def checkpoint(self, job_id, done, bytes_written):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET done = ?, bytes_written = ?, updated_at = ? WHERE id = ?",
+                (done, bytes_written, time.time(), job_id),
+            )
+
+
+class JobWorkerPool:
+    """
+    Runs queued jobs on num_workers asyncio workers.
+    Audio is appended to the job's WAV file one sentence at a time and the header is
+    patched on completion, so memory use does not grow with the length of the text.
+    """
+    def __init__(self, tts, store, num_workers=2):
+        self.tts = tts
+        self.store = store
+        self.num_workers = num_workers
+        self.queue = asyncio.Queue()
+        self.workers = []
+
+    def start(self):
+        for job_id in self.store.pending():
+            logging.info(f"resuming job {job_id}")
+            self.queue.put_nowait(job_id)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def _prepare_text(self, prompt_text, text):
+        return get_normed_text(prompt_text, 'en', 'v1'), self.tts._split_sentences(text)
+
+    async def submit(self, ref_wav_path, prompt_text, text, temperature=1.0, repetition_penalty=1.0,
+                     speed=1.0, scaling_factor=1.0, priority="bulk"):
+        # Normalization and sentence splitting run in a thread, off the event loop
+        prompt_text, sentences = await asyncio.to_thread(self._prepare_text, prompt_text, text)
+        params = {
+            "priority": priority,
+            "ref_wav_path": ref_wav_path,
+            "prompt_text": prompt_text,
+            "temperature": temperature,
+            "repetition_penalty": repetition_penalty,
+            "speed": speed,
+            "scaling_factor": scaling_factor,
+        }
+        job_id = self.store.create(params, sentences)
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"job {job_id} failed: {str(e)}")
+                self.store.set_status(job_id, JOB_FAILED, str(e))
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None or job["status"] in (JOB_COMPLETED, JOB_FAILED):
+            return
+        params = json.loads(job["params"])
+        sentences = json.loads(job["sentences"])
+        self.store.set_status(job_id, JOB_RUNNING)
+        processor = self.tts.sovits_processor
+
+        path = self.store.output_path(job_id)
+        done = job["done"]
+        bytes_written = job["bytes_written"]
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            # Drop anything written after the last checkpoint
+            f.truncate(WAV_HEADER_SIZE + bytes_written)
+            f.seek(0)
+            f.write(wav_header(bytes_written, processor.sampling_rate, processor.is_int32))
+            f.seek(0, os.SEEK_END)
+            for i in range(done, len(sentences)):
+                pcm = await self.tts.generate_sentence_pcm(
+                    params["ref_wav_path"], params["prompt_text"], sentences[i],
+                    temperature=params["temperature"], repetition_penalty=params["repetition_penalty"],
+                    speed=params["speed"], scaling_factor=params["scaling_factor"],
+                    priority=params.get("priority", "bulk"),
+                )
+                f.write(pcm)
+                f.flush()
+                os.fsync(f.fileno())
+                bytes_written += len(pcm)
+                self.store.checkpoint(job_id, i + 1, bytes_written)
+            f.seek(0)
+            f.write(wav_header(bytes_written, processor.sampling_rate, processor.is_int32))
+        self.store.set_status(job_id, JOB_COMPLETED)
+        logging.info(f"job {job_id} completed, {len(sentences)} sentences")
@@ -0,0 +1,232 @@
+import gc
+import logging
+import os
+import sys
+import threading
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+_UNITS = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_bytes(value, total=None):
+    """
+    Parses "512M", "8G", "1073741824" or, when total is known, "80%". Empty means no limit.
+    """
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value.endswith("%"):
+        if total is None:
+            return None
+        return int(total * float(value[:-1]) / 100)
+    value = value.rstrip("ib").rstrip("b")
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(float(value))
+
+
+def object_bytes(obj):
+    """Bytes held by tensors, arrays, strings and bytes nested in lists, tuples and dicts."""
+    if hasattr(obj, "element_size") and hasattr(obj, "nelement"):
+        return obj.element_size() * obj.nelement()
+    if hasattr(obj, "nbytes"):
+        return obj.nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum(object_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(object_bytes(item) for item in obj.values())
+    if isinstance(obj, (str, bytes, bytearray)):
+        return sys.getsizeof(obj)
+    return 0
+
+
+def module_bytes(module):
+    """Parameter and buffer bytes of a torch module."""
+    if module is None:
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.element_size() * t.nelement() for t in tensors)
+
+
+def evict_oldest(cache, fraction):
+    """
+    Drops the oldest `fraction` of a dict cache (insertion order) and returns how many
+    entries were removed. Readers use cache.get(), so concurrent eviction is safe.
+    """
+    keys = list(cache.keys())
+    count = int(len(keys) * fraction + 0.999)
+    for key in keys[:count]:
+        cache.pop(key, None)
+    return count
+
+
+def process_memory():
+    """Resident set size and its peak from /proc/self/status, in bytes."""
+    result = {"rss": None, "peak_rss": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    result["peak_rss"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return result
+
+
+def cgroup_limit():
+    """Memory limit of the container (cgroup v2, then v1), or None when unlimited."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == "max":
+            return None
+        limit = int(value)
+        # cgroup v1 reports a huge number when unlimited
+        return limit if limit < 1 << 60 else None
+    return None
+
+
+def cuda_memory():
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return {
+        "allocated": torch.cuda.memory_allocated(),
+        "reserved": torch.cuda.memory_reserved(),
+        "peak_allocated": torch.cuda.max_memory_allocated(),
+        "total": torch.cuda.get_device_properties(0).total_memory,
+    }
+
+
+class MemoryAccountant:
+    """
+    Reports bytes held by models, caches and in-flight buffers, tracks the peak of each,
+    and evicts caches once process RSS or CUDA allocated memory passes a soft limit.
+    Components are registered as callables so a snapshot always reads current sizes.
+    """
+    def __init__(self, soft_limit=None, cuda_soft_limit=None, evict_fraction=0.5):
+        """
+        :param soft_limit: RSS in bytes above which caches are evicted
+        :param cuda_soft_limit: CUDA allocated bytes above which caches are evicted
+        :param evict_fraction: share of each cache dropped per enforcement
+        """
+        self.soft_limit = soft_limit
+        self.cuda_soft_limit = cuda_soft_limit
+        self.evict_fraction = evict_fraction
+        self.models = {}
+        self.caches = {}
+        self.inflight_sources = {}
+        self.buffers = {}
+        self.peaks = {}
+        self.evictions = 0
+        self.last_snapshot = {}
+        self.lock = threading.Lock()
+
+    def register_model(self, name, size_fn):
+        self.models[name] = size_fn
+
+    def register_cache(self, name, size_fn, evict_fn):
+        """
+        :param evict_fn: callable(fraction) dropping that share of entries
+        """
+        self.caches[name] = (size_fn, evict_fn)
+
+    def register_inflight(self, name, size_fn):
+        self.inflight_sources[name] = size_fn
+
+    def add_buffer(self, kind, nbytes):
+        """Accounts an in-flight audio buffer; pair with release_buffer."""
+        with self.lock:
+            self.buffers[kind] = self.buffers.get(kind, 0) + nbytes
+            self._update_peak(f"inflight.{kind}", self.buffers[kind])
+
+    def release_buffer(self, kind, nbytes):
+        with self.lock:
+            self.buffers[kind] = self.buffers.get(kind, 0) - nbytes
+
+    def _update_peak(self, key, value):
+        if value is not None and value > self.peaks.get(key, 0):
+            self.peaks[key] = value
+
+    def _read(self, size_fn):
+        try:
+            return size_fn()
+        except Exception as e:
+            logging.warning(f"memory accounting failed: {e}")
+            return None
+
+    def snapshot(self):
+        process = process_memory()
+        limit = cgroup_limit()
+        snapshot = {
+            "process": dict(process, cgroup_limit=limit),
+            "cuda": cuda_memory(),
+            "models": {name: self._read(fn) for name, fn in self.models.items()},
+            "caches": {name: self._read(size_fn) for name, (size_fn, _) in self.caches.items()},
+            "inflight": {name: self._read(fn) for name, fn in self.inflight_sources.items()},
+        }
+        with self.lock:
+            snapshot["inflight"].update(self.buffers)
+            self._update_peak("process.rss", process["rss"])
+            if snapshot["cuda"] is not None:
+                self._update_peak("cuda.allocated", snapshot["cuda"]["allocated"])
+            for section in ("models", "caches", "inflight"):
+                for name, value in snapshot[section].items():
+                    self._update_peak(f"{section}.{name}", value)
+            snapshot["peaks"] = dict(self.peaks)
+        snapshot["soft_limits"] = {"rss": self.soft_limit, "cuda": self.cuda_soft_limit}
+        snapshot["evictions"] = self.evictions
+        self.last_snapshot = snapshot
+        return snapshot
+
+    def over_limit(self, snapshot):
+        rss = snapshot["process"]["rss"]
+        if self.soft_limit and rss is not None and rss > self.soft_limit:
+            return f"rss {rss} > {self.soft_limit}"
+        cuda = snapshot["cuda"]
+        if self.cuda_soft_limit and cuda is not None and cuda["allocated"] > self.cuda_soft_limit:
+            return f"cuda allocated {cuda['allocated']} > {self.cuda_soft_limit}"
+        return None
+
+    def enforce(self, snapshot=None):
+        """
+        Evicts caches when a soft limit is exceeded. Returns the reason, or None.
+        """
+        snapshot = snapshot or self.snapshot()
+        reason = self.over_limit(snapshot)
+        if reason is None:
+            return None
+        removed = {name: evict_fn(self.evict_fraction) for name, (_, evict_fn) in self.caches.items()}
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.evictions += 1
+        logging.warning(f"memory soft limit exceeded ({reason}), evicted cache entries: {removed}")
+        return reason
+
+    def log_line(self, snapshot):
+        mb = lambda v: "-" if v is None else f"{v / (1 << 20):.0f}M"
+        parts = [f"rss={mb(snapshot['process']['rss'])}", f"peak_rss={mb(snapshot['process']['peak_rss'])}"]
+        if snapshot["cuda"] is not None:
+            parts.append(f"cuda={mb(snapshot['cuda']['allocated'])}")
+            parts.append(f"cuda_peak={mb(snapshot['cuda']['peak_allocated'])}")
+        for section in ("models", "caches", "inflight"):
+            parts.extend(f"{name}={mb(value)}" for name, value in snapshot[section].items())
+        return "memory " + " ".join(parts)
+
+
+def accountant_from_env():
+    limit = cgroup_limit()
+    cuda = cuda_memory()
+    return MemoryAccountant(
+        soft_limit=parse_bytes(os.getenv("TTS_MEMORY_SOFT_LIMIT"), limit),
+        cuda_soft_limit=parse_bytes(os.getenv("TTS_CUDA_MEMORY_SOFT_LIMIT"), cuda["total"] if cuda else None),
+        evict_fraction=float(os.getenv("TTS_CACHE_EVICT_FRACTION", "0.5")),
+    )
@@ -0,0 +1,234 @@
+import bisect
+import threading
+import time
+
+# Prometheus text exposition without external dependencies. Observing a value is a
+# bisect plus two additions; formatting only happens when /metrics is scraped.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATIO_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *labelvalues):
+        child = self.children.get(labelvalues)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for labelvalues, child in list(self.children.items()):
+            lines.extend(self._child_lines(labelvalues, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self.children[()].inc(amount)
+
+    def _child_lines(self, labelvalues, child):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}"]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def dec(self, amount=1.0):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def inc(self, amount=1.0):
+        self.children[()].inc(amount)
+
+    def dec(self, amount=1.0):
+        self.children[()].dec(amount)
+
+    def _child_lines(self, labelvalues, child):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}"]
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def _child_lines(self, labelvalues, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose samples are read from fn() at scrape time, for values that are
+    already tracked elsewhere (queue lengths, cache hit counts). fn returns a list of
+    (labelvalues tuple, value) pairs.
+    """
+    def __init__(self, name, documentation, type_name, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.type_name = type_name
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for labelvalues, value in self.fn():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type_name, labelnames, fn):
+        return self.register(CallbackMetric(name, documentation, type_name, labelnames, fn))
+
+    def exposition(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "tts_stage_seconds", "Latency of each synthesis pipeline stage.", ["stage"])
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "tts_llm_tokens_per_second", "Audio tokens generated per second for each LLM sentence.",
+    buckets=RATE_BUCKETS)
+DECODE_SECONDS_PER_AUDIO_SECOND = REGISTRY.histogram(
+    "tts_sovits_decode_seconds_per_audio_second", "SoVITS decode time per second of produced audio.",
+    buckets=RATIO_BUCKETS)
+TIME_TO_FIRST_BYTE_SECONDS = REGISTRY.histogram(
+    "tts_time_to_first_byte_seconds", "Time from request arrival to the first audio byte.")
+REAL_TIME_FACTOR = REGISTRY.histogram(
+    "tts_real_time_factor", "Request wall time divided by produced audio duration.",
+    buckets=RATIO_BUCKETS)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "tts_requests_total", "Synthesis requests by endpoint and outcome.", ["endpoint", "outcome"])
+
+
+def observe_stage(stage, seconds, audio_seconds=None):
+    """Stage observer for Processor.stage_observer and the inference pipeline."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if audio_seconds:
+        DECODE_SECONDS_PER_AUDIO_SECOND.observe(seconds / audio_seconds)
@@ -0,0 +1,316 @@
+import collections
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+PROFILE_DIR = os.getenv("TTS_PROFILE_DIR", "logs/profiles")
+PROFILE_MODES = ("torch", "sampling", "both")
+
+# Hot paths that get a torch.profiler.record_function label while a session is armed.
+# They are patched in on arm and restored on disarm, so a disarmed server runs the
+# original functions with no wrapper at all.
+PROFILE_TARGETS = [
+    ("sovits.process", "Processor", "get_tts_wav", "Processor.get_tts_wav"),
+    ("sovits.models", "SynthesizerTrn", "decode", "SynthesizerTrn.decode"),
+    # Processor.generate_audio_token calls the inner HubertModel, not CNHubert.forward
+    ("transformers.models.hubert.modeling_hubert", "HubertModel", "forward", "HubertModel.forward"),
+    ("transformers.generation.utils", "GenerationMixin", "generate", "hf_generate"),
+]
+
+
+@contextlib.contextmanager
+def _worker_profiling(autograd):
+    """
+    Enables the running torch profiler on the calling thread for the duration of a labelled
+    call. Its callbacks are thread-local, so ops on to_thread workers (SoVITS decode, HF
+    generate) are otherwise missing from the trace.
+    """
+    enabled = False
+    if not autograd._profiler_enabled():
+        try:
+            autograd._enable_profiler_on_thread()
+            enabled = True
+        except RuntimeError:
+            # The session stopped between the check and this call
+            pass
+    try:
+        yield
+    finally:
+        if enabled:
+            try:
+                autograd._disable_profiler_on_thread()
+            except RuntimeError:
+                pass
+
+
+@contextlib.contextmanager
+def _profiled(label, record_function, autograd=None):
+    with contextlib.ExitStack() as stack:
+        if autograd is not None:
+            stack.enter_context(_worker_profiling(autograd))
+        stack.enter_context(record_function(label))
+        yield
+
+
+def _label_function(fn, label, record_function):
+    """
+    :param record_function: context manager factory taking the label, e.g. _profiled
+    """
+    if inspect.isgeneratorfunction(fn):
+        # get_tts_wav is a generator resumed from different worker threads,
+        # so each resumption is labelled rather than the generator lifetime
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            gen = fn(*args, **kwargs)
+            while True:
+                with record_function(label):
+                    try:
+                        item = next(gen)
+                    except StopIteration as e:
+                        return e.value
+                yield item
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with record_function(label):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class StackSampler:
+    """
+    Sampling Python profiler: a daemon thread records the stack of every other thread
+    each `interval` seconds, aggregated in collapsed-stack (flamegraph.pl / speedscope) form.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    def __init__(self, mode, requests, seconds, output_dir, interval):
+        self.id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.mode = mode
+        self.requests = requests
+        self.seconds = seconds
+        self.output_dir = output_dir
+        self.interval = interval
+        self.started_at = time.time()
+        self.requests_done = 0
+        self.torch_profiler = None
+        self.torch_thread = None
+        self.torch_stop = threading.Event()
+        self.torch_error = None
+        self.sampler = None
+        self.timer = None
+        self.files = []
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "requests": self.requests,
+            "seconds": self.seconds,
+            "requests_done": self.requests_done,
+            "elapsed_seconds": time.time() - self.started_at,
+        }
+
+
+class Profiler:
+    """
+    Arms torch.profiler and/or the stack sampler for the next N requests or T seconds,
+    whichever comes first, then writes <id>.trace.json (Chrome trace, open in
+    chrome://tracing or Perfetto) and <id>.collapsed.txt (flamegraph input) to output_dir.
+    When disarmed the only cost is the `session is None` check in request_finished.
+    """
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.output_dir = output_dir
+        self.session = None
+        self.last_result = None
+        self.originals = []
+        self.lock = threading.Lock()
+
+    def arm(self, requests=None, seconds=None, mode="both", interval=0.005):
+        """
+        :param requests: stop after this many finished requests
+        :param seconds: stop after this many seconds; defaults to 60 when requests is not given
+        :param mode: "torch", "sampling" or "both"
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: '{mode}'. Expected one of {PROFILE_MODES}")
+        if requests is None and seconds is None:
+            seconds = 60
+        with self.lock:
+            if self.session is not None:
+                raise RuntimeError(f"Profile session {self.session.id} is already armed")
+            os.makedirs(self.output_dir, exist_ok=True)
+            session = ProfileSession(mode, requests, seconds, self.output_dir, interval)
+            if mode in ("torch", "both"):
+                self._start_torch(session)
+            if mode in ("sampling", "both"):
+                session.sampler = StackSampler(interval)
+                session.sampler.start()
+            if seconds is not None:
+                session.timer = threading.Timer(seconds, self.disarm)
+                session.timer.daemon = True
+                session.timer.start()
+            self.session = session
+        logging.info(f"profile session {session.id} armed: mode={mode}, requests={requests}, seconds={seconds}")
+        return session.to_dict()
+
+    def _start_torch(self, session):
+        import torch
+        from torch.profiler import ProfilerActivity, profile, record_function
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        session.torch_profiler = profile(activities=activities, record_shapes=True, with_stack=True)
+        started = threading.Event()
+        session.torch_thread = threading.Thread(target=self._run_torch, args=(session, started),
+                                                name="torch-profiler", daemon=True)
+        session.torch_thread.start()
+        started.wait()
+        if session.torch_error is not None:
+            raise RuntimeError(f"torch profiler failed to start: {session.torch_error}")
+        autograd = torch._C._autograd
+        if not hasattr(autograd, "_enable_profiler_on_thread"):
+            logging.info("this torch cannot profile worker threads; the trace covers the profiler thread only")
+            autograd = None
+        self._patch_targets(functools.partial(_profiled, record_function=record_function, autograd=autograd))
+
+    def _run_torch(self, session, started):
+        """
+        Enters and exits the torch profiler on one thread: its state is thread-local, so
+        __exit__ on any other thread (the timer, request_finished, the DELETE handler) fails.
+        """
+        profiler = session.torch_profiler
+        try:
+            profiler.__enter__()
+        except Exception as e:
+            session.torch_error = e
+            return
+        finally:
+            started.set()
+        session.torch_stop.wait()
+        try:
+            profiler.__exit__(None, None, None)
+            path = os.path.join(session.output_dir, f"{session.id}.trace.json")
+            profiler.export_chrome_trace(path)
+            session.files.append(path)
+        except Exception as e:
+            session.torch_error = e
+
+    def _patch_targets(self, record_function):
+        for module_name, class_name, attr, label in PROFILE_TARGETS:
+            try:
+                owner = getattr(importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError):
+                logging.info(f"profile target {module_name}.{class_name}.{attr} unavailable, skipping")
+                continue
+            original = owner.__dict__[attr]
+            self.originals.append((owner, attr, original))
+            setattr(owner, attr, _label_function(original, label, record_function))
+
+    def _restore_targets(self):
+        while self.originals:
+            owner, attr, original = self.originals.pop()
+            setattr(owner, attr, original)
+
+    def request_finished(self):
+        session = self.session
+        if session is None or session.requests is None:
+            return
+        with self.lock:
+            session.requests_done += 1
+            done = session.requests_done >= session.requests
+        if done:
+            # Called from request handlers on the event loop; stopping the profiler and
+            # exporting the trace with stacks can take seconds, so it runs on its own thread
+            threading.Thread(target=self.disarm, name="profile-disarm", daemon=True).start()
+
+    def disarm(self):
+        """Stops the armed session, writes its files and returns a summary, or None if not armed."""
+        with self.lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            if session.timer is not None:
+                session.timer.cancel()
+            try:
+                if session.torch_thread is not None:
+                    session.torch_stop.set()
+                    session.torch_thread.join()
+                    if session.torch_error is not None:
+                        logging.error(f"profile session {session.id}: torch profiler failed: {session.torch_error}")
+                if session.sampler is not None:
+                    session.sampler.stop()
+                    path = os.path.join(session.output_dir, f"{session.id}.collapsed.txt")
+                    session.sampler.write_collapsed(path)
+                    session.files.append(path)
+            finally:
+                # Patched targets never outlive the session, even when the profiler failed
+                self._restore_targets()
+            result = dict(session.to_dict(), files=session.files)
+            with open(os.path.join(session.output_dir, f"{session.id}.json"), "w") as f:
+                json.dump(result, f, indent=2)
+            self.last_result = result
+        logging.info(f"profile session {session.id} written: {session.files}")
+        return result
+
+    def status(self):
+        session = self.session
+        return {
+            "armed": session is not None,
+            "session": session.to_dict() if session is not None else None,
+            "last_result": self.last_result,
+        }
+
+
+PROFILER = Profiler()
@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_LANE = "interactive"
+DEFAULT_LANE_WEIGHTS = {"interactive": 8, "bulk": 1}
+
+
+def lane_weights_from_env(env_var="TTS_LANE_WEIGHTS"):
+    """
+    Parses lane weights such as "interactive:8,bulk:1"; falls back to DEFAULT_LANE_WEIGHTS.
+    """
+    value = os.getenv(env_var)
+    if not value:
+        return dict(DEFAULT_LANE_WEIGHTS)
+    weights = {}
+    for item in value.split(","):
+        lane, weight = item.split(":")
+        weights[lane.strip()] = float(weight)
+    return weights
+
+
+class LaneStats:
+    def __init__(self):
+        self.granted = 0
+        self.queued = 0
+        self.running = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def to_dict(self):
+        return {
+            "granted": self.granted,
+            "queued": self.queued,
+            "running": self.running,
+            "mean_wait_seconds": self.wait_seconds / self.granted if self.granted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class PriorityScheduler:
+    """
+    Hands out `concurrency` slots across priority lanes with weighted fair sharing: a lane
+    with weight w gets w slots for every one slot of a weight-1 lane while both are waiting.
+    Callers take one slot per sentence (or decode segment), so a long bulk request yields to
+    interactive work at every sentence boundary.
+    Within a lane, waiters are served shortest expected job first: the one with the smallest
+    cost - aging_rate * seconds_waited, so expensive requests are not starved.
+    """
+    def __init__(self, name, concurrency, weights=None, aging_rate=1.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.aging_rate = aging_rate
+        self.weights = dict(weights or DEFAULT_LANE_WEIGHTS)
+        self.waiters = {lane: [] for lane in self.weights}
+        self.vtime = {lane: 0.0 for lane in self.weights}
+        self.stats = {lane: LaneStats() for lane in self.weights}
+        self.clock = 0.0
+        self.running = 0
+
+    def check_lane(self, lane):
+        if lane not in self.weights:
+            raise ValueError(f"Unknown priority lane: '{lane}'. Expected one of {sorted(self.weights)}")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane=DEFAULT_LANE, cost=0.0):
+        await self.acquire(lane, cost)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    async def acquire(self, lane=DEFAULT_LANE, cost=0.0):
+        """
+        :param cost: expected seconds of the whole request, used for ordering within the lane
+        """
+        self.check_lane(lane)
+        enqueued_at = time.monotonic()
+        if not self.waiters[lane]:
+            # A lane that was idle does not bank credit for the time it was idle; this applies
+            # to uncontended grants too, or they would move the clock back
+            self.vtime[lane] = max(self.vtime[lane], self.clock)
+        if self.running < self.concurrency and not any(self.waiters.values()):
+            self._grant(lane, enqueued_at)
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, enqueued_at, cost)
+        self.waiters[lane].append(entry)
+        self.stats[lane].queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(lane)
+            elif entry in self.waiters[lane]:
+                self.waiters[lane].remove(entry)
+                self.stats[lane].queued -= 1
+            raise
+
+    def release(self, lane=DEFAULT_LANE):
+        self.running -= 1
+        self.stats[lane].running -= 1
+        self._dispatch()
+
+    def _grant(self, lane, enqueued_at):
+        waited = time.monotonic() - enqueued_at
+        stats = self.stats[lane]
+        stats.granted += 1
+        stats.running += 1
+        stats.wait_seconds += waited
+        stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+        self.running += 1
+        self.clock = self.vtime[lane]
+        self.vtime[lane] += 1.0 / self.weights[lane]
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            lanes = [lane for lane, waiters in self.waiters.items() if waiters]
+            if not lanes:
+                return
+            lane = min(lanes, key=lambda l: self.vtime[l])
+            now = time.monotonic()
+            waiters = self.waiters[lane]
+            index = min(range(len(waiters)),
+                        key=lambda i: waiters[i][2] - self.aging_rate * (now - waiters[i][1]))
+            future, enqueued_at, _ = waiters.pop(index)
+            self.stats[lane].queued -= 1
+            if future.done():
+                continue
+            self._grant(lane, enqueued_at)
+            future.set_result(True)
+
+    def lane_stats(self):
+        return {lane: stats.to_dict() for lane, stats in self.stats.items()}
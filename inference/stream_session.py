@@ -0,0 +1,65 @@
+import logging
+
+from sovits.utils import get_normed_text, split_committed_text
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+class TTSStreamSession:
+    """
+    Incremental text-in, PCM-out synthesis for one speaker.
+    Text fragments are buffered until a sentence boundary is confirmed; committed text is held
+    back until it reaches min_words (the same minimum Inference uses when merging sentences),
+    unless the session is flushed.
+    """
+    def __init__(self, tts, ref_wav_path, prompt_text, temperature=1.0, repetition_penalty=1.0,
+                 speed=1.0, scaling_factor=1.0, min_words=12):
+        self.tts = tts
+        self.ref_wav_path = ref_wav_path
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.speed = speed
+        self.scaling_factor = scaling_factor
+        self.min_words = min_words
+        self.buffer = ""
+        self.committed = ""
+
+        # Keep the speaker reference warm for the whole session
+        processor = tts.sovits_processor
+        processor.generate_audio_token(ref_wav_path)
+        processor.get_refers([ref_wav_path])
+        self.prompt_text = get_normed_text(prompt_text, 'en', 'v1')
+
+    def feed(self, fragment):
+        """
+        Adds a text fragment and returns the sentences that are ready for synthesis.
+        """
+        self.buffer += fragment
+        committed, self.buffer = split_committed_text(self.buffer)
+        if not committed:
+            return []
+        self.committed += committed
+        if len(self.committed.split()) < self.min_words:
+            return []
+        return self._take_committed()
+
+    def flush(self):
+        """
+        Returns all remaining text as sentences, regardless of boundaries and length.
+        """
+        self.committed += self.buffer
+        self.buffer = ""
+        return self._take_committed()
+
+    def _take_committed(self):
+        text, self.committed = self.committed.strip(), ""
+        if not text:
+            return []
+        return self.tts._split_sentences(text)
+
+    async def synthesize(self, sentence):
+        return await self.tts.generate_sentence_pcm(
+            self.ref_wav_path, self.prompt_text, sentence,
+            temperature=self.temperature, repetition_penalty=self.repetition_penalty,
+            speed=self.speed, scaling_factor=self.scaling_factor,
+        )
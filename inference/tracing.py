@@ -0,0 +1,119 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from inference.metrics import STAGE_SECONDS, observe_stage
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# The trace of the request being served. asyncio tasks and asyncio.to_thread copy the
+# context, so spans recorded in LLM tasks and SoVITS worker threads land in the right trace.
+CURRENT_TRACE = contextvars.ContextVar("tts_trace", default=None)
+
+MAX_SERVER_TIMING_ENTRIES = 64
+
+
+class Trace:
+    """
+    Stage spans of one synthesis request, with offsets relative to the request start.
+    """
+    def __init__(self, request_id=None, endpoint=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.wall_start = time.time()
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, name, seconds, end=None, **attrs):
+        end = time.perf_counter() if end is None else end
+        span = {"name": name, "start_ms": (end - seconds - self.started_at) * 1000, "dur_ms": seconds * 1000}
+        if attrs:
+            span["attrs"] = attrs
+        with self.lock:
+            self.spans.append(span)
+
+    def server_timing(self):
+        """
+        Server-Timing header value for the spans recorded so far. Spans finishing after the
+        headers are sent (e.g. decode of a streamed response) only appear in the trace log.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        entries = []
+        for i, span in enumerate(spans[:MAX_SERVER_TIMING_ENTRIES]):
+            entries.append(f'{span["name"]};dur={span["dur_ms"]:.1f};desc="{i}"')
+        total_ms = (time.perf_counter() - self.started_at) * 1000
+        entries.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(entries)
+
+    def headers(self):
+        return {"X-Request-ID": self.request_id, "Server-Timing": self.server_timing()}
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "start": self.wall_start,
+            "total_ms": (time.perf_counter() - self.started_at) * 1000,
+            "spans": spans,
+        }
+
+
+class TraceLog:
+    """Appends finished traces to a local JSONL file; disabled when path is empty."""
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def write(self, trace):
+        if not self.path:
+            return
+        line = json.dumps(trace.to_dict())
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+TRACE_LOG = TraceLog(os.getenv("TTS_TRACE_LOG", ""))
+
+
+def record_stage(stage, seconds, audio_seconds=None, **attrs):
+    """
+    Records a finished stage in the metrics and, when a request is being traced, as a span.
+    Also usable as Processor.stage_observer.
+    """
+    observe_stage(stage, seconds, audio_seconds)
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        if audio_seconds:
+            attrs["audio_seconds"] = round(audio_seconds, 3)
+        trace.add_span(stage, seconds, **attrs)
+
+
+@contextlib.contextmanager
+def stage(name, **attrs):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start, **attrs)
+
+
+def start_trace(request_id=None, endpoint=None):
+    trace = Trace(request_id, endpoint)
+    CURRENT_TRACE.set(trace)
+    return trace
+
+
+def finish_trace(trace):
+    TRACE_LOG.write(trace)
@@ -17,6 +17,8 @@ from transformers import (
 
 import torch.nn as nn
 
+from sovits.weights import pretrained_kwargs
+
 cnhubert_base_path = None
 
 
@@ -27,7 +29,8 @@ class CNHubert(nn.Module):
             base_path = cnhubert_base_path
         if os.path.exists(base_path):...
         else:raise FileNotFoundError(base_path)
-        self.model = HubertModel.from_pretrained(base_path, local_files_only=True)
+        # mmap-loads model.safetensors when the directory has one (see sovits.weights)
+        self.model = HubertModel.from_pretrained(base_path, local_files_only=True, **pretrained_kwargs(base_path))
         self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(
             base_path, local_files_only=True
         )
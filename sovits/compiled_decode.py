@@ -0,0 +1,191 @@
+"""
+torch.compile decode path with length buckets.
+
+Codes and phones are zero-padded up to the next bucket and decoded with length masks, so
+the compiled TextEncoder, flow reverse and Generator only ever see a fixed set of shapes:
+one graph per bucket, compiled once, instead of a recompile (and fresh allocator blocks)
+for every new sentence length. warmup() compiles every (token, phone) bucket pair at
+startup; lengths beyond the largest bucket, and pairs that were not warmed, fall back to
+eager, so a request never waits on a compile.
+
+    TTS_DECODE_BACKEND=compile TTS_COMPILE_BUCKETS=64,128,256,512 python api.py
+    python -m sovits.compiled_decode --sovits-path pretrained_models/Muyan-TTS/sovits.pth
+"""
+import argparse
+import bisect
+import itertools
+import logging
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_TOKEN_BUCKETS = (64, 128, 256, 512)
+
+
+def parse_buckets(value):
+    return tuple(sorted(int(v) for v in value.split(",") if v.strip()))
+
+
+def bucket_for(length, buckets):
+    """Smallest bucket holding `length`, or None when it is beyond the largest."""
+    index = bisect.bisect_left(buckets, length)
+    return buckets[index] if index < len(buckets) else None
+
+
+class BucketedDecoder:
+    def __init__(self, vq_model, token_buckets=DEFAULT_TOKEN_BUCKETS, phone_buckets=None, mode=None):
+        """
+        :param token_buckets: padded semantic-token lengths
+        :param phone_buckets: padded phone lengths; defaults to half of each token bucket,
+                              about one phone per two tokens
+        :param mode: torch.compile mode, e.g. "max-autotune"
+        """
+        self.vq_model = vq_model
+        self.token_buckets = tuple(sorted(token_buckets))
+        self.phone_buckets = tuple(sorted(phone_buckets or [max(8, b // 2) for b in self.token_buckets]))
+        # One graph per (token, phone) bucket pair for each compiled component
+        cache_size = len(self.token_buckets) * len(self.phone_buckets) + 1
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, cache_size)
+
+        def flow_reverse(z_p, y_mask, ge):
+            return vq_model.flow(z_p, y_mask, g=ge, reverse=True)
+
+        self.enc_p = torch.compile(vq_model.enc_p, dynamic=False, mode=mode)
+        self.flow = torch.compile(flow_reverse, dynamic=False, mode=mode)
+        self.dec = torch.compile(vq_model.dec, dynamic=False, mode=mode)
+        self.compiled = set()
+        self.report = {}
+        self.fallbacks = 0
+
+    def buckets(self, num_tokens, num_phones):
+        return bucket_for(num_tokens, self.token_buckets), bucket_for(num_phones, self.phone_buckets)
+
+    @torch.no_grad()
+    def decode(self, codes, text, ge, noise_scale=0.5):
+        """
+        SynthesizerTrn.decode at speed 1 with `ge` precomputed.
+        :param codes: LongTensor [n_q, 1, T_codes]
+        :param text: LongTensor [1, T_text]
+        :return: audio [1, 1, T_wav], trimmed to the unpadded length
+        """
+        token_bucket, phone_bucket = self.buckets(codes.size(2), text.size(1))
+        if (token_bucket, phone_bucket) not in self.compiled:
+            self.fallbacks += 1
+            code_lengths = torch.LongTensor([codes.size(2)]).to(codes.device)
+            text_lengths = torch.LongTensor([text.size(1)]).to(text.device)
+            audio, audio_lengths = self.vq_model.decode_batch(codes, code_lengths, text, text_lengths, ge,
+                                                              noise_scale=noise_scale)
+            return audio[:, :, :int(audio_lengths[0])]
+        return self._decode_bucket(codes, text, ge, token_bucket, phone_bucket, noise_scale)
+
+    @torch.no_grad()
+    def _decode_bucket(self, codes, text, ge, token_bucket, phone_bucket, noise_scale=0.5):
+        vq_model = self.vq_model
+        num_tokens, num_phones = codes.size(2), text.size(1)
+        code_lengths = torch.LongTensor([num_tokens]).to(codes.device)
+        text_lengths = torch.LongTensor([num_phones]).to(text.device)
+        codes = F.pad(codes, (0, token_bucket - num_tokens))
+        text = F.pad(text, (0, phone_bucket - num_phones))
+        frame_factor = 2 if vq_model.semantic_frame_rate == "25hz" else 1
+        quantized = vq_model.quantizer.decode(codes)
+        if frame_factor == 2:
+            quantized = F.interpolate(quantized, size=int(quantized.shape[-1] * 2), mode="nearest")
+        x, m_p, logs_p, y_mask = self.enc_p(quantized, code_lengths * frame_factor, text, text_lengths, ge)
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        z = self.flow(z_p, y_mask, ge)
+        audio = self.dec(z * y_mask, g=ge)
+        hop = audio.size(-1) // y_mask.size(-1)
+        return audio[:, :, :num_tokens * frame_factor * hop]
+
+    def _dummy_inputs(self, num_tokens, num_phones, device, dtype):
+        vq_model = self.vq_model
+        generator = torch.Generator().manual_seed(0)
+        codes = torch.randint(0, vq_model.quantizer.bins, (1, 1, num_tokens), generator=generator)
+        text = torch.randint(1, vq_model.enc_p.text_embedding.num_embeddings, (1, num_phones), generator=generator)
+        ge = torch.randn(1, vq_model.gin_channels, 1, generator=generator)
+        return codes.to(device), text.to(device), ge.to(device=device, dtype=dtype)
+
+    def _timed(self, fn, device):
+        if str(device).startswith("cuda"):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if str(device).startswith("cuda"):
+            torch.cuda.synchronize()
+        return time.perf_counter() - start
+
+    def warmup(self, repeat=2):
+        """
+        Compiles every (token bucket, phone bucket) pair and times compiled against eager
+        decode at the bucket size. Only warmed pairs are served compiled.
+        :return: dict of bucket name -> {compile_s, eager_s, compiled_s, speedup}
+        """
+        param = next(self.vq_model.parameters())
+        for token_bucket, phone_bucket in itertools.product(self.token_buckets, self.phone_buckets):
+            codes, text, ge = self._dummy_inputs(token_bucket, phone_bucket, param.device, param.dtype)
+            lengths = (torch.LongTensor([token_bucket]).to(param.device), torch.LongTensor([phone_bucket]).to(param.device))
+            compiled = lambda: self._decode_bucket(codes, text, ge, token_bucket, phone_bucket)
+            eager = lambda: self.vq_model.decode_batch(codes, lengths[0], text, lengths[1], ge)
+            compile_s = self._timed(compiled, param.device)
+            self.compiled.add((token_bucket, phone_bucket))
+            compiled_s = min(self._timed(compiled, param.device) for _ in range(repeat))
+            eager_s = min(self._timed(eager, param.device) for _ in range(repeat))
+            name = f"{token_bucket}x{phone_bucket}"
+            self.report[name] = {
+                "compile_s": compile_s,
+                "eager_s": eager_s,
+                "compiled_s": compiled_s,
+                "speedup": eager_s / compiled_s if compiled_s else None,
+            }
+            logging.info(f"decode bucket {name}: compiled in {compile_s:.1f}s, "
+                         f"eager {eager_s * 1000:.1f}ms -> compiled {compiled_s * 1000:.1f}ms "
+                         f"(x{self.report[name]['speedup']:.2f})")
+        return self.report
+
+    def stats(self):
+        return {
+            "token_buckets": list(self.token_buckets),
+            "phone_buckets": list(self.phone_buckets),
+            "compiled": sorted(f"{t}x{p}" for t, p in self.compiled),
+            "eager_fallbacks": self.fallbacks,
+            "buckets": self.report,
+        }
+
+
+def decoder_from_env(vq_model):
+    buckets = parse_buckets(os.getenv("TTS_COMPILE_BUCKETS", ",".join(map(str, DEFAULT_TOKEN_BUCKETS))))
+    phone_buckets = os.getenv("TTS_COMPILE_PHONE_BUCKETS")
+    return BucketedDecoder(vq_model, buckets, parse_buckets(phone_buckets) if phone_buckets else None,
+                           mode=os.getenv("TTS_COMPILE_MODE") or None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sovits-path", default=None, help="checkpoint to compile; random weights from s2.json if omitted")
+    parser.add_argument("--buckets", default=",".join(map(str, DEFAULT_TOKEN_BUCKETS)), help="token length buckets")
+    parser.add_argument("--phone-buckets", default=None, help="phone length buckets (default: half of --buckets)")
+    parser.add_argument("--mode", default=None, help="torch.compile mode")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args(argv)
+
+    if args.sovits_path:
+        from sovits.export import load_sovits
+        vq_model, _ = load_sovits(args.sovits_path, args.device)
+    else:
+        from benchmarks.fixtures import build_synthesizer, load_hps
+        vq_model = build_synthesizer(load_hps(), device=args.device)
+    decoder = BucketedDecoder(vq_model, parse_buckets(args.buckets),
+                              parse_buckets(args.phone_buckets) if args.phone_buckets else None, args.mode)
+    for name, row in decoder.warmup().items():
+        print(f"{name:<12} compile {row['compile_s']:>7.1f}s  eager {row['eager_s'] * 1000:>9.1f}ms  "
+              f"compiled {row['compiled_s'] * 1000:>9.1f}ms  x{row['speedup']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
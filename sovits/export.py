@@ -0,0 +1,192 @@
+"""
+Inference-only SoVITS checkpoints.
+
+    python -m sovits.export --input pretrained_models/Muyan-TTS/sovits.pth \
+        --output pretrained_models/Muyan-TTS/sovits_infer.pth --dtype fp16
+
+The exported artifact holds only what decode and extract_latent need: no posterior encoder
+(enc_q), no codebook EMA statistics, weight norm folded into plain weights, and the config
+embedded with version and semantic_frame_rate already resolved.
+
+An output path ending in .safetensors writes a safetensors file with the config in its
+metadata, which loads by mmap (see sovits.weights).
+"""
+import argparse
+import json
+import logging
+import time
+
+import torch
+from torch.nn.utils import parametrize
+
+from sovits.models import SynthesizerTrn
+from sovits.precision import DTYPES
+from sovits.weights import is_safetensors, load_safetensors, save_safetensors
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+INFERENCE_FORMAT = "sovits-inference-v1"
+# Codebook buffers only updated by the training-mode EMA
+TRAINING_ONLY_BUFFERS = ("cluster_size", "embed_avg")
+
+
+def is_inference_checkpoint(checkpoint):
+    return isinstance(checkpoint, dict) and checkpoint.get("format") == INFERENCE_FORMAT
+
+
+def resolve_config(checkpoint):
+    """
+    Training checkpoint config with the fields Processor.get_sovits_weights derives at
+    load time (semantic_frame_rate, version) filled in.
+    """
+    config = dict(checkpoint["config"])
+    model = dict(config["model"])
+    model["semantic_frame_rate"] = "25hz"
+    model["version"] = "v1" if checkpoint["weight"]["enc_p.text_embedding.weight"].shape[0] == 322 else "v2"
+    config["model"] = model
+    return config
+
+
+def fold_weight_norm(module):
+    """
+    Replaces every weight-normed layer (old-style hooks or parametrizations) with a
+    plain weight, so decode no longer recomputes g * v / ||v|| on each call.
+    """
+    for submodule in module.modules():
+        if hasattr(submodule, "weight_g") and hasattr(submodule, "weight_v"):
+            torch.nn.utils.remove_weight_norm(submodule)
+        elif parametrize.is_parametrized(submodule, "weight"):
+            parametrize.remove_parametrizations(submodule, "weight")
+    return module
+
+
+def strip_training_state(model):
+    for submodule in model.modules():
+        for name in TRAINING_ONLY_BUFFERS:
+            if name in submodule._buffers:
+                delattr(submodule, name)
+    return model
+
+
+def build_inference_model(config, device="cpu"):
+    """
+    Builds the inference-only SynthesizerTrn structure (no enc_q, weight norm folded,
+    no codebook EMA buffers), matching the state dict of an exported artifact.
+    """
+    data, train, model = config["data"], config["train"], dict(config["model"])
+    model["inference_only"] = True
+    vq_model = SynthesizerTrn(
+        data["filter_length"] // 2 + 1,
+        train["segment_size"] // data["hop_length"],
+        n_speakers=data["n_speakers"],
+        **model
+    )
+    return strip_training_state(fold_weight_norm(vq_model))
+
+
+def export_inference_checkpoint(input_path, output_path, dtype="fp32"):
+    """
+    :param dtype: "fp32", "fp16" or "bf16", the dtype the weights are stored in
+    :return: dict with parameter counts and sizes before and after
+    """
+    checkpoint = torch.load(input_path, map_location="cpu")
+    config = resolve_config(checkpoint)
+
+    full = dict(config["model"])
+    full.pop("inference_only", None)
+    vq_model = SynthesizerTrn(
+        config["data"]["filter_length"] // 2 + 1,
+        config["train"]["segment_size"] // config["data"]["hop_length"],
+        n_speakers=config["data"]["n_speakers"],
+        **full
+    )
+    vq_model.load_state_dict(checkpoint["weight"], strict=False)
+    if hasattr(vq_model, "enc_q"):
+        del vq_model.enc_q
+    vq_model = strip_training_state(fold_weight_norm(vq_model.eval()))
+
+    state_dict = {k: (v.to(DTYPES[dtype]) if v.is_floating_point() else v).contiguous()
+                  for k, v in vq_model.state_dict().items()}
+    config["model"]["inference_only"] = True
+    if is_safetensors(output_path):
+        save_safetensors(output_path, state_dict,
+                         metadata={"format": INFERENCE_FORMAT, "dtype": dtype, "config": json.dumps(config)})
+    else:
+        torch.save({"format": INFERENCE_FORMAT, "config": config, "dtype": dtype, "weight": state_dict}, output_path)
+
+    source_bytes = sum(v.numel() * v.element_size() for v in checkpoint["weight"].values())
+    export_bytes = sum(v.numel() * v.element_size() for v in state_dict.values())
+    summary = {
+        "source_tensors": len(checkpoint["weight"]),
+        "export_tensors": len(state_dict),
+        "source_bytes": source_bytes,
+        "export_bytes": export_bytes,
+    }
+    logging.info(f"exported {output_path}: {summary}")
+    return summary
+
+
+def load_inference_model(checkpoint, device="cpu", dtype=None):
+    """
+    Loads an exported artifact. The module tree is created on the meta device and the
+    stored tensors are assigned into it, so no random initialization is computed. For
+    .safetensors on the CPU in the stored dtype, the parameters stay backed by the mmap.
+    :param checkpoint: path or an already loaded artifact dict
+    :param dtype: torch dtype to run in; defaults to the dtype it was exported with
+    :return: (vq_model, config dict)
+    """
+    if not isinstance(checkpoint, dict):
+        if is_safetensors(checkpoint):
+            weight, metadata = load_safetensors(checkpoint)
+            checkpoint = {"format": metadata.get("format"), "dtype": metadata.get("dtype"),
+                          "config": json.loads(metadata.get("config", "{}")), "weight": weight}
+        else:
+            checkpoint = torch.load(checkpoint, map_location=device)
+    if not is_inference_checkpoint(checkpoint):
+        raise ValueError("Not an inference-only SoVITS checkpoint, convert it with python -m sovits.export")
+    config = checkpoint["config"]
+    dtype = dtype or DTYPES[checkpoint["dtype"]]
+
+    start = time.perf_counter()
+    with torch.device("meta"):
+        vq_model = build_inference_model(config)
+    vq_model.load_state_dict(checkpoint["weight"], strict=True, assign=True)
+    vq_model = vq_model.to(device=device, dtype=dtype).eval()
+    logging.info(f"inference-only sovits built in {time.perf_counter() - start:.3f}s")
+    return vq_model, config
+
+
+def load_sovits(path, device="cpu", dtype=torch.float32):
+    """
+    Loads a training checkpoint or an inference-only export (.pth or .safetensors) for
+    inference, for tools that need the model without a Processor.
+    :return: (vq_model, config dict)
+    """
+    if is_safetensors(path):
+        return load_inference_model(path, device, dtype)
+    checkpoint = torch.load(path, map_location="cpu")
+    if is_inference_checkpoint(checkpoint):
+        return load_inference_model(checkpoint, device, dtype)
+    config = resolve_config(checkpoint)
+    vq_model = SynthesizerTrn(
+        config["data"]["filter_length"] // 2 + 1,
+        config["train"]["segment_size"] // config["data"]["hop_length"],
+        n_speakers=config["data"]["n_speakers"],
+        inference_only=True,
+        **config["model"]
+    )
+    vq_model.load_state_dict(checkpoint["weight"], strict=False)
+    return vq_model.to(device=device, dtype=dtype).eval(), config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="training checkpoint (sovits.pth)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="fp32")
+    args = parser.parse_args(argv)
+    export_inference_checkpoint(args.input, args.output, args.dtype)
+
+
+if __name__ == "__main__":
+    main()
@@ -838,6 +838,7 @@ class SynthesizerTrn(nn.Module):
         semantic_frame_rate=None,
         freeze_quantizer=None,
         version = "v2",
+        inference_only=False,
         **kwargs
     ):
         super().__init__()
@@ -881,15 +882,17 @@ class SynthesizerTrn(nn.Module):
             upsample_kernel_sizes,
             gin_channels=gin_channels,
         )
-        self.enc_q = PosteriorEncoder(
-            spec_channels,
-            inter_channels,
-            hidden_channels,
-            5,
-            1,
-            16,
-            gin_channels=gin_channels,
-        )
+        # The posterior encoder is only used in training; decode and extract_latent never touch it
+        if not inference_only:
+            self.enc_q = PosteriorEncoder(
+                spec_channels,
+                inter_channels,
+                hidden_channels,
+                5,
+                1,
+                16,
+                gin_channels=gin_channels,
+            )
         self.flow = ResidualCouplingBlock(
             inter_channels, hidden_channels, 5, 1, 4, gin_channels=gin_channels
         )
@@ -980,9 +983,8 @@ class SynthesizerTrn(nn.Module):
         o = self.dec((z * y_mask)[:, :, :], g=ge)
         return o, y_mask, (z, z_p, m_p, logs_p)
 
-    @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5,speed=1):
-        def get_ge(refer):
+    def get_ge(self, refer):
+        def _get_ge(refer):
             ge = None
             if refer is not None:
                 refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
@@ -997,11 +999,16 @@ class SynthesizerTrn(nn.Module):
         if(type(refer)==list):
             ges=[]
             for _refer in refer:
-                ge=get_ge(_refer)
+                ge=_get_ge(_refer)
                 ges.append(ge)
             ge=torch.stack(ges,0).mean(0)
         else:
-            ge=get_ge(refer)
+            ge=_get_ge(refer)
+        return ge
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5,speed=1):
+        ge = self.get_ge(refer)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1021,6 +1028,103 @@ class SynthesizerTrn(nn.Module):
         o = self.dec((z * y_mask)[:, :, :], g=ge)
         return o
 
+    def latent_receptive_field(self):
+        """
+        One-sided receptive field of flow reverse plus the Generator, in latent frames:
+        the context a window of z needs so its audio matches decoding the whole segment.
+        """
+        flow = self.flow
+        frames = flow.n_flows * sum(get_padding(flow.kernel_size, flow.dilation_rate**i)
+                                    for i in range(flow.n_layers))
+        frames += 3  # conv_pre
+        rate = 1
+        for u, k in zip(self.upsample_rates, self.upsample_kernel_sizes):
+            frames += math.ceil(math.ceil(k / u) / 2) / rate
+            rate *= u
+            frames += max(
+                sum(get_padding(rk, d) + (get_padding(rk) if self.resblock == "1" else 0) for d in ds)
+                for rk, ds in zip(self.resblock_kernel_sizes, self.resblock_dilation_sizes)
+            ) / rate
+        frames += 3 / rate  # conv_post
+        return math.ceil(frames)
+
+    @torch.no_grad()
+    def decode_chunked(self, codes, text, refer, noise_scale=0.5, speed=1,
+                       chunk_frames=200, overlap_frames=8, context_frames=None):
+        """
+        decode() in overlapping latent windows, so the Generator activations are bounded
+        by the window size instead of the segment length. TextEncoder and the noise still
+        cover the whole segment; flow reverse and the Generator run per window with
+        context_frames of extra latent on each side, and adjacent windows are crossfaded
+        over overlap_frames.
+        :param context_frames: defaults to latent_receptive_field()
+        :return: generator of audio chunks [1, 1, T_chunk], each yielded once decoded
+        """
+        ge = self.get_ge(refer)
+
+        y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
+        text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
+
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(
+                quantized, size=int(quantized.shape[-1] * 2), mode="nearest"
+            )
+        x, m_p, logs_p, y_mask = self.enc_p(
+            quantized, y_lengths, text, text_lengths, ge, speed
+        )
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+
+        total = z_p.size(2)
+        context = self.latent_receptive_field() if context_frames is None else context_frames
+        hop = math.prod(self.upsample_rates)
+        tail = None
+        for start in range(0, total, chunk_frames):
+            end = min(start + chunk_frames, total)
+            stop = min(end + overlap_frames, total)
+            left, right = max(start - context, 0), min(stop + context, total)
+            z = self.flow(z_p[:, :, left:right], y_mask[:, :, left:right], g=ge, reverse=True)
+            o = self.dec(z * y_mask[:, :, left:right], g=ge)
+            o = o[:, :, (start - left) * hop:(stop - left) * hop]
+            if tail is not None and tail.size(-1) > 0:
+                n = tail.size(-1)
+                fade = torch.linspace(0.0, 1.0, n + 2, device=o.device, dtype=o.dtype)[1:-1]
+                o = torch.cat([o[:, :, :n] * fade + tail * (1 - fade), o[:, :, n:]], -1)
+            # [end, stop) is decoded again by the next window and crossfaded there
+            tail = o[:, :, (end - start) * hop:]
+            yield o[:, :, :(end - start) * hop]
+
+    @torch.no_grad()
+    def decode_batch(self, codes, code_lengths, text, text_lengths, ge, noise_scale=0.5, speed=1):
+        """
+        Decodes a zero-padded batch of semantic tokens in a single pass.
+        :param codes: LongTensor [n_q, B, T_codes]
+        :param code_lengths: LongTensor [B], valid length of each code sequence
+        :param text: LongTensor [B, T_text] of phone ids
+        :param text_lengths: LongTensor [B], valid length of each phone sequence
+        :param ge: reference embedding [B, gin_channels, 1] (see get_ge)
+        :return: (audio [B, 1, T_wav], audio_lengths [B])
+        """
+        frame_factor = 2 if self.semantic_frame_rate == "25hz" else 1
+        y_lengths = code_lengths * frame_factor
+
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(
+                quantized, size=int(quantized.shape[-1] * 2), mode="nearest"
+            )
+        x, m_p, logs_p, y_mask = self.enc_p(
+            quantized, y_lengths, text, text_lengths, ge, speed
+        )
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+
+        z = self.flow(z_p, y_mask, g=ge, reverse=True)
+
+        o = self.dec(z * y_mask, g=ge)
+        latent_lengths = y_mask.sum(dim=(1, 2)).long()
+        audio_lengths = latent_lengths * (o.size(-1) // y_mask.size(-1))
+        return o, audio_lengths
+
     def extract_latent(self, x):
         ssl = self.ssl_proj(x) 
         quantized, codes, commit_loss, quantized_list = self.quantizer(ssl)
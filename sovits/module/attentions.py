@@ -1,4 +1,5 @@
 import math
+import os
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -6,6 +7,9 @@ from torch.nn import functional as F
 from sovits.module import commons
 from sovits.module.modules import LayerNorm
 
+# TTS_FAST_ATTENTION=0 restores the reference implementation (for equivalence checks)
+FAST_ATTENTION = os.getenv("TTS_FAST_ATTENTION", "1") == "1"
+
 
 class Encoder(nn.Module):
     def __init__(
@@ -245,6 +249,13 @@ class MultiHeadAttention(nn.Module):
         key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
         value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
 
+        if FAST_ATTENTION and not self.proximal_bias and self.block_length is None:
+            if self.window_size is None:
+                output, p_attn = self._sdpa_attention(query, key, value, mask), None
+            else:
+                output, p_attn = self._banded_relative_attention(query, key, value, mask)
+            return output.transpose(2, 3).contiguous().view(b, d, t_t), p_attn
+
         scores = torch.matmul(query / math.sqrt(self.k_channels), key.transpose(-2, -1))
         if self.window_size is not None:
             assert (
@@ -289,6 +300,66 @@ class MultiHeadAttention(nn.Module):
         )  # [b, n_h, t_t, d_k] -> [b, d, t_t]
         return output, p_attn
 
+    def _sdpa_attention(self, query, key, value, mask=None):
+        """
+        Fused scaled_dot_product_attention for attention without relative positions (the
+        MRTE cross-attention). The mask becomes an additive -1e4 bias, which matches the
+        masked_fill of the reference path except on rows that are masked entirely; callers
+        zero those positions with their own masks. Attention weights are not returned.
+        """
+        bias = None
+        if mask is not None:
+            bias = torch.zeros(mask.shape, dtype=query.dtype, device=query.device).masked_fill(mask == 0, -1e4)
+        return F.scaled_dot_product_attention(
+            query, key, value, attn_mask=bias, dropout_p=self.p_dropout if self.training else 0.0
+        )
+
+    def _banded_relative_attention(self, query, key, value, mask=None):
+        """
+        Relative-position attention with the window handled as a band: the key bias is
+        q . emb_rel_k over the 2*window_size+1 offsets, skewed onto the [l, l] scores, and
+        the value term reads those offsets' weights straight off the attention matrix. The
+        reference path pads both to 2*l-1 positions, materializing two [b, h, l, 2*l-1]
+        tensors that are zero outside the window.
+        """
+        length = key.size(2)
+        query = query / math.sqrt(self.k_channels)
+        scores = torch.matmul(query, key.transpose(-2, -1))
+        rel_logits = self._matmul_with_relative_keys(query, self.emb_rel_k)  # [b, h, l, 2w+1]
+        scores = scores + self._relative_band_to_absolute(rel_logits, length)
+        if mask is not None:
+            scores = scores.masked_fill(mask == 0, -1e4)
+        p_attn = F.softmax(scores, dim=-1)
+        p_attn = self.drop(p_attn)
+        output = torch.matmul(p_attn, value)
+        relative_weights = self._absolute_to_relative_band(p_attn, length)  # [b, h, l, 2w+1]
+        output = output + self._matmul_with_relative_values(relative_weights, self.emb_rel_v)
+        return output, p_attn
+
+    def _relative_band_to_absolute(self, x, length):
+        """
+        x: [b, h, l, 2*w+1], logits per relative offset -w..w
+        ret: [b, h, l, l], zero outside the window
+        """
+        batch, heads = x.size(0), x.size(1)
+        row = length + 2 * self.window_size
+        # Rows padded to row + 1 and re-read with stride row shift row i right by i
+        x = F.pad(x, commons.convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, length]]))
+        x_flat = x.reshape([batch, heads, length * (row + 1)])[:, :, : length * row]
+        return x_flat.view([batch, heads, length, row])[:, :, :, self.window_size : self.window_size + length]
+
+    def _absolute_to_relative_band(self, x, length):
+        """
+        x: [b, h, l, l]
+        ret: [b, h, l, 2*w+1], the weights at offsets -w..w (zero beyond the edges)
+        """
+        batch, heads = x.size(0), x.size(1)
+        row = length + 2 * self.window_size
+        x = F.pad(x, commons.convert_pad_shape([[0, 0], [0, 0], [0, 0], [self.window_size, self.window_size]]))
+        # Re-reading with stride row + 1 shifts row i left by i
+        x_flat = F.pad(x.reshape([batch, heads, length * row]), commons.convert_pad_shape([[0, 0], [0, 0], [0, length]]))
+        return x_flat.view([batch, heads, length, row + 1])[:, :, :, : 2 * self.window_size + 1]
+
     def _matmul_with_relative_values(self, x, y):
         """
         x: [b, h, l, m]
@@ -308,20 +379,15 @@ class MultiHeadAttention(nn.Module):
         return ret
 
     def _get_relative_embeddings(self, relative_embeddings, length):
-        max_relative_position = 2 * self.window_size + 1
-        # Pad first before slice to avoid using cond ops.
-        pad_length = max(length - (self.window_size + 1), 0)
-        slice_start_position = max((self.window_size + 1) - length, 0)
-        slice_end_position = slice_start_position + 2 * length - 1
-        if pad_length > 0:
-            padded_relative_embeddings = F.pad(
-                relative_embeddings,
-                commons.convert_pad_shape([[0, 0], [pad_length, pad_length], [0, 0]]),
-            )
-        else:
-            padded_relative_embeddings = relative_embeddings
+        # Always pad by `length` on both sides and slice at a fixed offset: same result as
+        # padding only when length > window_size + 1, but without Python max()/if on the
+        # length, so the time axis stays dynamic when traced for ONNX export.
+        padded_relative_embeddings = F.pad(
+            relative_embeddings,
+            commons.convert_pad_shape([[0, 0], [length, length], [0, 0]]),
+        )
         used_relative_embeddings = padded_relative_embeddings[
-            :, slice_start_position:slice_end_position
+            :, self.window_size + 1:self.window_size + 2 * length
         ]
         return used_relative_embeddings
 
@@ -0,0 +1,183 @@
+"""
+ONNX Runtime backend for SynthesizerTrn.decode.
+
+    python -m sovits.onnx_decode --sovits-path pretrained_models/Muyan-TTS/sovits.pth \
+        --output pretrained_models/Muyan-TTS/sovits_decode.onnx
+
+Exports quantizer decode, TextEncoder, flow reverse and the Generator as one graph with
+dynamic token / phone / sample axes; the reference embedding `ge` is an input, computed
+eagerly by get_ge (it is cached per reference in practice). After export the graph is
+checked against eager decode (noise_scale 0) and both are timed over --token-lengths.
+
+Serving: TTS_DECODE_BACKEND=onnx TTS_ONNX_DECODE_PATH=<exported .onnx>. TTS_ORT_THREADS
+sets the session's intra-op threads (default: physical cores as seen by torch).
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+INPUT_NAMES = ["codes", "text", "ge", "noise_scale"]
+OUTPUT_NAMES = ["audio"]
+DYNAMIC_AXES = {"codes": {2: "tokens"}, "text": {1: "phones"}, "audio": {2: "samples"}}
+
+
+class OnnxDecoder(nn.Module):
+    """
+    SynthesizerTrn.decode for a single item at speed 1, with every length derived from
+    tensor shapes so the traced graph keeps its time axes dynamic.
+    """
+
+    def __init__(self, vq_model):
+        super().__init__()
+        self.vq_model = vq_model
+
+    def forward(self, codes, text, ge, noise_scale):
+        """
+        :param codes: LongTensor [n_q, 1, T_codes]
+        :param text: LongTensor [1, T_text]
+        :param ge: [1, gin_channels, 1]
+        :param noise_scale: float tensor [1]
+        :return: audio [1, 1, T_wav]
+        """
+        vq_model = self.vq_model
+        quantized = vq_model.quantizer.decode(codes)
+        if vq_model.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(quantized, scale_factor=2.0, mode="nearest")
+        y_lengths = torch.ones_like(codes[0, :, 0]) * quantized.size(2)
+        text_lengths = torch.ones_like(text[:, 0]) * text.size(1)
+        x, m_p, logs_p, y_mask = vq_model.enc_p(quantized, y_lengths, text, text_lengths, ge)
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        z = vq_model.flow(z_p, y_mask, g=ge, reverse=True)
+        return vq_model.dec(z * y_mask, g=ge)
+
+
+def export_decode_onnx(vq_model, output_path, opset=17):
+    """
+    :param vq_model: SynthesizerTrn in eval mode; exported in fp32 on the CPU
+    """
+    decoder = OnnxDecoder(vq_model.float().cpu().eval())
+    generator = torch.Generator().manual_seed(0)
+    codes = torch.randint(0, vq_model.quantizer.bins, (1, 1, 60), generator=generator)
+    text = torch.randint(1, vq_model.enc_p.text_embedding.num_embeddings, (1, 40), generator=generator)
+    ge = torch.zeros(1, vq_model.gin_channels, 1)
+    noise_scale = torch.tensor([0.5])
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(decoder, (codes, text, ge, noise_scale), output_path, opset_version=opset,
+                          input_names=INPUT_NAMES, output_names=OUTPUT_NAMES, dynamic_axes=DYNAMIC_AXES)
+    logging.info(f"exported decode graph to {output_path} in {time.perf_counter() - start:.1f}s")
+    return output_path
+
+
+def session_options(threads=None):
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    # One graph per call on the decode worker: parallelism goes into the operators
+    options.intra_op_num_threads = threads or int(os.getenv("TTS_ORT_THREADS", "0")) or torch.get_num_threads()
+    options.inter_op_num_threads = 1
+    return options
+
+
+class OnnxDecodeSession:
+    def __init__(self, model_path, device="cpu", threads=None):
+        """
+        :param device: "cuda" uses the CUDA execution provider when onnxruntime has it
+        """
+        import onnxruntime
+        providers = ["CPUExecutionProvider"]
+        if str(device).startswith("cuda") and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.model_path = model_path
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=session_options(threads),
+                                                    providers=providers)
+        logging.info(f"onnx decode session on {self.session.get_providers()} from {model_path}")
+
+    def decode(self, codes, text, ge, noise_scale=0.5):
+        """
+        Same contract as SynthesizerTrn.decode at speed 1, with `ge` precomputed.
+        :return: float32 numpy audio [T_wav]
+        """
+        feeds = {
+            "codes": codes.detach().cpu().numpy().astype(np.int64),
+            "text": text.detach().cpu().numpy().astype(np.int64),
+            "ge": ge.detach().float().cpu().numpy(),
+            "noise_scale": np.array([noise_scale], dtype=np.float32),
+        }
+        return self.session.run(OUTPUT_NAMES, feeds)[0][0, 0]
+
+
+def time_call(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def validate(vq_model, session, token_lengths, repeat=3, seed=1234):
+    """
+    Compares the session against eager decode with noise_scale 0 and times both.
+    :return: list of dict rows (tokens, max_abs, eager_s, onnx_s, speedup)
+    """
+    from benchmarks.fixtures import decode_inputs, load_hps
+    hps = load_hps()
+    rows = []
+    for num_tokens in token_lengths:
+        codes, phones, refer = decode_inputs(vq_model, hps, num_tokens, seed=seed)
+        with torch.no_grad():
+            ge = vq_model.get_ge([refer])
+            eager = lambda: vq_model.decode(codes, phones, [refer], noise_scale=0.0)
+            reference = eager().float().cpu().numpy()[0, 0]
+        onnx = lambda: session.decode(codes, phones, ge, noise_scale=0.0)
+        out = onnx()
+        length = min(len(reference), len(out))
+        row = {
+            "tokens": num_tokens,
+            "length_diff": len(out) - len(reference),
+            "max_abs": float(np.max(np.abs(reference[:length] - out[:length]))),
+            "eager_s": time_call(eager, repeat),
+            "onnx_s": time_call(onnx, repeat),
+        }
+        row["speedup"] = row["eager_s"] / row["onnx_s"]
+        logging.info(f"tokens={num_tokens} max_abs={row['max_abs']:.2e} length_diff={row['length_diff']} "
+                     f"eager={row['eager_s'] * 1000:.1f}ms onnx={row['onnx_s'] * 1000:.1f}ms x{row['speedup']:.2f}")
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sovits-path", required=True, help="training checkpoint or inference-only export")
+    parser.add_argument("--output", required=True, help="path of the .onnx file to write")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--token-lengths", default="50,150,400", help="lengths to validate and time; empty to skip")
+    parser.add_argument("--threads", type=int, default=None, help="onnxruntime intra-op threads")
+    parser.add_argument("--max-abs", type=float, default=1e-3, help="largest accepted difference from eager")
+    args = parser.parse_args(argv)
+
+    from sovits.export import load_sovits
+    vq_model, _ = load_sovits(args.sovits_path)
+    export_decode_onnx(vq_model, args.output, args.opset)
+    if not args.token_lengths:
+        return 0
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    session = OnnxDecodeSession(args.output, threads=args.threads)
+    rows = validate(vq_model, session, [int(n) for n in args.token_lengths.split(",")])
+    failed = [row for row in rows if row["max_abs"] > args.max_abs or row["length_diff"] != 0]
+    print(f"{len(rows) - len(failed)}/{len(rows)} lengths within max_abs {args.max_abs}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
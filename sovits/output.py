@@ -0,0 +1,94 @@
+"""
+Output stage: gain, clipping and integer conversion of decoded audio, and WAV framing.
+
+Decoded float32 audio is normalized, scaled and clipped in place and converted once into
+the integer buffer that is sent; WAV headers are computed from the byte count instead of
+rewriting the stream through soundfile. Callers get memoryviews over those buffers, so a
+request holds about one copy of its audio.
+"""
+import numpy as np
+
+from sovits.utils import wav_header
+
+WAV_HEADER_SIZE = 44
+SILENCE_SECONDS = 0.3
+# is_int32 -> (sample dtype, full scale, clip low, clip high); the int32 high bound is the
+# largest float32 below 2**31, so the cast cannot wrap around
+SAMPLE_FORMATS = {
+    False: (np.int16, 32768.0, -32768.0, 32767.0),
+    True: (np.int32, 2147483647.0, -2147483648.0, 2147483520.0),
+}
+
+
+def sample_width(is_int32=False):
+    return 4 if is_int32 else 2
+
+
+def silence_samples(rate):
+    """Samples of trailing silence appended after each segment."""
+    return int(rate * SILENCE_SECONDS)
+
+
+def peak_gain(audio, scaling_factor=1.0):
+    """scaling_factor, divided by the peak of audio louder than full scale."""
+    if not audio.shape[0]:
+        return scaling_factor
+    # max / -min instead of np.abs(audio).max(), which allocates a full-size temporary
+    peak = max(float(audio.max()), -float(audio.min()))
+    return scaling_factor / peak if peak > 1 else scaling_factor
+
+
+def to_pcm(audio, scaling_factor=1.0, is_int32=False, silence=0, out=None, normalize=True):
+    """
+    Peak-normalizes audio louder than full scale, applies scaling_factor, clips and
+    converts to integer samples. `audio` is modified in place when it is a writable
+    float32 array.
+    :param audio: float numpy audio [T]
+    :param silence: samples of silence to append
+    :param out: preallocated int16/int32 array of T + silence samples to write into
+    :param normalize: False for a part of a segment, e.g. a decode_chunk_frames window or
+                      resampled output; it is only scaled and clipped, so neighbouring parts
+                      keep the same level
+    :return: the integer samples, `out` when given
+    """
+    dtype, full_scale, low, high = SAMPLE_FORMATS[is_int32]
+    audio = np.require(audio, np.float32, ["W"])
+    length = audio.shape[0]
+    if out is None:
+        out = np.empty(length + silence, dtype=dtype)
+    if length:
+        gain = peak_gain(audio, scaling_factor) if normalize else scaling_factor
+        audio *= np.float32(gain * full_scale)
+        np.clip(audio, low, high, out=audio)
+        out[:length] = audio
+    out[length:] = 0
+    return out
+
+
+def as_bytes(pcm):
+    """Byte view of an integer sample array, without copying."""
+    return memoryview(pcm).cast("B")
+
+
+def wav_chunks(segments, rate, is_int32=False):
+    """
+    A WAV file as a header followed by one byte view per PCM segment.
+    :param segments: list of int16/int32 sample arrays
+    :return: generator of bytes-like chunks
+    """
+    views = [as_bytes(pcm) for pcm in segments]
+    yield wav_header(sum(view.nbytes for view in views), rate, is_int32)
+    yield from views
+
+
+def wav_bytes(audio, rate, scaling_factor=1.0, is_int32=False, silence=0, normalize=True):
+    """
+    A complete WAV file of one segment, converted straight into the buffer after the header.
+    :return: bytearray
+    """
+    data_size = (audio.shape[0] + silence) * sample_width(is_int32)
+    buffer = bytearray(WAV_HEADER_SIZE + data_size)
+    buffer[:WAV_HEADER_SIZE] = wav_header(data_size, rate, is_int32)
+    to_pcm(audio, scaling_factor, is_int32, silence, normalize=normalize,
+           out=np.frombuffer(buffer, dtype=SAMPLE_FORMATS[is_int32][0], offset=WAV_HEADER_SIZE))
+    return buffer
@@ -0,0 +1,152 @@
+"""
+Device-aware precision policy for the SoVITS and HuBERT models.
+
+TTS_PRECISION selects the default mode: "auto" (default), "fp32", "fp16" or "bf16".
+"auto" picks fp16 on CUDA, and on the CPU bf16 only when a short self-benchmark shows it
+is actually faster than fp32 on this host (fp16 on the CPU is slow and is never chosen).
+TTS_PRECISION_SOVITS / TTS_PRECISION_HUBERT override it per model.
+
+A model either has its weights cast to the low-precision dtype, or keeps fp32 weights and
+runs under torch.autocast, which leaves softmax, norms and reductions in fp32. Autocast is
+used for HuBERT (its fp16 cast can produce NaN features) and for every model on the CPU;
+TTS_AUTOCAST_MODELS="hubert,sovits" overrides the set.
+"""
+import contextlib
+import logging
+import os
+import time
+
+import torch
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+MODELS = ("sovits", "hubert")
+# bf16 has to beat fp32 by this factor in the self-benchmark to be picked on the CPU
+CPU_BF16_MIN_SPEEDUP = 1.2
+
+
+def _time(fn, repeat=5):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_cpu_bf16():
+    """
+    Times a small conv + linear workload (the shapes of the SoVITS decoder) in fp32 and
+    under bf16 autocast.
+    :return: dict with fp32_s, bf16_s and speedup; speedup 0 when bf16 fails on this CPU
+    """
+    generator = torch.Generator().manual_seed(0)
+    conv = torch.nn.Conv1d(192, 192, 5, padding=2)
+    linear = torch.nn.Linear(192, 768)
+    x = torch.randn(1, 192, 400, generator=generator)
+
+    @torch.no_grad()
+    def run():
+        return linear(conv(x).transpose(1, 2))
+
+    def run_bf16():
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return run()
+
+    fp32_s = _time(run)
+    try:
+        bf16_s = _time(run_bf16)
+    except RuntimeError as e:
+        logging.info(f"bf16 autocast unavailable on this CPU: {e}")
+        return {"fp32_s": fp32_s, "bf16_s": None, "speedup": 0.0}
+    return {"fp32_s": fp32_s, "bf16_s": bf16_s, "speedup": fp32_s / bf16_s}
+
+
+class PrecisionPolicy:
+    def __init__(self, device, default="auto", overrides=None, autocast_models=None):
+        """
+        :param default: "auto", "fp32", "fp16" or "bf16"
+        :param overrides: dict of model name -> mode, for models that should differ
+        :param autocast_models: models run under autocast with fp32 weights instead of
+                                being cast; None for the device default
+        """
+        self.device = str(device)
+        self.device_type = "cuda" if self.device.startswith("cuda") else "cpu"
+        self.benchmark = None
+        self.default = self._resolve(default)
+        self.modes = {model: self.default for model in MODELS}
+        for model, mode in (overrides or {}).items():
+            self.modes[model] = self._resolve(mode)
+        if autocast_models is None:
+            autocast_models = ("hubert",) if self.device_type == "cuda" else MODELS
+        self.autocast_models = set(autocast_models)
+
+    def _resolve(self, mode):
+        if mode != "auto":
+            if mode not in DTYPES:
+                raise ValueError(f"Unknown precision: '{mode}'. Expected auto or one of {sorted(DTYPES)}")
+            return mode
+        if self.device_type == "cuda":
+            major, _ = torch.cuda.get_device_capability(self.device)
+            # fp16 tensor cores from Volta on; older cards gain little and overflow the same
+            return "fp16" if major >= 7 else "fp32"
+        if self.benchmark is None:
+            self.benchmark = benchmark_cpu_bf16()
+        return "bf16" if self.benchmark["speedup"] >= CPU_BF16_MIN_SPEEDUP else "fp32"
+
+    def mode(self, model):
+        return self.modes[model]
+
+    def dtype(self, model):
+        """Compute dtype of the model: what autocast runs in, or what the weights are cast to."""
+        return DTYPES[self.modes[model]]
+
+    def uses_autocast(self, model):
+        return model in self.autocast_models and self.modes[model] != "fp32"
+
+    def weight_dtype(self, model):
+        """dtype the model's weights and float inputs are cast to."""
+        return torch.float32 if self.uses_autocast(model) else self.dtype(model)
+
+    def autocast(self, model):
+        if not self.uses_autocast(model):
+            return contextlib.nullcontext()
+        return torch.autocast(self.device_type, dtype=self.dtype(model))
+
+    def fall_back(self, model):
+        """Switches a model to fp32, e.g. after it produced NaN in low precision."""
+        self.modes[model] = "fp32"
+
+    def describe(self):
+        models = ", ".join(f"{model}={self.modes[model]}/{'autocast' if self.uses_autocast(model) else 'cast'}"
+                           for model in MODELS)
+        line = f"precision policy on {self.device}: default {self.default}; {models}"
+        if self.benchmark is not None:
+            line += f"; cpu bf16 self-benchmark x{self.benchmark['speedup']:.2f} vs fp32"
+        return line
+
+    def stats(self):
+        return {
+            "device": self.device,
+            "default": self.default,
+            "models": {model: {"mode": self.modes[model], "autocast": self.uses_autocast(model)} for model in MODELS},
+            "cpu_bf16_benchmark": self.benchmark,
+        }
+
+
+def policy_from_env(device):
+    """
+    Policy from TTS_PRECISION, TTS_PRECISION_<MODEL> and TTS_AUTOCAST_MODELS. The legacy
+    is_half=False environment variable still forces fp32 when TTS_PRECISION is unset.
+    """
+    default = os.getenv("TTS_PRECISION")
+    if default is None:
+        default = "fp32" if os.getenv("is_half", "True") == "False" else "auto"
+    overrides = {model: os.environ[f"TTS_PRECISION_{model.upper()}"]
+                 for model in MODELS if os.getenv(f"TTS_PRECISION_{model.upper()}")}
+    autocast_models = os.getenv("TTS_AUTOCAST_MODELS")
+    if autocast_models is not None:
+        autocast_models = [m.strip() for m in autocast_models.split(",") if m.strip()]
+    policy = PrecisionPolicy(device, default, overrides, autocast_models)
+    logging.info(policy.describe())
+    return policy
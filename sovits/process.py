@@ -1,4 +1,5 @@
 import re
+import time
 import torch
 import librosa
 import types
@@ -6,8 +7,13 @@ import sys
 import numpy as np
 from io import BytesIO
 from sovits.models import SynthesizerTrn
+from sovits.export import is_inference_checkpoint, load_inference_model
+from sovits.weights import is_safetensors, timed_load
+from sovits.precision import PrecisionPolicy, policy_from_env
 import logging
 from sovits.utils import *
+from sovits.output import as_bytes, peak_gain, silence_samples, to_pcm, wav_bytes, wav_chunks
+from sovits.resample import Resampler
 import sovits.cnhubert as cnhubert
 
 utils_module = types.ModuleType('utils')
@@ -67,12 +73,16 @@ class Processor:
     def __init__(
         self,
         device="cuda" if torch.cuda.is_available() else "cpu",
-        is_half=True,
+        is_half=None,
         stream_mode="close",
         is_int32=False,
         sovits_path="pretrained_models/Muyan-TTS/sovits.pth",
         cnhubert_path="pretrained_models/chinese-hubert-base",
         default_cut_punc="",
+        decode_backend="torch",
+        onnx_decode_path=None,
+        decode_chunk_frames=0,
+        precision=None,
     ):
         if not Processor._initialized:
             self.spec_cache = {}
@@ -81,8 +91,19 @@ class Processor:
             self.is_int32 = is_int32
             self.stream_mode = stream_mode
             self.device = device
-            self.is_half = is_half
+            # is_half=True/False forces fp16/fp32 everywhere; otherwise the device-aware policy
+            if precision is None:
+                precision = policy_from_env(device) if is_half is None else \
+                    PrecisionPolicy(device, "fp16" if is_half else "fp32")
+            self.precision = precision
             self.default_cut_punc = default_cut_punc
+            # Optional callable(stage, seconds, audio_seconds=None) for latency instrumentation
+            self.stage_observer = None
+            # Optional accountant with add_buffer / release_buffer (inference.memory.MemoryAccountant)
+            # for the audio a request holds until it is sent
+            self.buffer_accountant = None
+            self.cache_hits = {"audio_token": 0, "spec": 0}
+            self.cache_misses = {"audio_token": 0, "spec": 0}
 
             # set sovits path
             if sovits_path is not None:
@@ -91,57 +112,142 @@ class Processor:
                 raise FileNotFoundError("No valid sovits.pth found.")
 
             # load sovits model
-            sovits = self.get_sovits_weights(self.sovits_path, self.device)
+            with timed_load("sovits"):
+                sovits = self.get_sovits_weights(self.sovits_path, self.device)
             self.speaker_list["default"] = Speaker(name="default", sovits=sovits)
 
             # load cnhubert model
-            cnhubert.cnhubert_base_path = cnhubert_path
-            ssl_model = cnhubert.get_model()
-            if self.is_half:
-                self.ssl_model = ssl_model.half().to(self.device)
-            else:
-                self.ssl_model = ssl_model.to(self.device)
+            with timed_load("hubert"):
+                cnhubert.cnhubert_base_path = cnhubert_path
+                ssl_model = cnhubert.get_model()
+                self.ssl_model = ssl_model.to(device=self.device, dtype=self.precision.weight_dtype("hubert"))
+
+            # "onnx" runs single-segment decode through onnxruntime (python -m sovits.onnx_decode),
+            # "compile" through torch.compile graphs per length bucket (sovits.compiled_decode)
+            self.decode_backend = decode_backend
+            # > 0: eager decode runs flow and Generator in latent windows of this many frames
+            self.decode_chunk_frames = decode_chunk_frames
+            self.onnx_decoder = None
+            self.compiled_decoder = None
+            if decode_backend == "onnx":
+                from sovits.onnx_decode import OnnxDecodeSession
+                if not onnx_decode_path:
+                    raise FileNotFoundError("decode_backend 'onnx' needs an exported onnx_decode_path")
+                with timed_load("sovits_onnx"):
+                    self.onnx_decoder = OnnxDecodeSession(onnx_decode_path, self.device)
+            elif decode_backend == "compile":
+                from sovits.compiled_decode import decoder_from_env
+                with timed_load("sovits_compile"):
+                    self.compiled_decoder = decoder_from_env(sovits.vq_model)
+                    self.compiled_decoder.warmup()
+            elif decode_backend != "torch":
+                raise ValueError(f"Unknown decode backend: '{decode_backend}'")
 
             Processor._initialized = True
 
+    def _decode(self, vq_model, pred_semantic, phones, refers, speed=1):
+        """
+        Decodes one segment with the configured backend.
+        :return: float32 numpy audio [T_wav]
+        """
+        phones = torch.LongTensor(phones).to(self.device).unsqueeze(0)
+        # The exported / compiled graphs are speed 1 only; other speeds stay on the eager path
+        if self.onnx_decoder is not None and speed == 1:
+            with torch.no_grad():
+                ge = vq_model.get_ge(refers)
+            return self.onnx_decoder.decode(pred_semantic, phones, ge)
+        with self.precision.autocast("sovits"):
+            if self.compiled_decoder is not None and speed == 1 and vq_model is self.compiled_decoder.vq_model:
+                with torch.no_grad():
+                    ge = vq_model.get_ge(refers)
+                audio = self.compiled_decoder.decode(pred_semantic, phones, ge)
+            else:
+                audio = vq_model.decode(pred_semantic, phones, refers, speed=speed)
+        return audio.detach().float().cpu().numpy()[0, 0]
+
+    def _segment_chunks(self, vq_model, pred_semantic, phones, refers, speed=1):
+        """
+        Decodes one segment, in latent windows when decode_chunk_frames is set so the first
+        audio is available before the whole segment has gone through the Generator.
+        :return: generator of (float32 numpy audio, is_last)
+        """
+        accelerated = speed == 1 and (self.onnx_decoder is not None or self.compiled_decoder is not None)
+        if not self.decode_chunk_frames or accelerated:
+            yield self._decode(vq_model, pred_semantic, phones, refers, speed), True
+            return
+        phones = torch.LongTensor(phones).to(self.device).unsqueeze(0)
+        chunks = vq_model.decode_chunked(pred_semantic, phones, refers, speed=speed,
+                                         chunk_frames=self.decode_chunk_frames)
+        previous = None
+        while True:
+            # autocast state is thread-local, so it is only held while a window decodes
+            with self.precision.autocast("sovits"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            if previous is not None:
+                yield previous, False
+            previous = chunk.detach().float().cpu().numpy()[0, 0]
+        yield previous, True
+
+    def _add_buffer(self, nbytes):
+        if self.buffer_accountant is not None:
+            self.buffer_accountant.add_buffer("segments", nbytes)
+        return nbytes
+
+    def _release_buffer(self, nbytes):
+        if self.buffer_accountant is not None and nbytes:
+            self.buffer_accountant.release_buffer("segments", nbytes)
+
+    def _observe_stage(self, stage, start, audio_seconds=None):
+        if self.stage_observer is not None:
+            self.stage_observer(stage, time.perf_counter() - start, audio_seconds)
+
     def generate_audio_token(self, ref_wav_path, spk="default"):
-        if ref_wav_path in self.audio_token_cache:
-            return self.audio_token_cache[ref_wav_path]
+        # .get() so entries evicted concurrently under memory pressure count as misses
+        audio_token = self.audio_token_cache.get(ref_wav_path)
+        if audio_token is not None:
+            self.cache_hits["audio_token"] += 1
+            return audio_token
+        self.cache_misses["audio_token"] += 1
+        start = time.perf_counter()
 
         infer_sovits = self.speaker_list[spk].sovits
         vq_model = infer_sovits.vq_model
         hps = infer_sovits.hps
-        zero_wav = np.zeros(
-            int(hps.data.sampling_rate * 0.3),
-            dtype=np.float16 if self.is_half == True else np.float32,
-        )
+        zero_wav = np.zeros(int(hps.data.sampling_rate * 0.3), dtype=np.float32)
         
         with torch.no_grad():
             wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-            wav16k = torch.from_numpy(wav16k)
-            zero_wav_torch = torch.from_numpy(zero_wav)
-            if self.is_half == True:
-                wav16k = wav16k.half().to(self.device)
-                zero_wav_torch = zero_wav_torch.half().to(self.device)
-            else:
-                wav16k = wav16k.to(self.device)
-                zero_wav_torch = zero_wav_torch.to(self.device)
-            wav16k = torch.cat([wav16k, zero_wav_torch])
-            ssl_content = self.ssl_model.model(wav16k.unsqueeze(0))[
-                "last_hidden_state"
-            ].transpose(
-                1, 2
-            )  
-            codes = vq_model.extract_latent(ssl_content)
+            wav16k = torch.from_numpy(np.concatenate([wav16k, zero_wav]))
+            wav16k = wav16k.to(device=self.device, dtype=self.precision.weight_dtype("hubert"))
+            with self.precision.autocast("hubert"):
+                ssl_content = self.ssl_model.model(wav16k.unsqueeze(0))[
+                    "last_hidden_state"
+                ].transpose(
+                    1, 2
+                )  
+            with self.precision.autocast("sovits"):
+                codes = vq_model.extract_latent(ssl_content.to(self.precision.weight_dtype("sovits")))
             prompt_semantic = codes[0, 0]
             prompt = prompt_semantic.unsqueeze(0).to(self.device)
             
             audio_token = tensor_to_audio_tokens(prompt)
             self.audio_token_cache[ref_wav_path] = audio_token
+            self._observe_stage("reference_tokens", start)
             return audio_token
     
     def get_sovits_weights(self, sovits_path, device="cpu"):
+        dtype = self.precision.weight_dtype("sovits")
+        if is_safetensors(sovits_path):
+            # Memory-mapped inference-only export, shared between processes via the page cache
+            vq_model, config = load_inference_model(sovits_path, self.device, dtype)
+            return Sovits(vq_model, DictToAttrRecursive(config))
         dict_s2 = torch.load(sovits_path, map_location=device)
+        if is_inference_checkpoint(dict_s2):
+            # Exported with python -m sovits.export: only the decode/extract_latent modules
+            vq_model, config = load_inference_model(dict_s2, self.device, dtype)
+            return Sovits(vq_model, DictToAttrRecursive(config))
         hps = dict_s2["config"]
         hps = DictToAttrRecursive(hps)
         hps.model.semantic_frame_rate = "25hz"
@@ -158,81 +264,195 @@ class Processor:
         )
         if ("pretrained" not in sovits_path):
             del vq_model.enc_q
-        if self.is_half == True:
-            vq_model = vq_model.half().to(self.device)
-        else:
-            vq_model = vq_model.to(self.device)
+        vq_model = vq_model.to(device=self.device, dtype=dtype)
         vq_model.eval()
         vq_model.load_state_dict(dict_s2["weight"], strict=False)
         sovits = Sovits(vq_model, hps)
         return sovits
 
-    def get_tts_wav(self, predict, vits_wav_path, prompt_text, prompt_language, text, text_language, speed=1, inp_refs=[], spk="default", scaling_factor=1.0):
+    def get_refers(self, paths, spk="default"):
+        hps = self.speaker_list[spk].sovits.hps
+        dtype = self.precision.weight_dtype("sovits")
+        refers = []
+        with torch.no_grad():
+            for path in paths:
+                refer = self.spec_cache.get(path)
+                if refer is None:
+                    self.cache_misses["spec"] += 1
+                    start = time.perf_counter()
+                    refer = get_spepc(hps, path).to(dtype).to(self.device)
+                    self.spec_cache[path] = refer
+                    self._observe_stage("reference_spectrogram", start)
+                else:
+                    self.cache_hits["spec"] += 1
+                refers.append(refer)
+        return refers
+
+    def get_tts_wav(self, predict, vits_wav_path, prompt_text, prompt_language, text, text_language, speed=1, inp_refs=[], spk="default", scaling_factor=1.0, cancel_event=None, media_type="wav", sample_rate=None):
+        # media_type "pcm" yields raw PCM per chunk regardless of stream_mode, e.g. to feed an encoder;
+        # sample_rate resamples the output, with one Resampler carrying its state across all segments
         infer_sovits = self.speaker_list[spk].sovits
         vq_model = infer_sovits.vq_model
         hps = infer_sovits.hps
 
-        dtype = torch.float16 if self.is_half == True else torch.float32
-        zero_wav = np.zeros(int(hps.data.sampling_rate * 0.3), dtype=np.float16 if self.is_half == True else np.float32)
-        refers=[]
-        with torch.no_grad():
-            for path in [vits_wav_path] + inp_refs:
-                # try:
-                    if path not in self.spec_cache:
-                        refer = get_spepc(hps, path).to(dtype).to(self.device)
-                        
-                        self.spec_cache[path] = refer
-                    else:
-                        refer = self.spec_cache[path]
-                    refers.append(refer)
-                # except Exception as e:
-                #     logging.error(e)
+        silence = silence_samples(hps.data.sampling_rate)
+        resampler = self._resampler(hps, sample_rate)
+        refers = self.get_refers([vits_wav_path] + inp_refs, spk)
         version = vq_model.version
         prompt_language = prompt_language.lower()
         text_language = text_language.lower()
         texts = text.split("\n")
-        audio_bytes = BytesIO()
+        # "close" mode keeps the converted segments until the WAV header can be written
+        segments = []
+
+        splits = {"，", "。", "？", "！", ",", ".", "?", "!", "~", ":", "：", "—", "…", }
+        held = 0
+        try:
+            for text in texts:
+                if cancel_event is not None and cancel_event.is_set():
+                    logging.info("synthesis cancelled, skipping remaining segments")
+                    return
+                if only_punc(text):
+                    continue
+
+                if (text[-1] not in splits): text += "。" if text_language != "en" else "."
+                phones2, _, _ = get_phone(text, text_language, version)
+                pred_token = parse_audio_tokens(predict)
+                pred_semantic = torch.LongTensor(pred_token).to(self.device).unsqueeze(0).unsqueeze(0)
+                start = time.perf_counter()
+                first = True
+                for audio, last in self._segment_chunks(vq_model, pred_semantic, phones2, refers, speed):
+                    self._observe_stage("sovits_decode", start, len(audio) / hps.data.sampling_rate)
+                    start = time.perf_counter()
+                    # Only a segment decoded in one piece is peak-normalized; decode_chunk_frames
+                    # windows are scaled and clipped alike, so there are no level steps between them
+                    whole, first = first and last, False
+                    if resampler is not None:
+                        # Resampled output carries the filter tail of the previous segment, so the
+                        # gain comes from the decoded segment itself (resampling is linear)
+                        gain = peak_gain(audio, scaling_factor) if whole else scaling_factor
+                        pcm = to_pcm(resampler.process(audio, silence if last else 0), gain, self.is_int32,
+                                     normalize=False)
+                    else:
+                        pcm = to_pcm(audio, scaling_factor, self.is_int32, silence if last else 0, normalize=whole)
+                    self._observe_stage("pack", start)
+                    if self.stream_mode == "normal" or media_type == "pcm":
+                        yield as_bytes(pcm)
+                    else:
+                        segments.append(pcm)
+                        held += self._add_buffer(pcm.nbytes)
+                    start = time.perf_counter()
+
+            if not self.stream_mode == "normal" and media_type == "wav":
+                yield from wav_chunks(segments, sample_rate or hps.data.sampling_rate, self.is_int32)
+        finally:
+            self._release_buffer(held)
+
+
+    def get_tts_wav_batch(self, items, speed=1, spk="default", scaling_factor=1.0, max_batch_size=8, sample_rate=None):
+        """
+        Decodes several (predict, vits_wav_path, text) items with shared reference work.
+        The reference embedding is computed once per distinct vits_wav_path, and items are
+        sorted by token length and decoded in padded micro-batches of max_batch_size.
+        :return: list of wav bytes, in the order of items
+        """
+        infer_sovits = self.speaker_list[spk].sovits
+        vq_model = infer_sovits.vq_model
+        hps = infer_sovits.hps
+        version = vq_model.version
 
         splits = {"，", "。", "？", "！", ",", ".", "?", "!", "~", ":", "：", "—", "…", }
-        for text in texts:
+        ge_cache = {}
+        entries = []
+        for index, (predict, vits_wav_path, text) in enumerate(items):
+            text = text.replace("\n", " ").strip()
             if only_punc(text):
+                entries.append((index, None, None, None))
                 continue
+            if (text[-1] not in splits): text += "."
+            phones, _, _ = get_phone(text, "en", version)
+            if vits_wav_path not in ge_cache:
+                with torch.no_grad(), self.precision.autocast("sovits"):
+                    ge_cache[vits_wav_path] = vq_model.get_ge(self.get_refers([vits_wav_path], spk))
+            entries.append((index, parse_audio_tokens(predict), phones, vits_wav_path))
 
-            audio_opt = []
-            if (text[-1] not in splits): text += "。" if text_language != "en" else "."
-            phones2, _, _ = get_phone(text, text_language, version)
-            pred_token = []
-            for item in re.findall(r"<\|.+?\|>", predict):
-                if item == "<|eot_id|>" or item == "<|audio_token_end|>":
-                    continue
-                pred_token.append(int(item.split("_")[-1].split("|>")[0]))
-            pred_semantic = torch.LongTensor(pred_token).to(self.device).unsqueeze(0).unsqueeze(0)
-            audio = vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(self.device).unsqueeze(0),
-                                refers,speed=speed).detach().cpu().numpy()[0, 0]
-            max_audio=np.abs(audio).max()
-            if max_audio>1:
-                audio /= max_audio
-            audio *= scaling_factor  # adjust volumn
-            audio = np.clip(audio, -1.0, 1.0)
-            audio_opt.append(audio)
-            audio_opt.append(zero_wav)
-            if self.is_int32:
-                audio_bytes = pack_audio(audio_bytes,(np.concatenate(audio_opt, 0) * 2147483647).astype(np.int32),hps.data.sampling_rate, self.is_int32)
-            else:
-                audio_bytes = pack_audio(audio_bytes,(np.concatenate(audio_opt, 0) * 32768).astype(np.int16),hps.data.sampling_rate, self.is_int32)
-            if self.stream_mode == "normal":
-                audio_bytes, audio_chunk = read_clean_buffer(audio_bytes)
-                yield audio_chunk
-        
-        if not self.stream_mode == "normal": 
-            audio_bytes = pack_wav(audio_bytes,hps.data.sampling_rate, self.is_int32)
-            yield audio_bytes.getvalue()
+        results = [None] * len(items)
+        valid = sorted((e for e in entries if e[1]), key=lambda e: len(e[1]))
+        for start in range(0, len(valid), max_batch_size):
+            chunk = valid[start:start + max_batch_size]
+            max_codes = max(len(e[1]) for e in chunk)
+            max_phones = max(len(e[2]) for e in chunk)
+            codes = torch.zeros(1, len(chunk), max_codes, dtype=torch.long)
+            text = torch.zeros(len(chunk), max_phones, dtype=torch.long)
+            for i, (_, pred_token, phones, _) in enumerate(chunk):
+                codes[0, i, :len(pred_token)] = torch.LongTensor(pred_token)
+                text[i, :len(phones)] = torch.LongTensor(phones)
+            code_lengths = torch.LongTensor([len(e[1]) for e in chunk]).to(self.device)
+            text_lengths = torch.LongTensor([len(e[2]) for e in chunk]).to(self.device)
+            ge = torch.cat([ge_cache[e[3]] for e in chunk], 0)
+            start = time.perf_counter()
+            with self.precision.autocast("sovits"):
+                audio, audio_lengths = vq_model.decode_batch(codes.to(self.device), code_lengths,
+                                                             text.to(self.device), text_lengths, ge, speed=speed)
+            audio = audio.detach().float().cpu().numpy()
+            self._observe_stage("sovits_decode", start, int(audio_lengths.sum()) / hps.data.sampling_rate)
+            start = time.perf_counter()
+            for i, entry in enumerate(chunk):
+                results[entry[0]] = self._pack_segment(audio[i, 0, :int(audio_lengths[i])], hps, scaling_factor,
+                                                       sample_rate)
+            self._observe_stage("pack", start)
+
+        for entry in entries:
+            if results[entry[0]] is None:
+                results[entry[0]] = self._pack_segment(np.zeros(0, dtype=np.float32), hps, scaling_factor, sample_rate)
+        return results
+
+    def get_tts_pcm(self, predict, vits_wav_path, text, speed=1, spk="default", scaling_factor=1.0):
+        """
+        Decodes a single segment and returns raw PCM as a bytes-like view (followed by 0.3s of silence),
+        without any container, so callers can append segments to a file incrementally.
+        """
+        vq_model = self.speaker_list[spk].sovits.vq_model
+        hps = self.speaker_list[spk].sovits.hps
+        text = text.replace("\n", " ").strip()
+        pred_token = parse_audio_tokens(predict)
+        if only_punc(text) or not pred_token:
+            return as_bytes(to_pcm(np.zeros(0, dtype=np.float32), silence=silence_samples(hps.data.sampling_rate),
+                                   is_int32=self.is_int32))
+        splits = {"，", "。", "？", "！", ",", ".", "?", "!", "~", ":", "：", "—", "…", }
+        if (text[-1] not in splits): text += "."
+        phones, _, _ = get_phone(text, "en", vq_model.version)
+        refers = self.get_refers([vits_wav_path], spk)
+        pred_semantic = torch.LongTensor(pred_token).to(self.device).unsqueeze(0).unsqueeze(0)
+        start = time.perf_counter()
+        audio = np.concatenate([chunk for chunk, _ in self._segment_chunks(vq_model, pred_semantic, phones, refers, speed)])
+        self._observe_stage("sovits_decode", start, len(audio) / hps.data.sampling_rate)
+        start = time.perf_counter()
+        pcm = as_bytes(to_pcm(audio, scaling_factor, self.is_int32, silence_samples(hps.data.sampling_rate)))
+        self._observe_stage("pack", start)
+        return pcm
+
+    @property
+    def sampling_rate(self):
+        return self.speaker_list["default"].sovits.hps.data.sampling_rate
+
+    def _resampler(self, hps, sample_rate):
+        if not sample_rate or sample_rate == hps.data.sampling_rate:
+            return None
+        return Resampler(hps.data.sampling_rate, sample_rate)
 
+    def _pack_segment(self, audio, hps, scaling_factor, sample_rate=None):
+        silence = silence_samples(hps.data.sampling_rate)
+        resampler = self._resampler(hps, sample_rate)
+        if resampler is None:
+            return wav_bytes(audio, hps.data.sampling_rate, scaling_factor, self.is_int32, silence)
+        return wav_bytes(resampler.process(audio, silence), sample_rate, peak_gain(audio, scaling_factor),
+                         self.is_int32, normalize=False)
 
-    def handle(self, pred_semantic, vits_wav_path, prompt_text, prompt_language, text, text_language, cut_punc, speed, inp_refs, scaling_factor):
+    def handle(self, pred_semantic, vits_wav_path, prompt_text, prompt_language, text, text_language, cut_punc, speed, inp_refs, scaling_factor, cancel_event=None, media_type="wav", sample_rate=None):
         if cut_punc == None:
             text = cut_text(text, self.default_cut_punc)
         else:
             text = cut_text(text, cut_punc)
-        res = self.get_tts_wav(pred_semantic, vits_wav_path, prompt_text, prompt_language, text, text_language, speed, inp_refs, scaling_factor=scaling_factor)
+        res = self.get_tts_wav(pred_semantic, vits_wav_path, prompt_text, prompt_language, text, text_language, speed, inp_refs, scaling_factor=scaling_factor, cancel_event=cancel_event, media_type=media_type, sample_rate=sample_rate)
         return res
\ No newline at end of file
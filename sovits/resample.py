@@ -0,0 +1,96 @@
+"""
+Streaming polyphase resampling of the decoder output.
+
+Converting from the model rate to an output rate with up / down = rate_out / rate_in (in
+lowest terms) is an upsample by `up`, a windowed-sinc lowpass and a downsample by `down`.
+The polyphase form only evaluates the filter taps that meet non-zero input samples at
+retained outputs. Kernels are built once per rate pair and cached; a Resampler carries the
+filter history and output phase from one segment to the next, so segments resampled one
+after another join exactly as if the whole stream had been resampled at once.
+"""
+import functools
+import math
+
+import numpy as np
+
+SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+# Filter half-length in input samples of the slower side, and Kaiser window shape;
+# the same defaults as scipy.signal.resample_poly
+HALF_LENGTH = 10
+KAISER_BETA = 5.0
+
+
+def check_rate(rate):
+    if rate not in SAMPLE_RATES:
+        raise ValueError(f"Unsupported sample_rate: {rate}. Expected one of {list(SAMPLE_RATES)}")
+
+
+def ratio(rate_in, rate_out):
+    divisor = math.gcd(rate_in, rate_out)
+    return rate_out // divisor, rate_in // divisor
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_kernel(up, down):
+    """
+    Lowpass for upsampling by `up` then downsampling by `down`, split into its `up` phases.
+    :return: (kernel [up, taps] with each phase time-reversed, prototype filter length)
+    """
+    length = 2 * HALF_LENGTH * max(up, down) + 1
+    cutoff = 0.5 / max(up, down)
+    n = np.arange(length) - (length - 1) / 2
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, KAISER_BETA)
+    prototype *= up / prototype.sum()
+    taps = -(-length // up)
+    padded = np.zeros(up * taps)
+    padded[:length] = prototype
+    # phase p holds prototype[p + j * up]; reversed so it lines up with ascending input
+    kernel = np.ascontiguousarray(padded.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+    kernel.flags.writeable = False
+    return kernel, length
+
+
+class Resampler:
+    def __init__(self, rate_in, rate_out):
+        self.rate_in = rate_in
+        self.rate_out = rate_out
+        self.up, self.down = ratio(rate_in, rate_out)
+        self.kernel, length = polyphase_kernel(self.up, self.down)
+        taps = self.kernel.shape[1]
+        # Zero history before the first sample; output time 0 sits at the filter centre
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.position = (taps - 1) * self.up + (length - 1) // 2
+
+    def process(self, audio, silence=0):
+        """
+        Resamples the next stretch of the stream.
+        :param audio: float32 numpy audio [T] at rate_in
+        :param silence: samples of silence at rate_in to append after audio
+        :return: float32 numpy audio at rate_out; output lags the input by half the filter
+                 length, which the following audio (or silence) flushes out
+        """
+        up, down = self.up, self.down
+        taps = self.kernel.shape[1]
+        buffer = np.empty(len(self.history) + len(audio) + silence, dtype=np.float32)
+        buffer[:len(self.history)] = self.history
+        buffer[len(self.history):len(buffer) - silence] = audio
+        buffer[len(buffer) - silence:] = 0
+
+        # Output m reads the input window ending at (position + m * down) // up
+        count = max(0, (len(buffer) * up - 1 - self.position) // down + 1)
+        out = np.zeros(count, dtype=np.float32)
+        for first in range(min(up, count)):
+            t = self.position + first * down
+            phase, end = t % up, t // up
+            # Outputs first, first + up, ... share a phase; their windows advance by `down`
+            n = len(range(first, count, up))
+            start = end - taps + 1
+            target = out[first::up]
+            for k, weight in enumerate(self.kernel[phase]):
+                target += weight * buffer[start + k:start + k + (n - 1) * down + 1:down]
+
+        self.position += count * down
+        drop = min(self.position // up - (taps - 1), len(buffer))
+        self.history = buffer[drop:].copy()
+        self.position -= drop * up
+        return out
@@ -13,6 +13,7 @@ import soundfile as sf
 from io import BytesIO
 from sovits.LangSegment import LangSegment
 import json
+import struct
 
 def clean_text_inf_normed_text(text, language, version):
     language = language.replace('all_', '')
@@ -54,6 +55,19 @@ def tensor_to_audio_tokens(tensor):
     result = "".join(tokens)
     return result
 
+def parse_audio_tokens(predict):
+    """
+    Parses the <|audio_token_x|> ids out of an LLM completion, skipping end markers.
+    :param predict: generated text
+    :return: list of integer token ids
+    """
+    pred_token = []
+    for item in re.findall(r"<\|.+?\|>", predict):
+        if item == "<|eot_id|>" or item == "<|audio_token_end|>":
+            continue
+        pred_token.append(int(item.split("_")[-1].split("|>")[0]))
+    return pred_token
+
 def cut_text(text, punc):
     punc_list = [p for p in punc if p in {",", ".", ";", "?", "!", "、", "，", "。", "？", "！", "；", "：", "…"}]
     if len(punc_list) > 0:
@@ -118,6 +132,18 @@ def pack_wav(audio_bytes, rate, is_int32=False):
         sf.write(wav_bytes, data, rate, format='WAV')
     return wav_bytes
 
+def wav_header(data_size, rate, is_int32=False):
+    """
+    Builds a 44-byte PCM WAV header for data_size bytes of mono audio.
+    """
+    sample_width = 4 if is_int32 else 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, rate, rate * sample_width, sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
 def pack_aac(audio_bytes, data, rate, is_int32=False):
     if is_int32:
         pcm = 's32le'
@@ -279,6 +305,39 @@ def clean_and_split_text(text):
 
 
 
+def is_committed_boundary(text, index):
+    """
+    Whether text[index] ends a sentence in incrementally received, not yet normalized text.
+    A period only counts when whitespace follows it, so decimals ("12.50"), URLs and dotted
+    abbreviations are never cut before get_normed_text has spelled them out.
+    """
+    ch = text[index]
+    if ch in "!?":
+        return True
+    if ch != '.':
+        return False
+    return index + 1 < len(text) and text[index + 1].isspace() and not should_skip_period(text, index)
+
+
+def split_committed_text(text):
+    """
+    Splits incrementally received text at the last sentence boundary that is already
+    followed by more text.
+    :return: (committed, remainder); committed is "" when no boundary is confirmed yet
+    """
+    # Same character class as clean_and_split_text; the substitution keeps positions aligned
+    cleaned_text = re.sub(r"[^\w\s\.,!?:']", " ", text)
+    boundaries = [i for i in range(len(cleaned_text)) if is_committed_boundary(cleaned_text, i)]
+    # A trailing "!" or "?" may still be followed by more punctuation
+    while boundaries and not cleaned_text[boundaries[-1] + 1:].strip():
+        boundaries.pop()
+    if not boundaries:
+        return "", text
+    last_boundary = boundaries[-1]
+    return text[:last_boundary + 1], text[last_boundary + 1:]
+
+
+
 def get_phone(text,language,version):
     if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
         language = language.replace("all_","")
@@ -0,0 +1,93 @@
+"""
+Memory-mapped weight loading.
+
+Safetensors files opened on the CPU are mapped read-only (copy-on-write) instead of being
+unpickled into private memory, so several worker processes on one host share the weight
+pages through the page cache as long as the weights are used in their stored dtype.
+
+    # HuBERT / Llama directories that only ship pytorch_model.bin
+    python -m sovits.weights --hf-dir pretrained_models/chinese-hubert-base
+    # SoVITS: export the inference-only artifact as .safetensors
+    python -m sovits.export --input .../sovits.pth --output .../sovits_infer.safetensors
+"""
+import argparse
+import contextlib
+import logging
+import os
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Cold-start time of each model load, in seconds
+LOAD_SECONDS = {}
+
+
+@contextlib.contextmanager
+def timed_load(name):
+    start = time.perf_counter()
+    yield
+    LOAD_SECONDS[name] = time.perf_counter() - start
+    logging.info(f"{name} loaded in {LOAD_SECONDS[name]:.2f}s")
+
+
+def is_safetensors(path):
+    return str(path).endswith(".safetensors")
+
+
+def has_safetensors(model_dir):
+    return os.path.exists(os.path.join(model_dir, "model.safetensors")) or \
+        os.path.exists(os.path.join(model_dir, "model.safetensors.index.json"))
+
+
+def pretrained_kwargs(model_dir):
+    """
+    from_pretrained arguments that load safetensors weights by mmap straight into an empty
+    model, instead of initializing it randomly and copying the weights over.
+    """
+    if not has_safetensors(model_dir):
+        return {}
+    return {"use_safetensors": True, "low_cpu_mem_usage": True}
+
+
+def save_safetensors(path, tensors, metadata=None):
+    from safetensors.torch import save_file
+    save_file({k: v.contiguous() for k, v in tensors.items()}, path, metadata=metadata)
+
+
+def load_safetensors(path, device="cpu"):
+    """
+    :return: (tensors dict, metadata dict); CPU tensors are backed by the file mapping
+    """
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    return load_file(path, device=str(device)), metadata
+
+
+def convert_hf_dir(model_dir, model_cls=None):
+    """Rewrites a transformers model directory with safetensors weights."""
+    if model_cls is None:
+        from transformers import AutoModel
+        model_cls = AutoModel
+    model = model_cls.from_pretrained(model_dir, local_files_only=True)
+    model.save_pretrained(model_dir, safe_serialization=True)
+    logging.info(f"wrote safetensors weights to {model_dir}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hf-dir", action="append", required=True,
+                        help="transformers model directory to convert (repeatable)")
+    parser.add_argument("--causal-lm", action="store_true", help="load the directories as causal LMs (Llama)")
+    args = parser.parse_args(argv)
+    model_cls = None
+    if args.causal_lm:
+        from transformers import AutoModelForCausalLM
+        model_cls = AutoModelForCausalLM
+    for model_dir in args.hf_dir:
+        convert_hf_dir(model_dir, model_cls)
+
+
+if __name__ == "__main__":
+    main()
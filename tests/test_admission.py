@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from inference.admission import AdmissionController, AdmissionRejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_within_budget_and_release_restores_it():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=4, max_inflight_audio_seconds=10.0)
+        first = await controller.acquire(2, 3.0)
+        second = await controller.acquire(2, 3.0)
+        assert controller.stats() == {"inflight_requests": 2, "inflight_sentences": 4,
+                                      "inflight_audio_seconds": 6.0, "queued": 0}
+        controller.release(first)
+        controller.release(first)  # releasing twice is a no-op
+        controller.release(second)
+        assert controller.stats() == {"inflight_requests": 0, "inflight_sentences": 0,
+                                      "inflight_audio_seconds": 0.0, "queued": 0}
+    run(scenario())
+
+
+def test_oversized_request_runs_alone():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=2, max_inflight_audio_seconds=1.0)
+        ticket = await controller.acquire(10, 100.0)
+        assert controller.inflight_requests == 1
+        controller.release(ticket)
+    run(scenario())
+
+
+def test_queued_requests_are_admitted_in_order_on_release():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=2, max_queue=4, default_deadline=5.0)
+        running = await controller.acquire(2, 1.0)
+        admitted = []
+
+        async def waiter(name):
+            ticket = await controller.acquire(1, 1.0)
+            admitted.append(name)
+            return ticket
+
+        tasks = [asyncio.create_task(waiter(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0.01)
+        assert admitted == [] and controller.stats()["queued"] == 3
+
+        controller.release(running)
+        await asyncio.sleep(0.01)
+        # Two sentences of budget fit the first two waiters, the third keeps waiting
+        assert admitted == ["a", "b"] and controller.stats()["queued"] == 1
+
+        controller.release(await tasks[0])
+        tickets = await asyncio.gather(*tasks[1:])
+        assert admitted == ["a", "b", "c"]
+        for ticket in tickets:
+            controller.release(ticket)
+        assert controller.inflight_requests == 0
+    run(scenario())
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=1, max_queue=1, default_deadline=5.0)
+        running = await controller.acquire(1, 2.0)
+        queued = asyncio.create_task(controller.acquire(1, 2.0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(1, 2.0)
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+        controller.release(running)
+        controller.release(await queued)
+    run(scenario())
+
+
+def test_deadline_expiring_in_queue_is_rejected_with_503():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=1, max_queue=4)
+        running = await controller.acquire(1, 1.0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(1, 1.0, deadline=0.05)
+        assert rejected.value.status_code == 503
+        # The expired waiter is gone and takes no budget once the running request ends
+        assert controller.stats()["queued"] == 0
+        controller.release(running)
+        assert controller.inflight_requests == 0
+    run(scenario())
+
+
+def test_predicted_wait_beyond_deadline_is_shed_immediately():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=1, max_queue=4, default_deadline=60.0)
+        running = await controller.acquire(1, 1.0)
+        queued = asyncio.create_task(controller.acquire(1, 1.0, service_seconds=10.0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(1, 1.0, deadline=5.0)
+        assert rejected.value.status_code == 503
+        assert controller.stats()["queued"] == 1
+        controller.release(running)
+        controller.release(await queued)
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=1, max_queue=4, default_deadline=5.0)
+        running = await controller.acquire(1, 1.0)
+        queued = asyncio.create_task(controller.acquire(1, 1.0))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert controller.stats()["queued"] == 0
+        controller.release(running)
+        assert controller.inflight_requests == 0
+    run(scenario())
+
+
+def test_release_from_worker_thread():
+    async def scenario():
+        controller = AdmissionController(max_inflight_sentences=1, max_queue=4, default_deadline=5.0)
+        running = await controller.acquire(1, 1.0)
+        queued = asyncio.create_task(controller.acquire(1, 1.0))
+        await asyncio.sleep(0.01)
+        await asyncio.to_thread(controller.release, running)
+        controller.release(await asyncio.wait_for(queued, 1.0))
+        assert controller.inflight_requests == 0
+    run(scenario())
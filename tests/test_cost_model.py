@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from inference.cost_model import AUDIO_TOKENS_PER_SECOND, CostModel
+
+
+def test_predict_from_phone_counts():
+    model = CostModel(tokens_per_phone=2.0, llm_seconds_per_token=0.01, decode_seconds_per_audio_second=0.1)
+    estimate = model.predict([10, 40], speed=2.0)
+    assert estimate.sentences == 2
+    assert estimate.phones == 50
+    assert estimate.audio_tokens == 100
+    assert estimate.audio_seconds == pytest.approx(100 / AUDIO_TOKENS_PER_SECOND / 2.0)
+    # Sentences go to the LLM in parallel, so only the longest one counts
+    assert estimate.llm_seconds == pytest.approx(0.01 * 80)
+    assert estimate.decode_seconds == pytest.approx(0.1 * estimate.audio_seconds)
+    assert estimate.total_seconds == pytest.approx(estimate.llm_seconds + estimate.decode_seconds)
+
+
+def test_empty_request_costs_nothing():
+    estimate = CostModel().predict([])
+    assert estimate.to_dict() == {"sentences": 0, "phones": 0, "audio_tokens": 0.0, "audio_seconds": 0.0,
+                                  "llm_seconds": 0.0, "decode_seconds": 0.0}
+
+
+def test_coefficients_converge_to_observed_ratios():
+    model = CostModel(tokens_per_phone=2.0, llm_seconds_per_token=0.01,
+                      decode_seconds_per_audio_second=0.1, smoothing=0.1)
+    for _ in range(100):
+        model.observe_tokens(100, 350)
+        model.observe_llm(200, 4.0)
+        model.observe_decode(10.0, 0.5)
+    coefficients = model.coefficients()
+    assert coefficients["tokens_per_phone"] == pytest.approx(3.5, rel=1e-3)
+    assert coefficients["llm_seconds_per_token"] == pytest.approx(0.02, rel=1e-3)
+    assert coefficients["decode_seconds_per_audio_second"] == pytest.approx(0.05, rel=1e-3)
+
+
+def test_single_observation_moves_by_smoothing():
+    model = CostModel(tokens_per_phone=2.0, smoothing=0.25)
+    model.observe_tokens(10, 60)
+    assert model.tokens_per_phone == pytest.approx(0.75 * 2.0 + 0.25 * 6.0)
+
+
+def test_empty_observations_are_ignored():
+    model = CostModel()
+    before = model.coefficients()
+    model.observe_tokens(0, 10)
+    model.observe_tokens(10, 0)
+    model.observe_llm(0, 1.0)
+    model.observe_decode(0.0, 1.0)
+    assert model.coefficients() == before
+
+
+def test_concurrent_observations_converge():
+    model = CostModel(tokens_per_phone=2.0, smoothing=0.05)
+
+    def observe():
+        for _ in range(500):
+            model.observe_tokens(10, 40)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.tokens_per_phone == pytest.approx(4.0, rel=1e-6)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from inference.jobs import JOB_COMPLETED, JOB_RUNNING, JobStore, JobWorkerPool
+from sovits.output import WAV_HEADER_SIZE
+from sovits.utils import wav_header
+
+RATE = 24000
+PARAMS = {
+    "priority": "bulk",
+    "ref_wav_path": "ref.wav",
+    "prompt_text": "prompt",
+    "temperature": 1.0,
+    "repetition_penalty": 1.0,
+    "speed": 1.0,
+    "scaling_factor": 1.0,
+}
+SENTENCES = ["first sentence.", "second sentence.", "third sentence."]
+
+
+def pcm_of(sentence):
+    # Distinct, even-length PCM per sentence
+    return sentence.encode() * 2
+
+
+class StubTTS:
+    """Stands in for Inference: generate_sentence_pcm returns fixed PCM and can fail once."""
+    def __init__(self, fail_on=None):
+        self.sovits_processor = SimpleNamespace(sampling_rate=RATE, is_int32=False)
+        self.fail_on = fail_on
+        self.calls = []
+
+    async def generate_sentence_pcm(self, ref_wav_path, prompt_text, sentence, **kwargs):
+        self.calls.append(sentence)
+        if sentence == self.fail_on:
+            raise RuntimeError("worker interrupted")
+        return pcm_of(sentence)
+
+
+def test_job_resumes_from_checkpoint(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    output_dir = str(tmp_path / "jobs")
+
+    store = JobStore(db_path, output_dir)
+    job_id = store.create(PARAMS, SENTENCES)
+    store.set_status(job_id, JOB_RUNNING)
+    interrupted = StubTTS(fail_on=SENTENCES[1])
+    with pytest.raises(RuntimeError):
+        asyncio.run(JobWorkerPool(interrupted, store)._run(job_id))
+    assert interrupted.calls == SENTENCES[:2]
+    # A crash while writing leaves bytes past the last checkpoint
+    with open(store.output_path(job_id), "ab") as f:
+        f.write(b"partial")
+
+    # A restarted server reopens the database and picks the job up again
+    store = JobStore(db_path, output_dir)
+    assert store.pending() == [job_id]
+    job = store.get(job_id)
+    assert job["done"] == 1
+    assert job["bytes_written"] == len(pcm_of(SENTENCES[0]))
+
+    resumed = StubTTS()
+    asyncio.run(JobWorkerPool(resumed, store)._run(job_id))
+    assert resumed.calls == SENTENCES[1:]
+
+    job = store.get(job_id)
+    assert job["status"] == JOB_COMPLETED
+    assert job["done"] == len(SENTENCES)
+    pcm = b"".join(pcm_of(sentence) for sentence in SENTENCES)
+    assert job["bytes_written"] == len(pcm)
+    with open(store.output_path(job_id), "rb") as f:
+        data = f.read()
+    assert data[:WAV_HEADER_SIZE] == wav_header(len(pcm), RATE)
+    assert data[WAV_HEADER_SIZE:] == pcm
+    assert os.path.getsize(store.output_path(job_id)) == WAV_HEADER_SIZE + len(pcm)
+
+
+def test_completed_job_is_not_rerun(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "jobs"))
+    job_id = store.create(PARAMS, SENTENCES[:1])
+    tts = StubTTS()
+    asyncio.run(JobWorkerPool(tts, store)._run(job_id))
+    asyncio.run(JobWorkerPool(tts, store)._run(job_id))
+    assert tts.calls == SENTENCES[:1]
+    assert store.pending() == []
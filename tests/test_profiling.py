@@ -0,0 +1,69 @@
+import json
+import threading
+import time
+
+import pytest
+
+from inference import profiling
+from inference.profiling import Profiler
+
+
+class Target:
+    def run(self, x):
+        return x * 2
+
+
+def wait_disarmed(profiler, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while profiler.session is not None:
+        assert time.monotonic() < deadline, "profile session was not disarmed by its timer"
+        time.sleep(0.01)
+    # disarm clears the session before it writes the files
+    while profiler.last_result is None:
+        assert time.monotonic() < deadline, "profile session did not write its result"
+        time.sleep(0.01)
+    return profiler.last_result
+
+
+def test_sampling_session_disarms_from_timer(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path))
+    profiler.arm(seconds=0.1, mode="sampling", interval=0.001)
+    result = wait_disarmed(profiler)
+    assert [f.endswith(".collapsed.txt") for f in result["files"]] == [True]
+    assert (tmp_path / f"{result['id']}.json").exists()
+
+
+def test_second_arm_is_rejected(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path))
+    profiler.arm(seconds=10, mode="sampling")
+    try:
+        with pytest.raises(RuntimeError):
+            profiler.arm(seconds=10, mode="sampling")
+    finally:
+        profiler.disarm()
+    assert profiler.session is None
+
+
+def test_torch_session_disarms_from_timer(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    monkeypatch.setattr(profiling, "PROFILE_TARGETS", [(__name__, "Target", "run", "Target.run")])
+    original = Target.__dict__["run"]
+    profiler = Profiler(output_dir=str(tmp_path))
+
+    # Armed here, disarmed by the session's threading.Timer
+    profiler.arm(seconds=0.5, mode="torch")
+    assert Target.__dict__["run"] is not original
+
+    # Work on another thread, like SoVITS decode on an asyncio.to_thread worker
+    worker = threading.Thread(target=Target().run, args=(torch.ones(64, 64),))
+    worker.start()
+    worker.join()
+
+    result = wait_disarmed(profiler)
+    assert Target.__dict__["run"] is original
+    trace_files = [f for f in result["files"] if f.endswith(".trace.json")]
+    assert len(trace_files) == 1
+    with open(trace_files[0]) as f:
+        events = json.load(f)["traceEvents"]
+    if hasattr(torch._C._autograd, "_enable_profiler_on_thread"):
+        assert any(event.get("name") == "Target.run" for event in events)
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from inference.scheduler import PriorityScheduler, lane_weights_from_env
+
+
+async def grant_order(scheduler, waiters, delay=0.0):
+    """
+    Queues waiters (name, lane, cost) behind a held slot, then releases it and returns the
+    order in which the waiters were granted; each releases its slot as soon as it gets it.
+    """
+    order = []
+
+    async def waiter(name, lane, cost):
+        async with scheduler.slot(lane, cost):
+            order.append(name)
+
+    await scheduler.acquire("interactive")
+    tasks = []
+    for name, lane, cost in waiters:
+        tasks.append(asyncio.create_task(waiter(name, lane, cost)))
+        await asyncio.sleep(delay)
+    await asyncio.sleep(0.01)
+    scheduler.release("interactive")
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_lane_weights_share_slots():
+    scheduler = PriorityScheduler("test", 1, {"interactive": 4, "bulk": 1}, aging_rate=0.0)
+    waiters = [(f"i{i}", "interactive", 0.0) for i in range(8)] + [(f"b{i}", "bulk", 0.0) for i in range(8)]
+    order = asyncio.run(grant_order(scheduler, waiters))
+    # Bulk gets one slot for every four interactive ones while both lanes are waiting
+    for start in range(0, 10, 5):
+        window = order[start:start + 5]
+        assert sum(name.startswith("b") for name in window) == 1, order
+    assert sorted(order) == sorted(name for name, _, _ in waiters)
+    stats = scheduler.lane_stats()
+    assert stats["interactive"]["granted"] == 9 and stats["bulk"]["granted"] == 8
+    assert all(lane["queued"] == 0 and lane["running"] == 0 for lane in stats.values())
+
+
+def test_idle_lane_does_not_bank_credit():
+    scheduler = PriorityScheduler("test", 1, {"interactive": 1, "bulk": 1}, aging_rate=0.0)
+
+    async def scenario():
+        # Bulk runs alone for a while, then interactive work arrives
+        for _ in range(5):
+            async with scheduler.slot("bulk"):
+                pass
+        return await grant_order(scheduler, [("b", "bulk", 0.0), ("i", "interactive", 0.0),
+                                             ("b2", "bulk", 0.0), ("i2", "interactive", 0.0)])
+    order = asyncio.run(scenario())
+    # Equal weights alternate; bulk's earlier solo run is not held against it beyond the current round
+    assert order[:2] in (["b", "i"], ["i", "b"])
+    assert {order[2], order[3]} == {"b2", "i2"}
+
+
+def test_shortest_job_first_within_a_lane():
+    scheduler = PriorityScheduler("test", 1, {"interactive": 1}, aging_rate=0.0)
+    order = asyncio.run(grant_order(scheduler, [("long", "interactive", 5.0), ("short", "interactive", 1.0),
+                                                ("medium", "interactive", 3.0)]))
+    assert order == ["short", "medium", "long"]
+
+
+def test_aging_lets_a_long_waiter_overtake():
+    waiters = [("old_long", "interactive", 10.0), ("new_short", "interactive", 1.0)]
+    fresh = PriorityScheduler("test", 1, {"interactive": 1}, aging_rate=0.0)
+    assert asyncio.run(grant_order(fresh, waiters, delay=0.05)) == ["new_short", "old_long"]
+    # 0.05 s of waiting at 1000 cost-seconds per second outweighs the 9 s cost difference
+    aged = PriorityScheduler("test", 1, {"interactive": 1}, aging_rate=1000.0)
+    assert asyncio.run(grant_order(aged, waiters, delay=0.05)) == ["old_long", "new_short"]
+
+
+def test_cancelled_waiter_is_removed():
+    scheduler = PriorityScheduler("test", 1, {"interactive": 1})
+
+    async def scenario():
+        await scheduler.acquire("interactive")
+        waiter = asyncio.create_task(scheduler.acquire("interactive"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release("interactive")
+    asyncio.run(scenario())
+    assert scheduler.running == 0
+    assert scheduler.lane_stats()["interactive"]["queued"] == 0
+
+
+def test_unknown_lane_is_rejected():
+    scheduler = PriorityScheduler("test", 1)
+    with pytest.raises(ValueError):
+        scheduler.check_lane("urgent")
+
+
+def test_lane_weights_from_env(monkeypatch):
+    monkeypatch.setenv("TTS_LANE_WEIGHTS", "interactive:4, bulk:0.5")
+    assert lane_weights_from_env() == {"interactive": 4.0, "bulk": 0.5}
+    monkeypatch.delenv("TTS_LANE_WEIGHTS")
+    assert lane_weights_from_env() == {"interactive": 8, "bulk": 1}
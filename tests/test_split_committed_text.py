@@ -0,0 +1,41 @@
+import pytest
+
+from sovits.utils import split_committed_text
+
+
+@pytest.mark.parametrize("text", [
+    "The total is 12.50 dollars and",
+    "Pi is roughly 3.14159 so",
+    "The price is 12.",
+])
+def test_decimal_point_is_not_a_boundary(text):
+    assert split_committed_text(text) == ("", text)
+
+
+@pytest.mark.parametrize("text", [
+    "Visit example.com today",
+    "Mail me at jane.doe@example.org when",
+    "Download it from https://www.example.com/docs/index.html and",
+])
+def test_url_is_not_a_boundary(text):
+    assert split_committed_text(text) == ("", text)
+
+
+@pytest.mark.parametrize("text, committed", [
+    ("Mr. Smith arrived. Then he", "Mr. Smith arrived."),
+    ("Dr. Jones met Mrs. Lee. They", "Dr. Jones met Mrs. Lee."),
+    ("I saw J. Doe. He left", "I saw J. Doe."),
+    ("We met on Main St. near", ""),
+])
+def test_abbreviation_is_not_a_boundary(text, committed):
+    assert split_committed_text(text) == (committed, text[len(committed):])
+
+
+def test_commits_up_to_last_confirmed_boundary():
+    assert split_committed_text("Hello there. How are you? I am") == ("Hello there. How are you?", " I am")
+
+
+def test_trailing_boundary_waits_for_more_text():
+    assert split_committed_text("Wait!") == ("", "Wait!")
+    assert split_committed_text("Done. ") == ("", "Done. ")
+    assert split_committed_text("Really?! Yes") == ("Really?!", " Yes")
@@ -19,7 +19,8 @@ async def main(model_type, model_path):
         output_path = "logs/tts.wav"
         os.makedirs("logs", exist_ok=True)
         with open(output_path, "wb") as f:
-            f.write(next(wavs))  
+            for chunk in wavs:
+                f.write(chunk)
         logging.info(f"语音生成成功，保存在 {output_path}")
     except Exception as e:
         logging.error(f"TTS生成过程中出错: {str(e)}")